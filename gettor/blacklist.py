@@ -12,16 +12,22 @@
 
 import os
 import time
+import atexit
 import logging
-import sqlite3
-import datetime
+import threading
+import collections
 import ConfigParser
 
 import db
+import bloom
 import utils
 
 """Blacklist module for managing blacklisting of users."""
 
+# filter of blocked users, see BlockedUsers
+BLOOM_ERROR_RATE = 0.001
+BLOOM_CHECK_INTERVAL = 30
+
 
 class BlacklistError(Exception):
     pass
@@ -35,12 +41,306 @@ class InternalError(Exception):
     pass
 
 
+class BlockedUsers(object):
+    """Know which users might be permanently blocked without a query.
+
+    The blocked users are kept in a Bloom filter, so if a user isn't in it
+    we know for sure it isn't blocked. The filter is built again when the
+    version of the users table changes (see db.DB.get_version()), which is
+    checked at most every check_interval seconds.
+
+    Public methods:
+
+        might_be_blocked(): Check if a user might be blocked.
+        stats(): Get the size and false positive rate of the filter.
+
+    """
+
+    def __init__(self, db_obj, error_rate, check_interval, log):
+        """Create a new object.
+
+        The filter is built the first time it's needed.
+
+        :param: db_obj (object) the db.DB object of the users table.
+        :param: error_rate (float) maximum rate of false positives.
+        :param: check_interval (int) seconds between checks of the version
+                of the users table.
+        :param: log (object) the logger.
+
+        """
+        self.db = db_obj
+        self.error_rate = error_rate
+        self.check_interval = check_interval
+        self.log = log
+
+        self.filter = None
+        self.version = None
+        self.checked = 0
+        self.lock = threading.Lock()
+
+    def _refresh(self):
+        """Build the filter again if the blocked users have changed.
+
+        :raise: db.DBError if the blocked users can't be read.
+
+        """
+        now = time.time()
+        if self.filter is not None and \
+                now - self.checked < self.check_interval:
+            return
+
+        with self.lock:
+            if self.filter is not None and \
+                    now - self.checked < self.check_interval:
+                return
+
+            version = self.db.get_version()
+            if self.filter is None or version != self.version:
+                users = self.db.get_blocked_users()
+                # leave room for more blocked users until the next build
+                blocked = bloom.BloomFilter(len(users) * 2, self.error_rate)
+                for user, service in users:
+                    blocked.add(self._get_key(user, service))
+                self.filter = blocked
+                self.version = version
+                self.log.info(
+                    "Filter of blocked users built: %d users, false positive"
+                    " rate %f" % (len(blocked), blocked.false_positive_rate())
+                )
+            self.checked = now
+
+    def _get_key(self, user, service):
+        """Get the string representing a user in the filter."""
+        return ("%s:%s" % (user, service)).encode('utf-8')
+
+    def might_be_blocked(self, user, service):
+        """Check if a user might be blocked.
+
+        :param: user (string) unique (hashed) string that represents the user.
+        :param: service (string) the service related to the user (e.g. SMTP).
+
+        :raise: db.DBError if the blocked users can't be read.
+
+        :return: (bool) false if the user is not blocked for sure, true if
+                 it might be.
+
+        """
+        self._refresh()
+        return self._get_key(user, service) in self.filter
+
+    def stats(self):
+        """Get the size and false positive rate of the filter.
+
+        :return: (dict) blocked users in the filter ('users'), bits and
+                 hashes of the filter, estimated 'false_positive_rate' and
+                 'version' of the users table.
+
+        """
+        blocked = self.filter
+        if blocked is None:
+            return {}
+        return {
+            'users': len(blocked),
+            'bits': blocked.size,
+            'hashes': blocked.hashes,
+            'false_positive_rate': blocked.false_positive_rate(),
+            'version': self.version
+        }
+
+
+class UserCache(object):
+    """Count the requests of users in memory.
+
+    The counters of the users seen recently are kept in a LRU cache and
+    checked exactly like db.DB.check_user() does, but without touching
+    the database. A user is read from the database only the first time
+    it's seen (or after being evicted), and the changed counters are
+    saved in batches every flush_interval seconds.
+
+    The blocked flag of a cached user is checked against the filter of
+    blocked users (see BlockedUsers), and read again from the database
+    only if the filter says the user might be blocked, at most once every
+    flush_interval seconds. Counters are kept per process: this is meant
+    for long running services (e.g. the SMTP daemon), not for a process
+    per request.
+
+    Public methods:
+
+        check_user(): Count a request of a user and check if it's allowed.
+        flush(): Save the changed counters to the database.
+
+    """
+
+    def __init__(self, db_obj, blocked, size, flush_interval, log):
+        """Create a new cache.
+
+        :param: db_obj (object) the db.DB object of the users table.
+        :param: blocked (object) the BlockedUsers filter.
+        :param: size (int) maximum number of users kept in memory.
+        :param: flush_interval (int) seconds between saves of the counters.
+        :param: log (object) logger for the counters that can't be saved.
+
+        """
+        self.db = db_obj
+        self.blocked = blocked
+        self.size = size
+        self.flush_interval = flush_interval
+        self.log = log
+
+        # (user, service) -> user info, least recently used first
+        self.users = collections.OrderedDict()
+        # changed users evicted before being saved
+        self.evicted = {}
+        self.last_flush = time.time()
+        self.lock = threading.Lock()
+
+    def _load(self, key, now):
+        """Read a user from the database.
+
+        :param: key (tuple) the user and service.
+        :param: now (float) the current time.
+
+        :return: (dict) the user info, new if the user isn't in the
+                 database.
+
+        """
+        row = self.db.get_user(*key)
+        if row is None:
+            return {
+                'times': 0,
+                'blocked': 0,
+                'last_request': now,
+                'checked': now,
+                'dirty': False
+            }
+
+        return {
+            'times': row['times'],
+            'blocked': row['blocked'],
+            'last_request': float(row['last_request']),
+            'checked': now,
+            'dirty': False
+        }
+
+    def _get(self, key, now):
+        """Get a user from the cache, reading it if necessary.
+
+        :param: key (tuple) the user and service.
+        :param: now (float) the current time.
+
+        :return: (dict) the user info.
+
+        """
+        info = self.users.pop(key, None)
+        if info is None:
+            info = self.evicted.pop(key, None)
+        if info is None:
+            info = self._load(key, now)
+        elif not self.blocked.might_be_blocked(*key):
+            # blocked users are always in the filter
+            info['blocked'] = 0
+        elif now - info['checked'] > self.flush_interval:
+            row = self.db.get_user(*key)
+            if row is not None:
+                info['blocked'] = row['blocked']
+            info['checked'] = now
+
+        # most recently used go last
+        self.users[key] = info
+        while len(self.users) > self.size:
+            old_key, old_info = self.users.popitem(last=False)
+            if old_info['dirty']:
+                self.evicted[old_key] = old_info
+        return info
+
+    def check_user(self, user, service, max_req, wait_time):
+        """Count a request of a user and check if it should be served.
+
+        See db.DB.check_user(), the rules are the same.
+
+        :param: user (string) unique (hashed) string that represents the user.
+        :param: service (string) the service related to the user (e.g. SMTP).
+        :param: max_req (int) maximum number of requests a user can make
+                in a row.
+        :param: wait_time (int) minutes the user must wait after reaching
+                max_req requests.
+
+        :raise: db.DBError if the user can't be read. If the counters
+                can't be saved they are kept for the next flush, and the
+                verdict is returned anyway.
+
+        :return: (string/None) db.BLOCKED, db.THROTTLED or None.
+
+        """
+        now = time.time()
+        verdict = None
+
+        with self.lock:
+            info = self._get((user, service), now)
+
+            times = info['times'] + 1
+            if info['blocked']:
+                verdict = db.BLOCKED
+            elif info['times'] >= max_req:
+                if now < info['last_request'] + wait_time * 60:
+                    verdict = db.THROTTLED
+                else:
+                    # fresh user again!
+                    times = 1
+
+            info['times'] = times
+            info['last_request'] = now
+            info['dirty'] = True
+
+        if now - self.last_flush > self.flush_interval:
+            try:
+                self.flush()
+            except db.DBError as e:
+                self.log.error("Couldn't save request counters: %s" % str(e))
+        return verdict
+
+    def flush(self):
+        """Save the changed counters to the database.
+
+        :raise: db.DBError if the counters can't be saved. They are kept
+                and saved with the next flush.
+
+        """
+        with self.lock:
+            self.last_flush = time.time()
+            changed = self.evicted
+            self.evicted = {}
+            for key, info in self.users.items():
+                if info['dirty']:
+                    changed[key] = info
+                    info['dirty'] = False
+
+        if not changed:
+            return
+
+        rows = [
+            (key[0], key[1], info['times'], info['last_request'])
+            for key, info in changed.items()
+        ]
+        try:
+            self.db.save_users(rows)
+        except db.DBError:
+            with self.lock:
+                for key, info in changed.items():
+                    info['dirty'] = True
+                    if key not in self.users:
+                        self.evicted.setdefault(key, info)
+            raise
+
+
 class Blacklist(object):
     """Manage blacklisting of users.
 
     Public methods:
 
         is_blacklisted(): Check if someone is blacklisted.
+        flush(): Save the request counters kept in memory (if any).
+        stats(): Get the stats of the filter of blocked users.
 
     Exceptions:
 
@@ -75,6 +375,23 @@ class Blacklist(object):
             loglevel = config.get('log', 'level')
             self.db = db.DB(dbname)
 
+            # optional in-memory counters, see UserCache
+            self.cache_size = None
+            if config.has_section('cache'):
+                self.cache_size = int(config.get('cache', 'size'))
+                self.flush_interval = config.get('cache', 'flush_interval')
+                self.flush_interval = int(self.flush_interval)
+
+            self.bloom_error_rate = BLOOM_ERROR_RATE
+            self.bloom_check_interval = BLOOM_CHECK_INTERVAL
+            if config.has_section('bloom'):
+                self.bloom_error_rate = config.get('bloom', 'error_rate')
+                self.bloom_error_rate = float(self.bloom_error_rate)
+                self.bloom_check_interval = config.get(
+                    'bloom', 'check_interval'
+                )
+                self.bloom_check_interval = int(self.bloom_check_interval)
+
         except ConfigParser.Error as e:
             raise ConfigError("%s" % e)
         except db.Exception as e:
@@ -97,6 +414,26 @@ class Blacklist(object):
         log.propagate = False
         self.log = log
 
+        # checked first on every request, with or without the cache
+        self.blocked = BlockedUsers(
+            self.db,
+            self.bloom_error_rate,
+            self.bloom_check_interval,
+            self.log
+        )
+
+        self.cache = None
+        if self.cache_size is not None:
+            self.cache = UserCache(
+                self.db,
+                self.blocked,
+                self.cache_size,
+                self.flush_interval,
+                self.log
+            )
+            # don't lose the counters not saved yet
+            atexit.register(self.flush)
+
     def is_blacklisted(self, user, service, max_req, wait_time):
         """Check if a user is blacklisted.
 
@@ -117,44 +454,57 @@ class Blacklist(object):
                 making requests again after 'max_req' requests is reached.
                 For now this is considered in minutes.
 
+        Permanently blocked users are looked for in a filter first (see
+        BlockedUsers). With the cache, requests of users not in the filter
+        don't touch the database at all. Without it the request still has
+        to be counted in the database, but that's a single UPDATE.
+
         :raise: BlacklistError if the user is blacklisted
 
         """
         try:
-            self.log.info("Trying to get info from user")
+            self.log.info("Checking requests from user")
             self.db.connect()
-            r = self.db.get_user(user, service)
-            if r:
-                # permanently blacklisted
-                if r['blocked']:
-                    self.log.warning("Request from user permanently blocked")
-                    self.db.update_user(user, service, r['times']+1, 1)
-                    raise BlacklistError("Blocked user")
-                # don't be greedy
-                elif r['times'] >= max_req:
-                    last = datetime.datetime.fromtimestamp(
-                        float(r['last_request'])
-                    )
-                    next = last + datetime.timedelta(minutes=wait_time)
-
-                    if datetime.datetime.now() < next:
-                        self.log.warning("Too many requests from same user")
-                        self.db.update_user(user, service, r['times']+1, 0)
-                        raise BlacklistError("Too many requests")
-                    else:
-                        # fresh user again!
-                        self.log.info("Updating counter for existing user")
-                        self.db.update_user(user, service, 1, 0)
-                else:
-                    # adding up a request for user
-                    self.log.info("Request from existing user")
-                    self.db.update_user(user, service, r['times']+1, 0)
+            if self.cache is not None:
+                verdict = self.cache.check_user(
+                    user, service, max_req, wait_time
+                )
             else:
-                # new request for user
-                self.log.info("Request from new user")
-                self.db.add_user(user, service, 0)
+                verdict = self.db.check_user(
+                    user, service, max_req, wait_time,
+                    self.blocked.might_be_blocked(user, service)
+                )
         except db.DBError as e:
             self.log.error("Something failed!")
             raise InternalError("Error with database (%s)" % str(e))
-        except BlacklistError as e:
-            raise BlacklistError(e)
+
+        if verdict == db.BLOCKED:
+            self.log.warning("Request from user permanently blocked")
+            raise BlacklistError("Blocked user")
+        elif verdict == db.THROTTLED:
+            self.log.warning("Too many requests from same user")
+            raise BlacklistError("Too many requests")
+
+    def flush(self):
+        """Save the request counters kept in memory (if any).
+
+        :raise: InternalError if the counters can't be saved.
+
+        """
+        if self.cache is None:
+            return
+
+        try:
+            self.cache.flush()
+        except db.DBError as e:
+            self.log.error("Couldn't save request counters: %s" % str(e))
+            raise InternalError("Error with database (%s)" % str(e))
+
+    def stats(self):
+        """Get the stats of the filter of blocked users.
+
+        :return: (dict) see BlockedUsers.stats(), empty until the filter is
+                 first used.
+
+        """
+        return self.blocked.stats()
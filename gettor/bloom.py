@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of GetTor, a Tor Browser distribution system.
+#
+# :authors: Israel Leiva <ilv@riseup.net>
+#           see also AUTHORS file
+#
+# :copyright:   (c) 2008-2015, The Tor Project, Inc.
+#               (c) 2015, Israel Leiva
+#
+# :license: This is Free Software. See LICENSE for license information.
+
+import math
+import struct
+import hashlib
+
+"""Compact set membership with false positives but no false negatives."""
+
+
+class BloomFilter(object):
+    """Bloom filter of strings.
+
+    A filter can say that a string was added when it wasn't (a false
+    positive), but never the other way around. Its size is chosen so the
+    rate of false positives stays below error_rate while there are at most
+    'capacity' strings in it.
+
+    Public methods:
+
+        add(): Add a string to the filter.
+        false_positive_rate(): Estimate the current rate of false positives.
+
+    """
+
+    def __init__(self, capacity, error_rate):
+        """Create a new empty filter.
+
+        :param: capacity (int) expected number of strings.
+        :param: error_rate (float) maximum rate of false positives.
+
+        """
+        capacity = max(1, capacity)
+        self.size = int(math.ceil(
+            -capacity * math.log(error_rate) / math.log(2) ** 2
+        ))
+        self.hashes = max(1, int(round(
+            float(self.size) / capacity * math.log(2)
+        )))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, value):
+        """Get the bits of a string (double hashing).
+
+        :param: value (string) the string.
+
+        :return: (generator) the positions of its bits.
+
+        """
+        digest = hashlib.md5(value).digest()
+        h1, h2 = struct.unpack('<QQ', digest)
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, value):
+        """Add a string to the filter.
+
+        :param: value (string) the string.
+
+        """
+        for pos in self._positions(value):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, value):
+        for pos in self._positions(value):
+            if not self.bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def __len__(self):
+        return self.count
+
+    def false_positive_rate(self):
+        """Estimate the current rate of false positives.
+
+        :return: (float) the probability of a string not added to be
+                 found in the filter.
+
+        """
+        return (1 - math.exp(
+            -float(self.hashes) * self.count / self.size
+        )) ** self.hashes
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of GetTor, a Tor Browser distribution system.
+#
+# :authors: Israel Leiva <ilv@riseup.net>
+#           see also AUTHORS file
+#
+# :copyright:   (c) 2008-2015, The Tor Project, Inc.
+#               (c) 2015, Israel Leiva
+#
+# :license: This is Free Software. See LICENSE for license information.
+
+import os
+import time
+import logging
+import threading
+import ConfigParser
+
+import core
+import utils
+import blacklist
+
+"""Run several distribution channels in a single process."""
+
+# channels we know how to run, in the order they are started
+CHANNELS = ('smtp', 'xmpp', 'twitter')
+
+
+class ConfigError(Exception):
+    pass
+
+
+class InternalError(Exception):
+    pass
+
+
+class ChannelServer(object):
+    """Host the SMTP, XMPP and Twitter channels in a single process.
+
+    Every channel runs its usual blocking loop in its own thread, and all
+    of them share the same Core (i.e. the links index), Blacklist and
+    catalogs of translations, so these are loaded only once. Requests are
+    still processed as in the standalone channels, e.g. emails are handled
+    by the pool of workers of the SMTP daemon.
+
+    Public methods:
+
+        start(): Start the channels and wait until they stop.
+        stop(): Stop the channels.
+
+    Exceptions:
+
+        ConfigError: Bad configuration.
+        InternalError: Something went wrong internally.
+
+    """
+
+    def __init__(self, cfg=None):
+        """Create new object by reading a configuration file.
+
+        :param: cfg (string) the path of the configuration file.
+
+        """
+        default_cfg = 'channels.cfg'
+        config = ConfigParser.ConfigParser()
+
+        if cfg is None or not os.path.isfile(cfg):
+            cfg = default_cfg
+
+        try:
+            with open(cfg) as f:
+                config.readfp(f)
+        except IOError:
+            raise ConfigError("File %s not found!" % cfg)
+
+        try:
+            core_cfg = config.get('general', 'core_cfg')
+            blacklist_cfg = config.get('blacklist', 'cfg')
+
+            # a channel without configuration file is disabled
+            self.channels_cfg = {}
+            for name in CHANNELS:
+                if config.has_option('channels', name):
+                    channel_cfg = config.get('channels', name).strip()
+                    if channel_cfg:
+                        self.channels_cfg[name] = channel_cfg
+
+            logdir = config.get('log', 'dir')
+            logfile = os.path.join(logdir, 'channels.log')
+            loglevel = config.get('log', 'level')
+
+            self.core = core.Core(core_cfg)
+            self.bl = blacklist.Blacklist(blacklist_cfg)
+
+        except ConfigParser.Error as e:
+            raise ConfigError("Configuration error: %s" % str(e))
+        except blacklist.ConfigError as e:
+            raise InternalError("Blacklist error: %s" % str(e))
+        except core.ConfigError as e:
+            raise InternalError("Core error: %s" % str(e))
+
+        if not self.channels_cfg:
+            raise ConfigError("Configuration error: no channels enabled")
+
+        # logging
+        log = logging.getLogger(__name__)
+
+        logging_format = utils.get_logging_format()
+        date_format = utils.get_date_format()
+        formatter = logging.Formatter(logging_format, date_format)
+
+        log.info('Redirecting CHANNELS logging to %s' % logfile)
+        logfileh = logging.FileHandler(logfile, mode='a+')
+        logfileh.setFormatter(formatter)
+        logfileh.setLevel(logging.getLevelName(loglevel))
+        log.addHandler(logfileh)
+
+        # stop logging on stdout from now on
+        log.propagate = False
+        self.log = log
+
+        # name -> (channel object, start method, stop method)
+        self.channels = {}
+        self.threads = []
+
+    def _create_channel(self, name):
+        """Create the object of a channel.
+
+        Channel modules are imported here, so the dependencies of a channel
+        (e.g. sleekxmpp or tweepy) are only needed if it's enabled.
+
+        :param: name (string) the name of the channel.
+
+        :raise: ConfigError or InternalError if the channel can't be
+                created.
+
+        :return: (tuple) the channel object, its start and stop methods.
+
+        """
+        cfg = self.channels_cfg[name]
+        try:
+            if name == 'smtp':
+                import smtp as module
+            elif name == 'xmpp':
+                import xmpp as module
+            else:
+                import twitter as module
+        except ImportError as e:
+            raise InternalError("Channel %s not available: %s" % (name, e))
+
+        try:
+            if name == 'smtp':
+                obj = module.SMTP(cfg, self.core, self.bl)
+                return obj, obj.start_daemon, obj.stop_daemon
+            elif name == 'xmpp':
+                obj = module.XMPP(cfg, self.core, self.bl)
+                return obj, obj.start_bot, obj.stop_bot
+            else:
+                obj = module.TwitterBot(cfg, self.core, self.bl)
+                return obj, obj.start, obj.stop
+        except module.ConfigError as e:
+            raise ConfigError("Channel %s: %s" % (name, str(e)))
+        except module.InternalError as e:
+            raise InternalError("Channel %s: %s" % (name, str(e)))
+
+    def _run(self, name, start):
+        """Run the blocking loop of a channel.
+
+        :param: name (string) the name of the channel.
+        :param: start (function) the start method of the channel.
+
+        """
+        self.log.info("Starting channel %s" % name)
+        try:
+            start()
+        except Exception as e:
+            self.log.error("Channel %s failed: %s" % (name, str(e)))
+        self.log.info("Channel %s stopped" % name)
+
+    def start(self):
+        """Start the channels and wait until they stop.
+
+        Channels are created before starting any of them, so a bad
+        configuration is found right away.
+
+        :raise: ConfigError or InternalError if a channel can't be created.
+
+        """
+        for name in CHANNELS:
+            if name in self.channels_cfg:
+                self.channels[name] = self._create_channel(name)
+
+        for name in CHANNELS:
+            if name not in self.channels:
+                continue
+            obj, start, stop = self.channels[name]
+            t = threading.Thread(
+                target=self._run, args=(name, start), name=name
+            )
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+
+        try:
+            # join() with no timeout would block the signals
+            while any(t.is_alive() for t in self.threads):
+                time.sleep(1)
+        finally:
+            self.stop()
+
+    def stop(self):
+        """Stop the channels."""
+        for name, (obj, start, stop) in self.channels.items():
+            try:
+                stop()
+            except Exception as e:
+                self.log.error("Error stopping %s: %s" % (name, str(e)))
+        self.channels = {}
+
+        for t in self.threads:
+            t.join(5)
+        self.threads = []
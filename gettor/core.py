@@ -12,16 +12,21 @@
 
 import os
 import re
+import time
+import threading
 import logging
-import gettext
 import tempfile
 import ConfigParser
 
 import db
+import i18n
 import utils
 
 """Core module for getting links from providers."""
 
+# seconds between checks for changes in the links files
+LINKS_CHECK_INTERVAL = 30
+
 
 class ConfigError(Exception):
     pass
@@ -85,13 +90,19 @@ class Core(object):
             raise ConfigError("File %s not found!" % cfg)
 
         try:
-            self.supported_lc = config.get('links', 'locales')
-            self.supported_os = config.get('links', 'os')
+            # lists keep the order of the configuration, sets are used
+            # to check requests (the raw strings would match substrings)
+            self.supported_lc = config.get('links', 'locales').split(',')
+            self.supported_os = config.get('links', 'os').split(',')
+            self.supported_lc_set = frozenset(self.supported_lc)
+            self.supported_os_set = frozenset(self.supported_os)
 
             basedir = config.get('general', 'basedir')
             self.linksdir = config.get('links', 'dir')
             self.linksdir = os.path.join(basedir, self.linksdir)
             self.i18ndir = config.get('i18n', 'dir')
+            self.i18n = i18n.Translator(self.i18ndir)
+            self.i18n.preload()
 
             loglevel = config.get('log', 'level')
             logdir = config.get('log', 'dir')
@@ -123,6 +134,14 @@ class Core(object):
         log.propagate = False
         self.log = log
 
+        # parsed links, see _refresh_links_index()
+        self.links_index = None
+        self.links_providers = ()
+        self.links_msgs = {}
+        self.links_stamp = None
+        self.links_checked = 0
+        self.links_lock = threading.Lock()
+
     def _get_msg(self, msgid, lc):
         """Get message identified by msgid in a specific locale.
 
@@ -134,11 +153,7 @@ class Core(object):
         """
         # obtain the content in the proper language
         try:
-            t = gettext.translation(lc, self.i18ndir, languages=[lc])
-            _ = t.ugettext
-
-            msgstr = _(msgid)
-            return msgstr
+            return self.i18n.get_msg(msgid, lc)
         except IOError as e:
             raise ConfigError("%s" % str(e))
 
@@ -159,11 +174,11 @@ class Core(object):
 
         """
         # english and windows by default
-        if lc not in self.supported_lc:
+        if lc not in self.supported_lc_set:
             self.log.debug("Request for locale not supported. Default to en")
             lc = 'en'
 
-        if os not in self.supported_os:
+        if os not in self.supported_os_set:
             self.log.debug("Request for OS not supported. Default to windows")
             os = 'windows'
 
@@ -182,33 +197,16 @@ class Core(object):
 
         return links
 
-    def _get_links(self, osys, lc):
-        """Internal method to get the links.
-
-        Looks for the links inside each provider file. This should only be
-        called from get_links() method.
+    def _get_links_stamp(self):
+        """Get a snapshot of the links files in the links directory.
 
-        :param: osys (string) the operating system.
-        :param: lc (string) the locale.
+        The snapshot is used to find out if the links index is stale, so
+        it only takes into account the name, mtime and size of each file.
 
-        :return: (string/None) links on success, None otherwise.
+        :return: (tuple) sorted (path, mtime, size) entries.
 
         """
-
-        # read the links files using ConfigParser
-        # see the README for more details on the format used
-        links_files = []
-        
-        links32 = {}
-        links64 = {}
-        
-        # for the message to be sent
-        if osys == 'windows':
-            arch = '32/64'
-        elif osys == 'osx':
-            arch = '64'
-        else:
-            arch = '32'
+        stamp = []
 
         # look for files ending with .links
         p = re.compile('.*\.links$')
@@ -216,21 +214,62 @@ class Core(object):
         for name in os.listdir(self.linksdir):
             path = os.path.abspath(os.path.join(self.linksdir, name))
             if os.path.isfile(path) and p.match(path):
-                links_files.append(path)
+                st = os.stat(path)
+                stamp.append((path, st.st_mtime, st.st_size))
+
+        return tuple(sorted(stamp))
+
+    def _parse_links(self, osys, value):
+        """Parse the value of a links entry.
+
+        Each package is encoded as link$signature$checksum$ and linux
+        entries have two packages (32 and 64-bit) separated by a comma.
+        See the README for more details on the format used.
+
+        :param: osys (string) the operating system.
+        :param: value (string) the raw value read from the links file.
+
+        :raise: LinkFormatError if the entry doesn't have the right format.
+
+        :return: (tuple) one (link, signature, checksum) tuple per package.
 
-        # let's create a dictionary linking each provider with the links
-        # found for os and lc. This way makes it easy to check if no
-        # links were found
-        providers = {}
+        """
+        if osys == 'linux':
+            packages = [t for t in value.split(",") if t.strip()]
+            if len(packages) != 2:
+                raise LinkFormatError("Expected two packages for linux")
+        else:
+            packages = [value]
+
+        parsed = []
+        for package in packages:
+            fields = [l.strip() for l in package.split("$") if l.strip()]
+            if len(fields) != 3:
+                raise LinkFormatError("Malformed entry %s" % package.strip())
+            parsed.append(tuple(fields))
+
+        return tuple(parsed)
+
+    def _load_links_index(self, stamp):
+        """Build the links index from the links files.
 
-        # separator
-        spt = '=' * 72
+        The index maps (provider, os, locale) to the parsed entry of the
+        links file. It's never modified once built; a new one replaces it
+        when the links files change, along with the links messages for
+        every supported OS and locale.
+
+        :param: stamp (tuple) snapshot of the links files to be read.
+
+        :raise: InternalError if a links file can't be read.
+
+        """
+        index = {}
+        providers = []
 
         # reading links from providers directory
-        for name in links_files:
-            # we're reading files listed on linksdir, so they must exist!
+        for name, mtime, size in stamp:
             config = ConfigParser.ConfigParser()
-            # but just in case they don't
+            # files might have been removed since we listed them
             try:
                 with open(name) as f:
                     config.readfp(f)
@@ -239,122 +278,156 @@ class Core(object):
 
             try:
                 pname = config.get('provider', 'name')
-
-                # check if current provider pname has links for os in lc
-                providers[pname] = config.get(osys, lc)
-            except ConfigParser.Error as e:
-                # we should at least have the english locale available
-                self.log.error("Request for %s, returning 'en' instead" % lc)
-                providers[pname] = config.get(osys, 'en')
-            try:
-                #test = providers[pname].split("$")
-                #self.log.debug(test)
-                if osys == 'linux':
-                    t32, t64 = [t for t in providers[pname].split(",") if t]
-                    
-                    link, signature, chs32 = [l for l in t32.split("$") if l]
-                    link = "    %s: %s" % (pname, link)
-                    links32[link] = signature
-
-                    link, signature, chs64 = [l for l in t64.split("$") if l]
-                    link = "    %s: %s" % (pname, link.lstrip())
-                    links64[link] = signature
-                    
-                else:
-                    link, signature, chs32 = [l for l in providers[pname].split("$") if l]
-                    link = "    %s: %s" % (pname, link)
-                    links32[link] = signature
-                    
-                #providers[pname] = providers[pname].replace(",", "")
-                #providers[pname] = providers[pname].replace("$", "\n\n")
-
-                ### We will improve and add the verification section soon ###
-                # all packages are signed with same key
-                # (Tor Browser developers)
-                # fingerprint = config.get('key', 'fingerprint')
-                # for now, english messages only
-                # fingerprint_msg = self._get_msg('fingerprint', 'en')
-                # fingerprint_msg = fingerprint_msg % fingerprint
             except ConfigParser.Error as e:
-                raise InternalError("%s" % str(e))
+                self.log.error("Ignoring %s: %s" % (name, str(e)))
+                continue
+
+            providers.append(pname)
+            for osys in self.get_supported_os():
+                if not config.has_section(osys):
+                    continue
+                for lc, value in config.items(osys):
+                    try:
+                        index[(pname, osys, lc)] = self._parse_links(
+                            osys, value
+                        )
+                    except LinkFormatError as e:
+                        self.log.error(
+                            "Ignoring %s links (%s, %s): %s" %
+                            (pname, osys, lc, str(e))
+                        )
+
+        providers = tuple(sorted(providers))
+
+        # messages only depend on the links files, render them once
+        msgs = {}
+        for osys in self.get_supported_os():
+            for lc in self.get_supported_lc():
+                msgs[(osys, lc)] = self._render_links(
+                    index, providers, osys, lc
+                )
 
-        # create the final links list with all providers
-        all_links = []
+        self.links_index = index
+        self.links_providers = providers
+        self.links_msgs = msgs
+        self.links_stamp = stamp
 
-        msg = "Tor Browser %s-bit:\n" % arch
-        for link in links32:
-            msg = "%s\n%s" % (msg, link)
-            
-        all_links.append(msg)
-        
-        if osys == 'linux':
-            msg = "\n\n\nTor Browser 64-bit:\n"
-            for link in links64:
-                msg = "%s\n%s" % (msg, link)
-        
-            all_links.append(msg)
-        
-        ### We will improve and add the verification section soon ###
-        """
-        msg = "\n\n\nTor Browser's signature %s-bit:" %\
-              arch
-        for link in links32:
-            msg = "%s\n%s" % (msg, links32[link])
-        
-        all_links.append(msg)
-        
-        if osys == 'linux':
-            msg = "\n\n\nTor Browser's signature 64-bit:"
-            for link in links64:
-                msg = "%s%s" % (msg, links64[link])
-            
-            all_links.append(msg)
-        
-        msg = "\n\n\nSHA256 of Tor Browser %s-bit (advanced): %s\n" %\
-              (arch, chs32)
-        all_links.append(msg)
-        
-        if osys == 'linux':
-            msg = "SHA256 of Tor Browser 64-bit (advanced): %s\n" % chs64
-            all_links.append(msg)
+    def _refresh_links_index(self):
+        """Rebuild the links index if the links files have changed.
 
-        """
-        ### end verification ###
+        Changes are checked at most once every LINKS_CHECK_INTERVAL
+        seconds, so most requests don't touch the disk at all.
+
+        :raise: InternalError if the links directory can't be read.
 
         """
-        for key in providers.keys():
-            # get more friendly description of the provider
-            try:
-                # for now, english messages only
-                provider_desc = self._get_msg('provider_desc', 'en')
-                provider_desc = provider_desc % key
+        now = time.time()
+        if self.links_index is not None and \
+                now - self.links_checked < LINKS_CHECK_INTERVAL:
+            return
+
+        # several channels might share this object, only one of them
+        # should reload the index
+        with self.links_lock:
+            if self.links_index is not None and \
+                    now - self.links_checked < LINKS_CHECK_INTERVAL:
+                return
 
-                all_links.append(
-                    "%s\n%s\n\n%s%s\n\n\n" %
-                    (provider_desc, spt, ''.join(providers[key]), spt)
-                )
-            except ConfigError as e:
+            try:
+                stamp = self._get_links_stamp()
+            except OSError as e:
                 raise InternalError("%s" % str(e))
-        """
 
-        ### We will improve and add the verification section soon ###
-        # add fingerprint after the links
-        # all_links.append(fingerprint_msg)
+            if stamp != self.links_stamp:
+                self.log.debug("Links files changed. Loading links index...")
+                self._load_links_index(stamp)
+            self.links_checked = now
+
+    def _render_links(self, index, providers, osys, lc):
+        """Render the links message for an OS and locale.
+
+        :param: index (dict) the links index to read the links from.
+        :param: providers (tuple) the providers in the links index.
+        :param: osys (string) the operating system.
+        :param: lc (string) the locale.
+
+        :return: (string/None) links on success, None otherwise.
+
+        """
+        links32 = []
+        links64 = []
 
-        if all_links:
-            return "".join(all_links)
+        # for the message to be sent
+        if osys == 'windows':
+            arch = '32/64'
+        elif osys == 'osx':
+            arch = '64'
         else:
+            arch = '32'
+
+        for pname in providers:
+            packages = index.get((pname, osys, lc))
+            if packages is None:
+                # we should at least have the english locale available
+                self.log.debug("No %s links for %s in %s, using 'en'" %
+                               (osys, lc, pname))
+                packages = index.get((pname, osys, 'en'))
+            if packages is None:
+                self.log.error("No links for %s in %s" % (osys, pname))
+                continue
+
+            link, signature, chs32 = packages[0]
+            links32.append("    %s: %s" % (pname, link))
+
+            if osys == 'linux':
+                link, signature, chs64 = packages[1]
+                links64.append("    %s: %s" % (pname, link))
+
+        if not links32:
             # we're trying to get supported os an lc
             # but there aren't any links!
             return None
 
+        # create the final links list with all providers
+        all_links = []
+        all_links.append(
+            "Tor Browser %s-bit:\n\n%s" % (arch, "\n".join(links32))
+        )
+
+        if osys == 'linux':
+            all_links.append(
+                "\n\n\nTor Browser 64-bit:\n\n%s" % "\n".join(links64)
+            )
+
+        ### We will improve and add the verification section soon ###
+        # signatures and checksums are available in the links index
+        # as the second and third field of each package.
+
+        return "".join(all_links)
+
+    def _get_links(self, osys, lc):
+        """Internal method to get the links.
+
+        Links messages are rendered for every supported OS and locale
+        when the links index is loaded. This should only be called from
+        get_links() method.
+
+        :param: osys (string) the operating system.
+        :param: lc (string) the locale.
+
+        :return: (string/None) links on success, None otherwise.
+
+        """
+        self._refresh_links_index()
+        return self.links_msgs.get((osys, lc))
+
     def get_supported_os(self):
         """Public method to get the list of supported operating systems.
 
         :return: (list) the supported operating systems.
 
         """
-        return self.supported_os.split(',')
+        return list(self.supported_os)
 
     def get_supported_lc(self):
         """Public method to get the list of supported locales.
@@ -362,7 +435,7 @@ class Core(object):
         :return: (list) the supported locales.
 
         """
-        return self.supported_lc.split(',')
+        return list(self.supported_lc)
 
     def create_links_file(self, provider, fingerprint):
         """Public method to create a links file for a provider.
@@ -416,6 +489,9 @@ class Core(object):
                     "Error while creating new links file: %s" % str(e)
                 )
 
+            # make sure the links index is checked on the next request
+            self.links_checked = 0
+
     def add_link(self, provider, osys, lc, link):
         """Public method to add a link to a provider's links file.
 
@@ -440,11 +516,11 @@ class Core(object):
 
         self.log.debug("Request to add a new link")
         # don't try to add unsupported stuff
-        if lc not in self.supported_lc:
+        if lc not in self.supported_lc_set:
             self.log.debug("Request for locale %s not supported" % lc)
             raise NotSupportedError("Locale %s not supported" % lc)
 
-        if osys not in self.supported_os:
+        if osys not in self.supported_os_set:
             self.log.debug("Request for OS %s not supported" % osys)
             raise NotSupportedError("OS %s not supported" % osys)
 
@@ -476,6 +552,9 @@ class Core(object):
                 # this shouldn't happen, but just in case
                 self.log.debug("FAILED (OS not found)")
                 raise InternalError("Unknown section %s" % str(e))
+
+            # make sure the links index is checked on the next request
+            self.links_checked = 0
         else:
             self.log.debug("FAILED (links file doesn't seem legit)")
             raise LinkFileError("No links file for %s" % provider)
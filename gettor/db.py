@@ -10,12 +10,23 @@
 #
 # :license: This is Free Software. See LICENSE for license information.
 
+import os
 import time
 import sqlite3
 import datetime
+import threading
+
+from contextlib import contextmanager
 
 """DB interface for comunicating with sqlite3"""
 
+# milliseconds to wait for a lock held by another process
+BUSY_TIMEOUT = 5000
+
+# verdicts of check_user()
+BLOCKED = 'blocked'
+THROTTLED = 'throttled'
+
 
 class DBError(Exception):
     pass
@@ -26,8 +37,15 @@ class DB(object):
 
     Public methods:
 
+        connect(): connect to the database (once per process and thread).
+        close(): close the connection to the database.
         add_request(): add a request to the database (requests table).
         get_user(): get user info from the database (users table).
+        check_user(): count a request of a user and check if it's allowed.
+        save_users(): save the counters of several users at once.
+        get_blocked_users(): get all the users permanently blocked.
+        get_version(): get the version of the blocked users.
+        delete_expired_users(): delete a batch of users not seen lately.
         add_user(): add a user to the database (users table).
         update_user(): update a user on the database (users table).
 
@@ -45,16 +63,80 @@ class DB(object):
 
         """
         self.dbname = dbname
-
+        # sqlite3 connections can't be shared between threads
+        self.local = threading.local()
+
+    @property
+    def con(self):
+        """The connection of the current thread (see connect())."""
+        con = getattr(self.local, 'con', None)
+        if con is None or self.local.pid != os.getpid():
+            self.connect()
+            con = self.local.con
+        return con
 
     def connect(self):
-        """ """
+        """Connect to the database.
+
+        The connection is kept open and reused by every call made from the
+        same process and thread, so calling this more than once is cheap.
+        We use WAL so readers and writers from other GetTor processes
+        don't block each other, and wait up to BUSY_TIMEOUT milliseconds
+        for a lock instead of failing with 'database is locked'.
+
+        """
+        # a forked child must not use the connection of its parent
+        if getattr(self.local, 'con', None) is not None and \
+                self.local.pid == os.getpid():
+            return
+
         try:
-            self.con = sqlite3.connect(self.dbname)
-            self.con.row_factory = sqlite3.Row
+            # transactions are handled explicitly, see _transaction()
+            con = sqlite3.connect(
+                self.dbname,
+                timeout=BUSY_TIMEOUT / 1000.0,
+                isolation_level=None
+            )
+            con.row_factory = sqlite3.Row
+            con.execute("PRAGMA busy_timeout = %d" % BUSY_TIMEOUT)
+            con.execute("PRAGMA journal_mode = WAL")
+            con.execute("PRAGMA synchronous = NORMAL")
         except sqlite3.Error as e:
             raise DBError("%s" % str(e))
 
+        self.local.con = con
+        self.local.pid = os.getpid()
+
+    def close(self):
+        """Close the connection of the current thread (if any)."""
+        con = getattr(self.local, 'con', None)
+        self.local.con = None
+        if con is not None and self.local.pid == os.getpid():
+            try:
+                con.close()
+            except sqlite3.Error as e:
+                raise DBError("%s" % str(e))
+
+    @contextmanager
+    def _transaction(self):
+        """Run the statements of a with block in a single transaction.
+
+        The write lock is taken at the beginning (BEGIN IMMEDIATE), so
+        the transaction can't fail halfway because of another writer.
+
+        :return: (object) a cursor to execute the statements with.
+
+        """
+        cur = self.con.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            yield cur
+        except:
+            cur.execute("ROLLBACK")
+            raise
+        else:
+            cur.execute("COMMIT")
+
     def add_request(self):
         """Add a request to the database.
 
@@ -62,8 +144,7 @@ class DB(object):
 
         """
         try:
-            with self.con:
-                cur = self.con.cursor()
+            with self._transaction() as cur:
                 cur.execute("SELECT counter FROM requests WHERE id = 1")
                 row = cur.fetchone()
                 if row:
@@ -85,13 +166,12 @@ class DB(object):
 
         """
         try:
-            with self.con:
-                cur = self.con.cursor()
-                cur.execute("SELECT * FROM users WHERE id =? AND service =?",
-                            (user, service))
+            cur = self.con.cursor()
+            cur.execute("SELECT * FROM users WHERE id =? AND service =?",
+                        (user, service))
 
-                row = cur.fetchone()
-                return row
+            row = cur.fetchone()
+            return row
         except sqlite3.Error as e:
             raise DBError("%s" % str(e))
 
@@ -107,10 +187,9 @@ class DB(object):
 
         """
         try:
-            with self.con:
-                cur = self.con.cursor()
+            with self._transaction() as cur:
                 cur.execute("INSERT INTO users VALUES(?,?,?,?,?)",
-                            (user, service, 1, blocked, str(time.time())))
+                            (user, service, 1, blocked, time.time()))
         except sqlite3.Error as e:
             raise DBError("%s" % str(e))
 
@@ -126,10 +205,154 @@ class DB(object):
 
         """
         try:
-            with self.con:
-                cur = self.con.cursor()
+            with self._transaction() as cur:
+                cur.execute("UPDATE users SET times =?, blocked =?,"
+                            " last_request =? WHERE id =? AND service =?",
+                            (times, blocked, time.time(), user, service))
+        except sqlite3.Error as e:
+            raise DBError("%s" % str(e))
+
+    def check_user(self, user, service, max_req, wait_time,
+                   maybe_blocked=True):
+        """Count a request of a user and check if it should be served.
+
+        The check and the update of the counters are done in a single
+        transaction, so concurrent requests of the same user are counted
+        only once each and never get the same verdict by mistake.
+
+        If the user isn't blocked (e.g. according to a filter of blocked
+        users), a request below max_req is counted with a single UPDATE
+        and the user isn't read at all.
+
+        :param: user (string) unique (hashed) string that represents the user.
+        :param: service (string) the service related to the user (e.g. SMTP).
+        :param: max_req (int) maximum number of requests a user can make
+                in a row.
+        :param: wait_time (int) minutes the user must wait after reaching
+                max_req requests.
+        :param: maybe_blocked (bool) false if the user is known not to be
+                blocked.
+
+        :return: (string/None) BLOCKED if the user is permanently blocked,
+                 THROTTLED if the user made too many requests, None if the
+                 request should be served.
+
+        """
+        now = time.time()
+        verdict = None
+
+        try:
+            with self._transaction() as cur:
+                if not maybe_blocked:
+                    # blocked = 0 in case whoever told us is out of date
+                    cur.execute("UPDATE users SET times = times + 1,"
+                                " last_request =? WHERE id =? AND service =?"
+                                " AND blocked = 0 AND times <?",
+                                (now, user, service, max_req))
+                    if cur.rowcount == 1:
+                        return verdict
+
+                cur.execute("SELECT times, blocked, last_request FROM users"
+                            " WHERE id =? AND service =?", (user, service))
+                row = cur.fetchone()
+
+                if row is None:
+                    cur.execute("INSERT INTO users VALUES(?,?,?,?,?)",
+                                (user, service, 1, 0, now))
+                    return verdict
+
+                times = row['times'] + 1
+                blocked = row['blocked']
+                if blocked:
+                    verdict = BLOCKED
+                elif row['times'] >= max_req:
+                    if now < float(row['last_request']) + wait_time * 60:
+                        verdict = THROTTLED
+                    else:
+                        # fresh user again!
+                        times = 1
+
                 cur.execute("UPDATE users SET times =?, blocked =?,"
                             " last_request =? WHERE id =? AND service =?",
-                            (times, blocked, str(time.time()), user, service))
+                            (times, blocked, now, user, service))
+        except sqlite3.Error as e:
+            raise DBError("%s" % str(e))
+
+        return verdict
+
+    def save_users(self, users):
+        """Save the counters of several users at once.
+
+        Users are saved in a single transaction. Only the counters are
+        written, so a user blocked in the meantime (e.g. with
+        scripts/blacklist.py) stays blocked.
+
+        :param: users (list) tuples of user, service, times and
+                last_request.
+
+        """
+        try:
+            with self._transaction() as cur:
+                for user, service, times, last_request in users:
+                    cur.execute("UPDATE users SET times =?, last_request =?"
+                                " WHERE id =? AND service =?",
+                                (times, last_request, user, service))
+                    if cur.rowcount == 0:
+                        cur.execute("INSERT OR IGNORE INTO users"
+                                    " VALUES(?,?,?,?,?)",
+                                    (user, service, times, 0, last_request))
+        except sqlite3.Error as e:
+            raise DBError("%s" % str(e))
+
+    def get_blocked_users(self):
+        """Get all the users permanently blocked.
+
+        :return: (list) tuples of user and service.
+
+        """
+        try:
+            cur = self.con.cursor()
+            cur.execute("SELECT id, service FROM users WHERE blocked = 1")
+            return [(row['id'], row['service']) for row in cur.fetchall()]
+        except sqlite3.Error as e:
+            raise DBError("%s" % str(e))
+
+    def get_version(self):
+        """Get the version of the blocked users.
+
+        scripts/blacklist.py increases PRAGMA user_version every time it
+        changes the users table, so we know when to read the blocked users
+        again.
+
+        :return: (int) the version.
+
+        """
+        try:
+            cur = self.con.cursor()
+            cur.execute("PRAGMA user_version")
+            return cur.fetchone()[0]
+        except sqlite3.Error as e:
+            raise DBError("%s" % str(e))
+
+    def delete_expired_users(self, before, batch_size):
+        """Delete a batch of users not seen lately.
+
+        Users permanently blocked are never deleted. Each batch is a short
+        transaction using the index on last_request, so the write lock is
+        released quickly and requests being served don't have to wait.
+
+        :param: before (float) delete users whose last request is older
+                than this (seconds since the epoch).
+        :param: batch_size (int) maximum number of users deleted.
+
+        :return: (int) the number of users deleted.
+
+        """
+        try:
+            with self._transaction() as cur:
+                cur.execute("DELETE FROM users WHERE rowid IN"
+                            " (SELECT rowid FROM users WHERE last_request <?"
+                            " AND blocked = 0 LIMIT ?)", (before, batch_size))
+                return cur.rowcount
         except sqlite3.Error as e:
             raise DBError("%s" % str(e))
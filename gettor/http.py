@@ -12,11 +12,30 @@
 
 import os
 import re
+import gzip
 import json
-import codecs
+import time
+import shutil
+import hashlib
 import urllib2
+import urlparse
+import tempfile
+import threading
+import SocketServer
+import BaseHTTPServer
+import multiprocessing
 import ConfigParser
 
+from multiprocessing.pool import ThreadPool
+
+try:
+    # optional, only needed for .br files
+    import brotli
+except ImportError:
+    brotli = None
+
+from cStringIO import StringIO
+
 from time import gmtime, strftime
 
 import core
@@ -61,6 +80,376 @@ URL = {
     'asc': 'https://www.torproject.org/dist/torbrowser/%s/%s.asc'
 }
 
+# hashes of the files of a build, relative to its generation
+MANIFEST = '.manifest'
+
+# every build is a new generation of the tree; the web server serves the
+# one 'current' points to
+GENERATIONS = 'generations'
+CURRENT = 'current'
+KEEP_GENERATIONS = 3
+
+# processes serializing the nodes of the API (0 to do it in the builder
+# process) and threads writing them
+BUILD_PROCESSES = multiprocessing.cpu_count()
+BUILD_THREADS = 4
+
+# pretty printed json by default; compact json is about half the size. If
+# compress is set, .gz (and .br if brotli is available) siblings of every
+# file are built too
+BUILD_COMPACT = False
+BUILD_COMPRESS = False
+
+# embedded server (see HTTP.run()): address, seconds between checks for
+# changes in the links and mirrors, seconds between checks of the latest
+# version, and seconds an idle keep-alive connection is kept open
+SERVER_HOST = 'localhost'
+SERVER_PORT = 8080
+RELOAD_INTERVAL = 30
+VERSION_INTERVAL = 3600
+KEEP_ALIVE_TIMEOUT = 30
+
+# seconds to wait for the list of versions, so a stalled connection
+# doesn't hold up the reloads
+VERSION_TIMEOUT = 30
+
+# files made by compress() and their Content-Encoding, preferred first
+ENCODINGS = (('.br', 'br'), ('.gz', 'gzip'))
+
+
+
+def get_nodes(resources, providers, links, lv, mirrors):
+    """ Get all the nodes of the API tree.
+
+    :param: resources (dict) the available resources.
+    :param: providers (dict) the providers and their URLs.
+    :param: links (dict) the links of each provider by OS and locale.
+    :param: lv (dict) the latest versions and their downloads.
+    :param: mirrors (list) the mirrors of torproject.org.
+
+    :return: (list) tuples of the path of each node (relative to the root
+             of the tree) and its data.
+
+    """
+    nodes = [
+        ('api', resources),
+        ('api-content/providers', providers)
+    ]
+
+    for provider in links:
+        if provider == 'updated_at':
+            continue
+
+        provider_path = 'api-content/providers-content/%s' % provider
+        nodes.append((provider_path, links[provider]))
+        for osys in links[provider]:
+            os_path = '%s-content/%s' % (provider_path, osys)
+            nodes.append((os_path, links[provider][osys]))
+            for lc in links[provider][osys]:
+                nodes.append((
+                    '%s-content/%s' % (os_path, lc),
+                    links[provider][osys][lc]
+                ))
+
+    nodes.append(('api-content/latest', lv))
+    for release in lv:
+        if release == 'updated_at':
+            continue
+
+        release_path = 'api-content/latest-content/%s' % release
+        nodes.append((release_path, lv[release]))
+        for osys in lv[release]['downloads']:
+            os_path = '%s-content/%s' % (release_path, osys)
+            nodes.append((os_path, lv[release]['downloads'][osys]))
+            for lc in lv[release]['downloads'][osys]:
+                nodes.append((
+                    '%s-content/%s' % (os_path, lc),
+                    lv[release]['downloads'][osys][lc]
+                ))
+
+    nodes.append(('api-content/mirrors', mirrors))
+    return nodes
+
+
+def serialize(content, compact=False):
+    """ Serialize a node of the API.
+
+    :param: content (dict) the data of the node.
+    :param: compact (bool) true for json without whitespace.
+
+    :return: (tuple) the json of the node and its hash, which is also its
+             ETag.
+
+    """
+    if compact:
+        data = json.dumps(
+            content,
+            sort_keys=True,
+            separators=(',', ':'),
+            encoding="utf-8",
+        )
+    else:
+        # Make pretty json
+        data = json.dumps(
+            content,
+            sort_keys=True,
+            indent=4,
+            separators=(',', ': '),
+            encoding="utf-8",
+        )
+    return data, hashlib.sha1(data).hexdigest()
+
+
+def compress(data):
+    """ Compress the json of a node for clients accepting it.
+
+    The output only depends on the input (e.g. no timestamp in the gzip
+    header), so unchanged files keep their hash between builds.
+
+    :param: data (string) the json of the node.
+
+    :return: (list) tuples of the suffix of the file (.gz, .br), the data
+             and its hash.
+
+    """
+    buf = StringIO()
+    gz = gzip.GzipFile(filename='', mode='wb', fileobj=buf, mtime=0)
+    gz.write(data)
+    gz.close()
+    compressed = [('.gz', buf.getvalue())]
+
+    if brotli is not None:
+        compressed.append(('.br', brotli.compress(data)))
+
+    return [
+        (suffix, cdata, hashlib.sha1(cdata).hexdigest())
+        for suffix, cdata in compressed
+    ]
+
+
+def _serialize_node(args):
+    """ Serialize and compress a node (run by the pool of processes).
+
+    :param: args (tuple) the data of the node, compact and compress
+            options (see serialize_nodes()).
+
+    :return: (list) tuples of suffix, data and hash of each file.
+
+    """
+    content, compact, compressed = args
+    data, digest = serialize(content, compact)
+    files = [('', data, digest)]
+    if compressed:
+        files.extend(compress(data))
+    return files
+
+
+def serialize_nodes(nodes, processes, compact=False, compressed=False):
+    """ Serialize the nodes of the API, in parallel if possible.
+
+    Pretty printed json is encoded by the (slow) pure Python encoder, so
+    the work is split between several processes.
+
+    :param: nodes (list) tuples of path and data of each node.
+    :param: processes (int) number of processes; with less than two the
+            nodes are serialized by this process.
+    :param: compact (bool) true for json without whitespace.
+    :param: compressed (bool) true to add .gz and .br files of each node.
+
+    :raise: TypeError or ValueError if some data can't be serialized.
+
+    :return: (list) tuples of path, data and hash of each file.
+
+    """
+    work = [(content, compact, compressed) for path, content in nodes]
+    if processes < 2 or len(nodes) < processes:
+        serialized = map(_serialize_node, work)
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            chunksize = max(1, len(work) / (processes * 4))
+            serialized = pool.map(_serialize_node, work, chunksize)
+        finally:
+            pool.close()
+            pool.join()
+
+    return [
+        (path + suffix, data, digest)
+        for (path, content), files in zip(nodes, serialized)
+        for suffix, data, digest in files
+    ]
+
+
+def write_nodes(write, nodes, threads):
+    """ Write the nodes of the API using several threads.
+
+    Writing hundreds of small files is dominated by system calls, which
+    don't hold the interpreter lock.
+
+    :param: write (function) writes a node and returns a result.
+    :param: nodes (list) the nodes to write.
+    :param: threads (int) number of threads.
+
+    :return: (list) the results of write for each node.
+
+    """
+    if threads < 2:
+        return map(write, nodes)
+
+    pool = ThreadPool(threads)
+    try:
+        return pool.map(write, nodes)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def match_etag(header, etag):
+    """ Check if an If-None-Match header matches an ETag.
+
+    The header is a list of entity tags separated by commas, or '*'.
+    Weak tags (W/"...") match like strong ones, as If-None-Match uses the
+    weak comparison.
+
+    :param: header (string/None) the value of the header.
+    :param: etag (string) the ETag of the response, quoted.
+
+    :return: (bool) true if the header matches (i.e. 304 Not Modified).
+
+    """
+    if header is None:
+        return False
+    for tag in header.split(','):
+        tag = tag.strip()
+        if tag == '*':
+            return True
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+
+class APIRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Serve the nodes of the API from memory.
+
+    URLs are mapped to nodes like scripts/sample-htaccess-api-mirror does
+    for the static tree (e.g. /api/providers/dropbox?os=linux&lc=en).
+    Responses have an ETag, are sent compressed if the client accepts it,
+    and connections are kept alive (HTTP/1.1).
+
+    """
+    protocol_version = 'HTTP/1.1'
+    server_version = 'GetTor'
+    # close idle keep-alive connections
+    timeout = KEEP_ALIVE_TIMEOUT
+    # send headers and body together (flushed after every request) and
+    # right away, otherwise TCP delays responses on keep-alive connections
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def _get_node(self):
+        """ Get the name of the node requested.
+
+        :return: (string/None) the name of the node, None if the URL isn't
+                 part of the API.
+
+        """
+        url = urlparse.urlparse(self.path)
+        path = url.path.rstrip('/')
+        if path.endswith('.json'):
+            path = path[:-len('.json')]
+        parts = path.split('/')[1:]
+        query = urlparse.parse_qs(url.query)
+
+        if parts == ['api']:
+            return 'api'
+        if len(parts) == 2 and parts[0] == 'api':
+            return 'api-content/%s' % parts[1]
+        if len(parts) == 3 and parts[0] == 'api' and \
+                parts[1] in ('providers', 'latest'):
+            name = 'api-content/%s-content/%s' % (parts[1], parts[2])
+            if 'os' in query:
+                name = '%s-content/%s' % (name, query['os'][0])
+                if 'lc' in query:
+                    name = '%s-content/%s' % (name, query['lc'][0])
+            return name
+        return None
+
+    def _get_encoding(self):
+        """ Get the encoding of the response accepted by the client.
+
+        :return: (string) the suffix of the node to send ('' for none).
+
+        """
+        accepted = self.headers.get('Accept-Encoding', '')
+        accepted = [e.split(';')[0].strip() for e in accepted.split(',')]
+        for suffix, encoding in ENCODINGS:
+            if encoding in accepted:
+                return suffix
+        return ''
+
+    def _respond(self, body):
+        """ Send the node requested.
+
+        :param: body (bool) false to send only the headers (HEAD).
+
+        """
+        responses = self.server.api.responses
+        name = self._get_node()
+        if name is None or name not in responses:
+            self.send_error(404)
+            return
+
+        suffix = self._get_encoding()
+        if name + suffix not in responses:
+            suffix = ''
+        data, digest = responses[name + suffix]
+        etag = '"%s"' % digest
+
+        if match_etag(self.headers.get('If-None-Match'), etag):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Vary', 'Accept-Encoding')
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('ETag', etag)
+        self.send_header('Vary', 'Accept-Encoding')
+        if suffix:
+            self.send_header('Content-Encoding', dict(ENCODINGS)[suffix])
+        self.end_headers()
+        if body:
+            self.wfile.write(data)
+
+    def do_GET(self):
+        self._respond(True)
+
+    def do_HEAD(self):
+        self._respond(False)
+
+    def log_message(self, format, *args):
+        # one line per request on stderr is too much under load
+        pass
+
+
+class APIServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """ HTTP server with a thread per connection, see HTTP.run(). """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, api):
+        """ Create a new server.
+
+        :param: address (tuple) host and port to listen on.
+        :param: api (object) the HTTP object with the responses.
+
+        """
+        self.api = api
+        BaseHTTPServer.HTTPServer.__init__(self, address, APIRequestHandler)
 
 
 class ConfigError(Exception):
@@ -94,6 +483,42 @@ class HTTP(object):
         try:
             # path to static tree of API
             self.tree = config.get('general', 'tree')
+            # number of builds kept for rollback
+            self.keep_generations = KEEP_GENERATIONS
+            if config.has_option('general', 'generations'):
+                self.keep_generations = config.get('general', 'generations')
+                self.keep_generations = int(self.keep_generations)
+            # parallel builds
+            self.build_processes = BUILD_PROCESSES
+            self.build_threads = BUILD_THREADS
+            if config.has_section('build'):
+                self.build_processes = config.get('build', 'processes')
+                self.build_processes = int(self.build_processes)
+                self.build_threads = int(config.get('build', 'threads'))
+            self.build_compact = BUILD_COMPACT
+            self.build_compress = BUILD_COMPRESS
+            if config.has_option('build', 'compact'):
+                self.build_compact = config.getboolean('build', 'compact')
+            if config.has_option('build', 'compress'):
+                self.build_compress = config.getboolean('build', 'compress')
+            # embedded server (optional)
+            self.server_host = SERVER_HOST
+            self.server_port = SERVER_PORT
+            self.reload_interval = RELOAD_INTERVAL
+            self.version_interval = VERSION_INTERVAL
+            if config.has_section('server'):
+                self.server_host = config.get('server', 'host')
+                self.server_port = int(config.get('server', 'port'))
+                self.reload_interval = config.get('server', 'reload_interval')
+                self.reload_interval = int(self.reload_interval)
+                self.version_interval = config.get(
+                    'server', 'version_interval'
+                )
+                self.version_interval = int(self.version_interval)
+            # web server configuration copied into every build (optional)
+            self.htaccess = None
+            if config.has_option('general', 'htaccess'):
+                self.htaccess = config.get('general', 'htaccess')
             # server that provides the RESTful API
             self.server = config.get('general', 'url')
             # path to the links files
@@ -124,28 +549,148 @@ class HTTP(object):
             return False
         return True
     
-    def _write_json(self, path, content):
+    def _write_node(self, node):
+        """ Write a node of the API into the generation being built.
+
+        The hash of the json is compared with the one in the manifest of
+        the current generation. If they match, the file of the current
+        generation is linked instead of written again. The hash is added
+        to the manifest of the new generation only once the file is there,
+        so a file that failed is never taken as built.
+
+        :param: node (tuple) the path (relative to the tree), json and hash
+                of the node.
+
+        :raise: InternalError if the file can't be written.
+
+        :return: (bool) true if the file was written, false if linked.
+
         """
+        name, data, digest = node
+        path = os.path.join(self.staging, name)
+
+        if self.previous and self.old_manifest.get(name) == digest:
+            try:
+                os.link(os.path.join(self.previous, name), path)
+                self.manifest[name] = digest
+                return False
+            except OSError:
+                # missing or on another filesystem, just write it
+                pass
+
+        try:
+            with open(path, "wb") as jsonfile:
+                jsonfile.write(data)
+                jsonfile.flush()
+                os.fsync(jsonfile.fileno())
+        except (IOError, OSError) as e:
+            raise InternalError("Error building %s: %s" % (path, str(e)))
+        self.manifest[name] = digest
+        return True
+
+    def _fsync_dir(self, path):
+        """ Make sure the entries of a directory are on disk.
+
+        :param: path (string) the path of the directory.
+
         """
+        fd = os.open(path, os.O_RDONLY)
         try:
-            with codecs.open(
-                path,
-                "w",
-                "utf-8"
-            ) as jsonfile:
-                # Make pretty json
-                json.dump(
-                    content,
-                    jsonfile,
-                    sort_keys=True,
-                    indent=4,
-                    separators=(',', ': '),
-                    encoding="utf-8",
-                )
-        except IOError as e:
-            #logging.error("Couldn't write json: %s" % str(e))
-            print "Error building %s: %s" % (path, str(e))
-        print "%s built" % path
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def get_generations(self):
+        """ Get the generations of the tree, oldest first.
+
+        :return: (list) the names of the generations.
+
+        """
+        path = os.path.join(self.tree, GENERATIONS)
+        if not os.path.isdir(path):
+            return []
+        return sorted(
+            name for name in os.listdir(path) if not name.startswith('.')
+        )
+
+    def get_current(self):
+        """ Get the generation currently served.
+
+        :return: (string/None) the name of the generation, None if there
+                 isn't one yet.
+
+        """
+        path = os.path.join(self.tree, CURRENT)
+        if not os.path.islink(path):
+            return None
+        return os.path.basename(os.readlink(path))
+
+    def _load_manifest(self, generation):
+        """ Load the manifest of a generation.
+
+        :param: generation (string) the path of the generation.
+
+        :return: (dict) hashes of the files by path, empty if there is no
+                 manifest.
+
+        """
+        try:
+            with open(os.path.join(generation, MANIFEST)) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def _save_manifest(self):
+        """ Save the manifest of the generation being built. """
+        path = os.path.join(self.staging, MANIFEST)
+        with open(path, 'w') as f:
+            json.dump(self.manifest, f, sort_keys=True, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _publish(self, generation):
+        """ Make a generation the one served.
+
+        The 'current' symlink is replaced atomically (rename), so readers
+        see either the old or the new generation, never a mix of both.
+
+        :param: generation (string) the name of the generation.
+
+        """
+        path = os.path.join(self.tree, CURRENT)
+        tmp_path = '%s.tmp' % path
+        if os.path.lexists(tmp_path):
+            os.remove(tmp_path)
+        os.symlink(os.path.join(GENERATIONS, generation), tmp_path)
+        os.rename(tmp_path, path)
+        self._fsync_dir(self.tree)
+
+    def _prune(self):
+        """ Remove old generations, keeping the last keep_generations. """
+        current = self.get_current()
+        generations = self.get_generations()
+        old = generations[:max(0, len(generations) - self.keep_generations)]
+        for name in old:
+            if name != current:
+                shutil.rmtree(os.path.join(self.tree, GENERATIONS, name))
+                print "Generation %s removed" % name
+
+    def rollback(self):
+        """ Serve the generation before the current one again.
+
+        :raise: InternalError if there is no previous generation.
+
+        :return: (string) the name of the generation served now.
+
+        """
+        current = self.get_current()
+        generations = self.get_generations()
+        if current not in generations or generations.index(current) == 0:
+            raise InternalError("No previous generation to roll back to")
+
+        previous = generations[generations.index(current) - 1]
+        self._publish(previous)
+        return previous
 
     def _get_provider_name(self, p):
         """ Return simplified version of provider's name.
@@ -202,7 +747,7 @@ class HTTP(object):
 
     def _load_latest_version(self):
         """ Load latest version data. """
-        response = urllib2.urlopen(URL['version'])
+        response = urllib2.urlopen(URL['version'], timeout=VERSION_TIMEOUT)
         json_response = json.load(response)
 
         lv = {
@@ -365,125 +910,213 @@ class HTTP(object):
         """ Load all data.
 
         Since data is not frequently updated, we load all data before
-        running the RESTful API. Every time the links/mirrors/version
-        data is updated we should restart the API.
+        building the RESTful API. The embedded server (see run()) loads
+        it again when the links/mirrors/version data is updated.
 
         """
         self._load_links()
         self._load_mirrors()
         self._load_resources()
         self._load_latest_version()
+        self.version_loaded = time.time()
 
-    def build(self):
-        """ Build RESTful API. """
-        
-        print "Building API"
-        
-        # resources
-        self._write_json(
-            os.path.join(self.tree, 'api'),
-            self.resources
-        )
+    def _get_data_stamp(self):
+        """ Get the modification times of the links and mirrors files.
 
-        api_path = os.path.join(self.tree, 'api-content')
-        if not os.path.isdir(api_path):
-            os.mkdir(api_path)
-        
-        # providers
-        self._write_json(
-            os.path.join(api_path, 'providers'),
-            self.providers
+        :return: (tuple) names and modification times of the files.
+
+        """
+        stamp = []
+        for name in sorted(os.listdir(self.links_path)):
+            if name.endswith('.links'):
+                path = os.path.join(self.links_path, name)
+                stamp.append((name, os.stat(path).st_mtime))
+        stamp.append((self.mirrors_path, os.stat(self.mirrors_path).st_mtime))
+        return tuple(stamp)
+
+    def load_responses(self):
+        """ Serialize all the nodes of the API for the embedded server.
+
+        Every node is kept in memory as json, plus its compressed versions
+        (see compress()). The new responses replace the old ones at once,
+        so requests being served see either of them, never a mix.
+
+        Nodes are serialized by this process: forking a pool of processes
+        while the threads of the server hold locks could leave the
+        children deadlocked. The pool is only used by build().
+
+        """
+        nodes = get_nodes(
+            self.resources,
+            self.providers,
+            self.links,
+            self.lv,
+            self.mirrors
+        )
+        nodes = serialize_nodes(nodes, 0, self.build_compact, True)
+        self.responses = dict(
+            (path, (data, digest)) for path, data, digest in nodes
         )
 
-        providers_path = os.path.join(api_path, 'providers-content')
-        if not os.path.isdir(providers_path):
-            os.mkdir(providers_path)
+    def _reload(self, stamp):
+        """ Reload the data of the API when it changes (run by a thread).
 
-        for provider in self.links:
-            if provider == 'updated_at':
-                continue
+        Links and mirrors files are checked every reload_interval seconds,
+        and the latest version every version_interval seconds. If loading
+        fails the current responses are kept.
 
-            self._write_json(
-                os.path.join(providers_path, provider),
-                self.links[provider]
-            )
+        :param: stamp (tuple) the files stamp (see _get_data_stamp()) taken
+                before loading the current data.
 
-            provider_path = os.path.join(
-                providers_path,
-                "%s-content" % provider
-            )
+        """
+        while True:
+            time.sleep(self.reload_interval)
+            try:
+                new_stamp = self._get_data_stamp()
+                new_version = time.time() - self.version_loaded > \
+                    self.version_interval
+                if new_stamp == stamp and not new_version:
+                    continue
 
-            if not os.path.isdir(provider_path):
-                os.mkdir(provider_path)
-            
-            for osys in self.links[provider]:
-                self._write_json(
-                    os.path.join(provider_path, osys),
-                    self.links[provider][osys]
-                )
+                self._load_links()
+                self._load_mirrors()
+                self._load_resources()
+                if new_version:
+                    self._load_latest_version()
+                    self.version_loaded = time.time()
+                self.load_responses()
+                stamp = new_stamp
+                print "API data reloaded"
+            except Exception as e:
+                # keep serving the data we have
+                print "Error reloading API data: %s" % str(e)
+
+    def run(self):
+        """ Serve the RESTful API with the embedded HTTP server.
+
+        An alternative to build() that needs no web server: responses are
+        served from memory, and reloaded when the data changes without
+        restarting (see the [server] section of the configuration).
+
+        """
+        # taken before loading, so changes made meanwhile are reloaded
+        stamp = self._get_data_stamp()
+        self.load_data()
+        self.load_responses()
 
-                provider_os_path = os.path.join(
-                    provider_path, "%s-content" % osys
-                )            
-
-                if not os.path.isdir(provider_os_path):
-                    os.mkdir(provider_os_path)
-                
-                for lc in self.links[provider][osys]:
-                    self._write_json(
-                        os.path.join(provider_os_path, lc),
-                        self.links[provider][osys][lc]
-                    )
-
-        # latest version
-        self._write_json(
-            os.path.join(api_path, 'latest'),
-            self.lv
+        reloader = threading.Thread(
+            target=self._reload, args=(stamp,), name='reloader'
         )
-        
-        lv_path = os.path.join(api_path, 'latest-content')
-        if not os.path.isdir(lv_path):
-            os.mkdir(lv_path)
+        reloader.daemon = True
+        reloader.start()
 
-        for release in self.lv:
-            if release == 'updated_at':
-                continue
+        server = APIServer((self.server_host, self.server_port), self)
+        print "Serving API on %s:%d" % (self.server_host, self.server_port)
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
 
-            self._write_json(
-                os.path.join(lv_path, release),
-                self.lv[release]
-            )
-            
-            release_path = os.path.join(
-                lv_path,
-                "%s-content" % release
-            )
+    def build(self):
+        """ Build RESTful API.
 
-            if not os.path.isdir(release_path):
-                os.mkdir(release_path)
-            
-            for osys in self.lv[release]['downloads']:
-                self._write_json(
-                    os.path.join(release_path, osys),
-                    self.lv[release]['downloads'][osys]
-                )
+        Every build is a new generation of the tree, written into a staging
+        directory and published by pointing the 'current' symlink to it
+        (the web server should serve tree/current). Readers never see a
+        partial build, and rollback() serves the previous one again.
 
-                release_os_path = os.path.join(
-                    release_path,
-                    "%s-content" % osys
+        Builds are incremental: files that didn't change since the current
+        generation are linked instead of written (see _write_node()).
+
+        :raise: InternalError if the build fails. The current generation
+                is left untouched.
+
+        :return: (string) the name of the new generation.
+
+        """
+        
+        print "Building API"
+        generations_path = os.path.join(self.tree, GENERATIONS)
+        if not os.path.isdir(generations_path):
+            os.makedirs(generations_path)
+
+        current = self.get_current()
+        self.previous = None
+        self.old_manifest = {}
+        if current:
+            self.previous = os.path.join(generations_path, current)
+            self.old_manifest = self._load_manifest(self.previous)
+
+        self.staging = tempfile.mkdtemp(prefix='.build-', dir=generations_path)
+        self.manifest = {}
+        self.written = 0
+        self.unchanged = 0
+
+        try:
+            self._build_tree()
+            self._save_manifest()
+            if self.htaccess:
+                shutil.copy(
+                    self.htaccess, os.path.join(self.staging, '.htaccess')
                 )
+            os.chmod(self.staging, 0755)
+            for path, dirs, files in os.walk(self.staging):
+                self._fsync_dir(path)
+
+            # names sort in build order
+            base = time.strftime("%Y%m%d%H%M%S", time.gmtime())
+            generation = base
+            n = 0
+            while os.path.exists(os.path.join(generations_path, generation)):
+                n += 1
+                generation = '%s-%03d' % (base, n)
+            os.rename(self.staging, os.path.join(generations_path, generation))
+            self._fsync_dir(generations_path)
+        except (IOError, OSError, InternalError) as e:
+            shutil.rmtree(self.staging, ignore_errors=True)
+            raise InternalError("Couldn't build API: %s" % str(e))
+
+        self._publish(generation)
+        self._prune()
+        print "API built: generation %s, %d files written, %d unchanged" % (
+            generation, self.written, self.unchanged
+        )
+        return generation
 
-                if not os.path.isdir(release_os_path):
-                    os.mkdir(release_os_path)
-                
-                for lc in self.lv[release]['downloads'][osys]:
-                    self._write_json(
-                        os.path.join(release_os_path, lc),
-                        self.lv[release]['downloads'][osys][lc]
-                    )
-
-        # mirrors
-        self._write_json(
-            os.path.join(api_path, 'mirrors'),
+    def _build_tree(self):
+        """ Write all the nodes of the API into the staging directory.
+
+        The nodes are collected first, then serialized by a pool of
+        processes and written by a pool of threads (see the [build]
+        section of the configuration). The manifest of the generation
+        has the hash of every file, which is also its ETag.
+
+        """
+        nodes = get_nodes(
+            self.resources,
+            self.providers,
+            self.links,
+            self.lv,
             self.mirrors
         )
+
+        # parents first
+        dirs = set(os.path.dirname(path) for path, content in nodes)
+        for path in sorted(dirs):
+            path = os.path.join(self.staging, path)
+            if not os.path.isdir(path):
+                os.makedirs(path)
+
+        try:
+            nodes = serialize_nodes(
+                nodes,
+                self.build_processes,
+                self.build_compact,
+                self.build_compress
+            )
+        except (TypeError, ValueError) as e:
+            raise InternalError("Error serializing API: %s" % str(e))
+
+        written = write_nodes(self._write_node, nodes, self.build_threads)
+        self.written = written.count(True)
+        self.unchanged = written.count(False)
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of GetTor, a Tor Browser distribution system.
+#
+# :authors: Israel Leiva <ilv@riseup.net>
+#           see also AUTHORS file
+#
+# :copyright:   (c) 2008-2015, The Tor Project, Inc.
+#               (c) 2015, Israel Leiva
+#
+# :license: This is Free Software. See LICENSE for license information.
+
+import os
+import time
+import errno
+import gettext
+
+"""Shared cache of gettext catalogs for GetTor modules."""
+
+# seconds between checks for changes in the .mo files
+CHECK_INTERVAL = 30
+
+# catalogs loaded so far, shared by every Translator in the process.
+# (i18ndir, lc) -> (translation, mofile, mtime, last check)
+_catalogs = {}
+
+
+class Translator(object):
+    """Get translated messages from the catalogs of an i18n directory.
+
+    Catalogs follow the layout used by all GetTor modules, i.e. the
+    domain is the locale itself (i18ndir/lc/LC_MESSAGES/lc.mo). Each
+    catalog is loaded once and reloaded only if its .mo file changes.
+
+    Public methods:
+
+        preload(): Load all the catalogs available in the i18n directory.
+        get_msg(): Get a message in a specific locale.
+
+    """
+
+    def __init__(self, i18ndir):
+        """Create a new translator.
+
+        :param: i18ndir (string) the path of the i18n directory.
+
+        """
+        self.i18ndir = i18ndir
+
+    def _get_catalog(self, lc):
+        """Get the catalog for a locale, loading it if necessary.
+
+        :param: lc (string) the locale.
+
+        :raise: IOError if there is no catalog for the locale.
+
+        :return: (object) the gettext translation.
+
+        """
+        key = (self.i18ndir, lc)
+        catalog = _catalogs.get(key)
+        now = time.time()
+
+        if catalog is not None and now - catalog[3] < CHECK_INTERVAL:
+            return catalog[0]
+
+        mofile = gettext.find(lc, self.i18ndir, languages=[lc])
+        if mofile is None:
+            raise IOError(
+                errno.ENOENT, "No translation file found for domain", lc
+            )
+
+        mtime = os.stat(mofile).st_mtime
+        if catalog is not None and catalog[1:3] == (mofile, mtime):
+            translation = catalog[0]
+        else:
+            with open(mofile, 'rb') as f:
+                translation = gettext.GNUTranslations(f)
+
+        _catalogs[key] = (translation, mofile, mtime, now)
+        return translation
+
+    def preload(self):
+        """Load all the catalogs available in the i18n directory.
+
+        Locales without a catalog are just ignored, they will fail when
+        someone asks for a message in them.
+
+        """
+        try:
+            locales = os.listdir(self.i18ndir)
+        except OSError:
+            return
+
+        for lc in locales:
+            try:
+                self._get_catalog(lc)
+            except IOError:
+                pass
+
+    def get_msg(self, msgid, lc):
+        """Get message identified by msgid in a specific locale.
+
+        :param: msgid (string) the identifier of a string.
+        :param: lc (string) the locale.
+
+        :raise: IOError if there is no catalog for the locale.
+
+        :return: (string) the message from the .po file.
+
+        """
+        return self._get_catalog(lc).ugettext(msgid)
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of GetTor, a Tor Browser distribution system.
+#
+# :authors: Israel Leiva <ilv@riseup.net>
+#           see also AUTHORS file
+#
+# :copyright:   (c) 2008-2015, The Tor Project, Inc.
+#               (c) 2015, Israel Leiva
+#
+# :license: This is Free Software. See LICENSE for license information.
+
+import re
+
+"""Parsing of the requests received by the distribution channels."""
+
+# maximum number of words we look at; requests are just a few words long,
+# so this only bounds the work spent on huge messages (e.g. spam)
+MAX_WORDS = 1000
+
+WORD = re.compile(r'\S+')
+
+
+def get_words(msg, limit=MAX_WORDS):
+    """Get the words of a message, lazily.
+
+    Words are found as they are needed, so stopping early costs nothing
+    for the rest of the message.
+
+    :param: msg (string) the message.
+    :param: limit (int) maximum number of words to get.
+
+    :return: (generator) the words of the message.
+
+    """
+    for i, m in enumerate(WORD.finditer(msg)):
+        if i >= limit:
+            return
+        yield m.group()
+
+
+def count_words(msg, limit):
+    """Count the words of a message, up to a limit.
+
+    :param: msg (string) the message.
+    :param: limit (int) stop counting after this many words.
+
+    :return: (int) the number of words, at most limit.
+
+    """
+    return sum(1 for word in get_words(msg, limit))
+
+
+class RequestParser(object):
+    """Find out what users are asking for in their messages.
+
+    Words are matched (case insensitive) against the supported operating
+    systems and locales, and against 'mirror(s)'. A word matches if it
+    starts with the keyword (e.g. 'linux64' is a request for linux). All
+    keywords are compiled into a single regular expression, so each word
+    is checked only once.
+
+    Public methods:
+
+        parse(): Parse a message.
+
+    """
+
+    def __init__(self, supported_os, supported_lc):
+        """Create a new parser.
+
+        :param: supported_os (list) the supported operating systems.
+        :param: supported_lc (list) the supported locales.
+
+        """
+        # keywords as written in the configuration, by lowercase version
+        self.keywords = {}
+        alternatives = {}
+
+        for name, values in (('os', supported_os), ('lc', supported_lc)):
+            values = [v.strip() for v in values if v.strip()]
+            for v in values:
+                self.keywords[v.lower()] = v
+            # longest first, so 'zh-tw' wins over 'zh'
+            values = sorted(values, key=len, reverse=True)
+            alternatives[name] = '|'.join(map(re.escape, values)) or '(?!)'
+
+        self.pattern = re.compile(
+            "(?P<os>%s)|(?P<mirrors>mirrors?)|(?P<lc>%s)" %
+            (alternatives['os'], alternatives['lc']),
+            re.IGNORECASE
+        )
+
+    def parse(self, msg, find_lc=True):
+        """Parse a message.
+
+        Look for the OS, locale and type of request in a single pass over
+        the words of the message. We stop as soon as the request is fully
+        determined, or after MAX_WORDS words.
+
+        :param: msg (string) the message received.
+        :param: find_lc (bool) false if the locale is obtained by other
+                means (e.g. the address used in SMTP) and shouldn't be
+                looked for.
+
+        :return: (dict) the locale ('lc'), operating system ('os') and
+                 type of request ('type': help, links or mirrors).
+
+        """
+        # default values
+        req = {}
+        req['lc'] = 'en'
+        req['os'] = None
+        req['type'] = 'help'
+
+        found_lc = not find_lc
+        found_os = False
+        found_mirrors = False
+
+        for word in get_words(msg):
+            m = self.pattern.match(word)
+            if m is None:
+                continue
+
+            kind = m.lastgroup
+            if kind == 'lc' and not found_lc:
+                found_lc = True
+                req['lc'] = self.keywords[m.group(kind).lower()]
+            elif kind == 'os' and not found_os:
+                found_os = True
+                req['os'] = self.keywords[m.group(kind).lower()]
+                req['type'] = 'links'
+            elif kind == 'mirrors' and not found_mirrors:
+                found_mirrors = True
+                req['type'] = 'mirrors'
+
+            if found_lc and (found_os or found_mirrors):
+                break
+
+        return req
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of GetTor, a Tor Browser distribution system.
+#
+# :authors: Israel Leiva <ilv@riseup.net>
+#           see also AUTHORS file
+#
+# :copyright:   (c) 2008-2015, The Tor Project, Inc.
+#               (c) 2015, Israel Leiva
+#
+# :license: This is Free Software. See LICENSE for license information.
+
+import time
+import threading
+
+"""Rate limiting for the calls GetTor makes to external services."""
+
+
+class TokenBucket(object):
+    """Allow a given rate of operations, with bursts up to a capacity.
+
+    The bucket starts full and gets 'rate' tokens per second, up to
+    'capacity'. Every operation takes a token, so after a burst the
+    operations are spaced evenly at the given rate.
+
+    Public methods:
+
+        take(): Take tokens if there are enough of them.
+        wait(): Wait until there are enough tokens and take them.
+        empty(): Take all the tokens left.
+
+    """
+
+    def __init__(self, rate, capacity):
+        """Create a new bucket.
+
+        :param: rate (float) tokens added per second.
+        :param: capacity (int) maximum number of tokens.
+
+        """
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = self.capacity
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        """Add the tokens earned since the last update."""
+        now = time.time()
+        elapsed = max(0, now - self.updated)
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self.updated = now
+
+    def take(self, tokens=1):
+        """Take tokens if there are enough of them.
+
+        :param: tokens (int) number of tokens needed.
+
+        :return: (float) zero if the tokens were taken, otherwise the
+                 seconds until there are enough of them.
+
+        """
+        with self.lock:
+            self._refill()
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return 0
+            return (tokens - self.tokens) / self.rate
+
+    def wait(self, tokens=1):
+        """Wait until there are enough tokens and take them.
+
+        :param: tokens (int) number of tokens needed.
+
+        """
+        while True:
+            delay = self.take(tokens)
+            if not delay:
+                return
+            time.sleep(delay)
+
+    def empty(self):
+        """Take all the tokens left.
+
+        Useful when the service says we're over its limit anyway.
+
+        """
+        with self.lock:
+            self._refill()
+            self.tokens = 0
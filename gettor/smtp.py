@@ -15,20 +15,27 @@ import os
 import re
 import sys
 import time
-import email
-import gettext
 import logging
+import socket
 import smtplib
+import StringIO
 import datetime
+import threading
+import SocketServer
 import ConfigParser
 
 from email import Encoders
+from email.feedparser import FeedParser
 from email.MIMEBase import MIMEBase
 from email.mime.text import MIMEText
 from email.MIMEMultipart import MIMEMultipart
 
 import core
+import i18n
+import spool
+import keywords
 import utils
+import workers
 import blacklist
 
 """SMTP module for processing email requests."""
@@ -39,6 +46,23 @@ OS = {
     'windows': 'Windows'
 }
 
+# defaults for the connections to the SMTP server sending our replies
+SMTP_HOST = 'localhost'
+SMTP_PORT = 25
+SMTP_POOL_SIZE = 4
+SMTP_MAX_MESSAGES = 100
+SMTP_NOOP_INTERVAL = 30
+
+# seconds to wait for new emails when the spool is empty
+SPOOL_POLL_INTERVAL = 5
+
+# default maximum number of bytes read from an incoming email
+MAX_EMAIL_SIZE = 1024 * 1024
+
+# replies are rendered from templates with this mark as recipient
+RECIPIENT_MARK = 'gettor-recipient-mark'
+MAX_TEMPLATES = 256
+
 
 class ConfigError(Exception):
     pass
@@ -56,12 +80,197 @@ class InternalError(Exception):
     pass
 
 
+class EmailRequestHandler(SocketServer.StreamRequestHandler):
+    """Receive an email written to the daemon socket by pipe_email.py.
+
+    The client gets 'OK' once the email is queued for processing, or
+    'BUSY' if there are too many emails waiting already.
+
+    """
+
+    # don't let a stuck client block the daemon
+    timeout = 30
+
+    def handle(self):
+        smtp_obj = self.server.smtp
+
+        try:
+            parsed_msg, content = smtp_obj.read_email(self.rfile)
+        except socket.error as e:
+            smtp_obj.log.error("Error receiving email: %s" % str(e))
+            return
+
+        if self.server.pool.submit(smtp_obj.reply_email, parsed_msg,
+                                   content):
+            self.wfile.write("OK\n")
+        else:
+            smtp_obj.log.warning("Too many emails waiting, rejecting")
+            self.wfile.write("BUSY\n")
+
+
+class EmailServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    """Unix socket server for the daemon mode of the SMTP module.
+
+    Every client is read by its own thread, so a slow or stuck client
+    doesn't hold up the others. The emails are then processed by the pool
+    of workers.
+
+    """
+    daemon_threads = True
+
+    def __init__(self, path, smtp_obj, pool):
+        """Create a new server.
+
+        :param: path (string) the path of the Unix socket.
+        :param: smtp_obj (object) the SMTP object processing the emails.
+        :param: pool (object) the WorkerPool to process the emails with.
+
+        """
+        self.smtp = smtp_obj
+        self.pool = pool
+        SocketServer.UnixStreamServer.__init__(
+            self, path, EmailRequestHandler
+        )
+
+
+class SMTPPool(object):
+    """Reuse connections to the SMTP server for sending emails.
+
+    Idle connections are kept open and reused by the next email. Nothing
+    is sent while a connection is idle: one idle for more than
+    noop_interval seconds is checked with NOOP right before reusing it.
+    Broken connections are replaced transparently, and a connection is
+    closed after sending max_messages emails.
+
+    Public methods:
+
+        sendmail(): Send an email using one of the connections.
+        close(): Close all the idle connections.
+
+    """
+
+    def __init__(self, host, port, size, max_messages, noop_interval):
+        """Create a new pool of connections.
+
+        :param: host (string) the SMTP server.
+        :param: port (int) the port of the SMTP server.
+        :param: size (int) maximum number of idle connections kept open.
+        :param: max_messages (int) number of emails sent before closing a
+                connection.
+        :param: noop_interval (int) seconds a connection can be idle before
+                it's checked with NOOP.
+
+        """
+        self.host = host
+        self.port = port
+        self.size = size
+        self.max_messages = max_messages
+        self.noop_interval = noop_interval
+
+        # idle connections as [connection, emails sent, last used]
+        self.idle = []
+        self.lock = threading.Lock()
+
+    def _quit(self, conn):
+        """Close a connection, ignoring errors (it might be broken)."""
+        try:
+            conn[0].quit()
+        except (smtplib.SMTPException, socket.error):
+            conn[0].close()
+
+    def _get(self):
+        """Get an idle connection, or a new one if there are none.
+
+        :return: (list) the connection, emails sent and last used time.
+
+        """
+        while True:
+            with self.lock:
+                if not self.idle:
+                    break
+                conn = self.idle.pop()
+
+            if time.time() - conn[2] < self.noop_interval:
+                return conn
+
+            # the server might have closed it in the meantime
+            try:
+                if conn[0].noop()[0] == 250:
+                    return conn
+            except (smtplib.SMTPException, socket.error):
+                pass
+            self._quit(conn)
+
+        return [smtplib.SMTP(self.host, self.port), 0, None]
+
+    def _put(self, conn):
+        """Give a connection back to the pool after using it.
+
+        :param: conn (list) the connection, emails sent and last used time.
+
+        """
+        conn[2] = time.time()
+        if conn[1] < self.max_messages:
+            with self.lock:
+                if len(self.idle) < self.size:
+                    self.idle.append(conn)
+                    return
+        self._quit(conn)
+
+    def sendmail(self, from_addr, to_addr, msg):
+        """Send an email using one of the connections.
+
+        If the connection turns out to be broken, the email is sent again
+        once using a new connection.
+
+        :param: from_addr (string) the address of the sender.
+        :param: to_addr (string) the address of the recipient.
+        :param: msg (string) the email.
+
+        :raise: smtplib.SMTPException or socket.error if the email can't
+                be sent.
+
+        """
+        retry = True
+        while True:
+            conn = self._get()
+            try:
+                conn[0].sendmail(from_addr, to_addr, msg)
+            except (smtplib.SMTPServerDisconnected, socket.error):
+                self._quit(conn)
+                if not retry:
+                    raise
+                retry = False
+                continue
+            except smtplib.SMTPException:
+                # the server rejected the email, not the connection
+                self._put(conn)
+                raise
+
+            conn[1] += 1
+            self._put(conn)
+            return
+
+    def close(self):
+        """Close all the idle connections."""
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for conn in idle:
+            self._quit(conn)
+
+
 class SMTP(object):
     """Receive and reply requests by email.
 
     Public methods:
 
+        read_email(): Read the headers and the text of an email.
         process_email(): Process the email received.
+        reply_email(): Reply to an email already read.
+        start_daemon(): Process the emails received through a Unix socket.
+        stop_daemon(): Stop the daemon.
+        send_spool(): Send the replies queued in the spool.
+        close(): Close the connections to the SMTP server.
 
     Exceptions:
 
@@ -72,10 +281,14 @@ class SMTP(object):
 
     """
 
-    def __init__(self, cfg=None):
+    def __init__(self, cfg=None, core_obj=None, bl_obj=None):
     	"""Create new object by reading a configuration file.
 
         :param: cfg (string) path of the configuration file.
+        :param: core_obj (object) Core object to use instead of creating
+                a new one (e.g. shared with other channels).
+        :param: bl_obj (object) Blacklist object to use instead of creating
+                a new one.
 
         """
         default_cfg = 'smtp.cfg'
@@ -93,21 +306,81 @@ class SMTP(object):
         try:
             self.our_domain = config.get('general', 'our_domain')
             self.mirrors = config.get('general', 'mirrors')
+            self.max_size = MAX_EMAIL_SIZE
+            if config.has_option('general', 'max_size'):
+                self.max_size = int(config.get('general', 'max_size'))
+            # encoded attachments and replies, see _render_email()
+            self.attachments = {}
+            self.templates = {}
             self.i18ndir = config.get('i18n', 'dir')
+            self.i18n = i18n.Translator(self.i18ndir)
+            self.i18n.preload()
 
             logdir = config.get('log', 'dir')
             logfile = os.path.join(logdir, 'smtp.log')
             loglevel = config.get('log', 'level')
 
             blacklist_cfg = config.get('blacklist', 'cfg')
-            self.bl = blacklist.Blacklist(blacklist_cfg)
+            if bl_obj is None:
+                bl_obj = blacklist.Blacklist(blacklist_cfg)
+            self.bl = bl_obj
             self.bl_max_req = config.get('blacklist', 'max_requests')
             self.bl_max_req = int(self.bl_max_req)
             self.bl_wait_time = config.get('blacklist', 'wait_time')
             self.bl_wait_time = int(self.bl_wait_time)
 
             core_cfg = config.get('general', 'core_cfg')
-            self.core = core.Core(core_cfg)
+            if core_obj is None:
+                core_obj = core.Core(core_cfg)
+            self.core = core_obj
+            self.parser = keywords.RequestParser(
+                self.core.get_supported_os(),
+                self.core.get_supported_lc()
+            )
+
+            # connections to the SMTP server sending our replies
+            smtp_host = SMTP_HOST
+            smtp_port = SMTP_PORT
+            smtp_pool_size = SMTP_POOL_SIZE
+            smtp_max_messages = SMTP_MAX_MESSAGES
+            smtp_noop_interval = SMTP_NOOP_INTERVAL
+            if config.has_section('smtp'):
+                smtp_host = config.get('smtp', 'host')
+                smtp_port = int(config.get('smtp', 'port'))
+                smtp_pool_size = int(config.get('smtp', 'pool_size'))
+                smtp_max_messages = int(config.get('smtp', 'max_messages'))
+                smtp_noop_interval = int(config.get('smtp', 'noop_interval'))
+            self.smtp_pool = SMTPPool(
+                smtp_host,
+                smtp_port,
+                smtp_pool_size,
+                smtp_max_messages,
+                smtp_noop_interval
+            )
+
+            # replies are queued in the spool if there is one
+            self.spool = None
+            if config.has_section('spool'):
+                spool_db = config.get('spool', 'db')
+                spool_max_attempts = config.get('spool', 'max_attempts')
+                spool_max_attempts = int(spool_max_attempts)
+                spool_backoff = int(config.get('spool', 'backoff'))
+                self.spool_batch_size = config.get('spool', 'batch_size')
+                self.spool_batch_size = int(self.spool_batch_size)
+                self.spool_workers = int(config.get('spool', 'workers'))
+                self.spool = spool.Spool(
+                    spool_db, spool_max_attempts, spool_backoff
+                )
+
+            # only needed in daemon mode
+            self.daemon_socket = None
+            self.server = None
+            if config.has_section('daemon'):
+                self.daemon_socket = config.get('daemon', 'socket')
+                self.daemon_workers = config.get('daemon', 'workers')
+                self.daemon_workers = int(self.daemon_workers)
+                self.daemon_queue_size = config.get('daemon', 'queue_size')
+                self.daemon_queue_size = int(self.daemon_queue_size)
 
         except ConfigParser.Error as e:
             raise ConfigError("Configuration error: %s" % str(e))
@@ -115,6 +388,8 @@ class SMTP(object):
             raise InternalError("Blacklist error: %s" % str(e))
         except core.ConfigError as e:
             raise InternalError("Core error: %s" % str(e))
+        except spool.SpoolError as e:
+            raise InternalError("Spool error: %s" % str(e))
 
         # logging
         log = logging.getLogger(__name__)
@@ -197,22 +472,143 @@ class SMTP(object):
             addr = m.group(1)
         return addr
 
-    def _get_content(self, email):
-        """Get the body content of an email.
+    def _read_lines(self, fp):
+        """Read the lines of an email, up to max_size bytes.
+
+        :param: fp (object) file-like object to read the email from.
+
+        :return: (generator) the lines read.
+
+        """
+        left = self.max_size
+        while left > 0:
+            line = fp.readline(min(left, 65536))
+            if not line:
+                return
+            left -= len(line)
+            yield line
+
+    def _read_headers(self, lines):
+        """Read the headers of an email (or of a part of it).
+
+        :param: lines (generator) the lines of the email.
+
+        :return: (object) email object with the headers found.
+
+        """
+        parser = FeedParser()
+        for line in lines:
+            parser.feed(line)
+            if line in ('\n', '\r\n'):
+                break
+        return parser.close()
+
+    def _read_text_part(self, lines, boundary, fallback=None):
+        """Read the body of the first text part of a multipart email.
+
+        Nested multiparts are searched too. A text/plain part is preferred;
+        the first text part of another type (e.g. text/html) is only used
+        if there isn't one. Other parts are skipped without parsing them,
+        and nothing is read after the text/plain part.
+
+        :param: lines (generator) the lines of the email, after the headers.
+        :param: boundary (string) the boundary of the multipart email.
+        :param: fallback (list) where nested calls keep the body of the
+                first text part that isn't text/plain.
+
+        :return: (string/None) the body of the text part, None if there
+                 isn't one.
+
+        """
+        nested = fallback is not None
+        if not nested:
+            fallback = []
+
+        if boundary is not None:
+            body = self._read_parts(lines, boundary, fallback)
+            if body is not None:
+                return body
+
+        if nested or not fallback:
+            return None
+        return fallback[0]
+
+    def _read_parts(self, lines, boundary, fallback):
+        """Look for a text/plain part in the parts of a multipart email.
+
+        :param: lines (generator) the lines of the email, after the headers.
+        :param: boundary (string) the boundary of the multipart email.
+        :param: fallback (list) see _read_text_part().
+
+        :return: (string/None) the body of the text/plain part, None if
+                 there isn't one.
+
+        """
+        delimiter = '--' + boundary
+
+        # we look for the beginning of every part
+        for line in lines:
+            if line.startswith(delimiter):
+                break
+        else:
+            return None
+
+        while line.rstrip() != delimiter + '--':
+            part = self._read_headers(lines)
+            maintype = part.get_content_maintype()
+
+            if maintype == 'multipart':
+                body = self._read_text_part(
+                    lines, part.get_boundary(), fallback
+                )
+                if body is not None:
+                    return body
+                # keep looking in the rest of this multipart
+
+            body = []
+            for line in lines:
+                if line.startswith(delimiter):
+                    break
+                if maintype == 'text':
+                    body.append(line)
+            else:
+                line = delimiter + '--'
+
+            if part.get_content_type() == 'text/plain':
+                return ''.join(body)
+            if maintype == 'text' and not fallback:
+                fallback.append(''.join(body))
+
+        return None
+
+    def read_email(self, fp):
+        """Read the headers and the text of an incoming email.
 
-        :param: email (object) the email object to extract the content from.
+        Only the first max_size bytes are read, and we stop as soon as we
+        have the headers and the first text part, so big attachments are
+        never parsed nor kept in memory. The rest of the email is
+        discarded, so the sender doesn't fail writing it.
 
-        :return: (string) body of the message.
+        :param: fp (object) file-like object to read the email from.
+
+        :return: (tuple) email object with the headers, and the body of
+                 the first text part (None if there isn't one).
 
         """
-        # get the body content of the email
-        maintype = email.get_content_maintype()
+        lines = self._read_lines(fp)
+        parsed_msg = self._read_headers(lines)
+        content = None
+
+        maintype = parsed_msg.get_content_maintype()
         if maintype == 'multipart':
-            for part in email.get_payload():
-                if part.get_content_maintype() == 'text':
-                    return part.get_payload()
+            content = self._read_text_part(lines, parsed_msg.get_boundary())
         elif maintype == 'text':
-            return email.get_payload()
+            content = ''.join(lines)
+
+        while fp.read(65536):
+            pass
+
+        return parsed_msg, content
 
     def _get_msg(self, msgid, lc):
         """Get message identified by msgid in a specific locale.
@@ -225,11 +621,7 @@ class SMTP(object):
         """
         # obtain the content in the proper language
         try:
-            t = gettext.translation(lc, self.i18ndir, languages=[lc])
-            _ = t.ugettext
-
-            msgstr = _(msgid)
-            return msgstr
+            return self.i18n.get_msg(msgid, lc)
         except IOError as e:
             raise ConfigError("%s" % str(e))
 
@@ -259,41 +651,15 @@ class SMTP(object):
         """Parse the text part of the email received.
 
         Try to figure out what the user is asking, namely, the type
-        of request, the package and os required (if applies).
+        of request, the package and os required (if applies). The locale
+        is obtained from our address, see _parse_email().
 
         :param: msg (string) the content of the email to be parsed.
 
-        :return: (list) 3-tuple with the type of request, os and pt info.
+        :return: (dict) the type of request and os.
 
         """
-        # by default we asume the request is asking for help
-        req = {}
-        req['type'] = 'help'
-        req['os'] = None
-
-        # core knows what OS are supported
-        supported_os = self.core.get_supported_os()
-
-        # search for OS or mirrors request
-        # if nothing is found, help by default
-        found_request = False
-        words = re.split('\s+', msg.strip())
-        for word in words:
-            if not found_request:
-                # OS first
-                for os in supported_os:
-                    if re.match(os, word, re.IGNORECASE):
-                        req['os'] = os
-                        req['type'] = 'links'
-                        found_request = True
-                        break
-                # mirrors
-                if re.match("mirrors?", word, re.IGNORECASE):
-                    req['type'] = 'mirrors'
-                    found_request = True
-            else:
-                break
-        return req
+        return self.parser.parse(msg, find_lc=False)
 
     def _create_email(self, from_addr, to_addr, subject, msg):
         """Create an email object.
@@ -319,11 +685,47 @@ class SMTP(object):
 
         return email_obj
 
-    def _send_email(self, from_addr, to_addr, subject, msg, attach=None):
-        """Send an email.
+    def _get_attachment(self, path):
+        """Get the MIME part for attaching a file.
 
-        Take a 'from' and 'to' addresses, a subject and the content, creates
-        the email and send it.
+        The file is read and encoded only once; the part is built again
+        only if the file changes (e.g. when get_mirrors.py updates the
+        mirrors list).
+
+        :param: path (string) the path of the file.
+
+        :raise: IOError/OSError if the file can't be read.
+
+        :return: (object) the MIME part, already encoded.
+
+        """
+        st = os.stat(path)
+        stamp = (st.st_mtime, st.st_size)
+
+        cached = self.attachments.get(path)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+
+        part = MIMEBase('application', "octet-stream")
+        with open(path, "rb") as f:
+            part.set_payload(f.read())
+        Encoders.encode_base64(part)
+
+        part.add_header(
+            'Content-Disposition',
+            'attachment; filename="mirrors.txt"'
+        )
+
+        self.attachments[path] = (stamp, part)
+        return part
+
+    def _render_email(self, from_addr, to_addr, subject, msg, attach=None):
+        """Render an email ready to be sent.
+
+        Replies of the same kind only differ in the recipient, so each
+        reply is built and serialized once per sender, subject, content and
+        attachment. After that, rendering it is just filling in the 'To'
+        header.
 
         :param: from_addr (string) the address of the sender.
         :param: to_addr (string) the address of the recipient.
@@ -331,30 +733,68 @@ class SMTP(object):
         :param: msg (string) the content of the email.
         :param: attach (string) the path of the mirrors list.
 
+        :raise: SendEmailError if the recipient or the attachment are not
+                valid.
+
+        :return: (string) the email.
+
         """
-        email_obj = self._create_email(from_addr, to_addr, subject, msg)
+        if '\n' in to_addr or '\r' in to_addr:
+            raise SendEmailError("Invalid recipient address")
 
+        part = None
         if(attach):
             # for now, the only email with attachment is the one for mirrors
             try:
-                part = MIMEBase('application', "octet-stream")
-                part.set_payload(open(attach, "rb").read())
-                Encoders.encode_base64(part)
-
-                part.add_header(
-                    'Content-Disposition',
-                    'attachment; filename="mirrors.txt"'
-                )
+                part = self._get_attachment(attach)
+            except (IOError, OSError) as e:
+                raise SendEmailError('Error with mirrors: %s' % str(e))
 
+        key = (from_addr, subject, msg, part)
+        template = self.templates.get(key)
+        if template is None:
+            email_obj = self._create_email(
+                from_addr, RECIPIENT_MARK, subject, msg
+            )
+            if part is not None:
                 email_obj.attach(part)
-            except IOError as e:
-                raise SendEmailError('Error with mirrors: %s' % str(e))
+
+            # the mark only appears in the 'To' header
+            template = email_obj.as_string().split(RECIPIENT_MARK, 1)
+
+            # old templates are useless once the links or mirrors change
+            if len(self.templates) >= MAX_TEMPLATES:
+                self.templates.clear()
+            self.templates[key] = template
+
+        return to_addr.join(template)
+
+    def _send_email(self, from_addr, to_addr, subject, msg, attach=None):
+        """Send an email.
+
+        Take a 'from' and 'to' addresses, a subject and the content, creates
+        the email and send it. If there is a spool, the email is queued
+        there and sent later by send_spool().
+
+        :param: from_addr (string) the address of the sender.
+        :param: to_addr (string) the address of the recipient.
+        :param: subject (string) the subject of the email.
+        :param: msg (string) the content of the email.
+        :param: attach (string) the path of the mirrors list.
+
+        """
+        raw_msg = self._render_email(from_addr, to_addr, subject, msg, attach)
+
+        if self.spool is not None:
+            try:
+                self.spool.add(from_addr, to_addr, raw_msg)
+                return
+            except spool.SpoolError as e:
+                raise SendEmailError("Error with spool: %s" % str(e))
 
         try:
-            s = smtplib.SMTP("localhost")
-            s.sendmail(from_addr, to_addr, email_obj.as_string())
-            s.quit()
-        except smtplib.SMTPException as e:
+            self.smtp_pool.sendmail(from_addr, to_addr, raw_msg)
+        except (smtplib.SMTPException, socket.error) as e:
             raise SendEmailError("Error with SMTP: %s" % str(e))
 
     def _send_links(self, links, lc, os, from_addr, to_addr):
@@ -437,23 +877,43 @@ class SMTP(object):
     def process_email(self, raw_msg):
         """Process the email received.
 
-        Create an email object from the string received. The processing
-        flow is as following:
+        Read the email (see read_email()) and reply to it (see
+        reply_email()).
+
+        :param: raw_msg (string/object) the email received, or a file-like
+                object to read it from (e.g. sys.stdin).
+
+        :raise: InternalError if something goes wrong while asking for the
+                links to the Core module.
+
+        """
+        if isinstance(raw_msg, basestring):
+            raw_msg = StringIO.StringIO(raw_msg)
+
+        parsed_msg, content = self.read_email(raw_msg)
+        self.reply_email(parsed_msg, content)
+
+    def reply_email(self, parsed_msg, content):
+        """Reply to the email received.
+
+        The processing flow is as following:
 
             - check for blacklisted address.
             - parse the email.
             - check the type of request.
             - send reply.
 
-        :param: raw_msg (string) the email received.
+        :param: parsed_msg (object) email object with the headers.
+        :param: content (string) the body of the email.
 
         :raise: InternalError if something goes wrong while asking for the
                 links to the Core module.
 
         """
         self.log.debug("Processing email")
-        parsed_msg = email.message_from_string(raw_msg)
-        content = self._get_content(parsed_msg)
+        if content is None:
+            # no text found (at least not within max_size), send help
+            content = ''
         from_addr = parsed_msg['From']
         to_addr = parsed_msg['To']
         bogus_request = False
@@ -533,3 +993,136 @@ class SMTP(object):
                                              "server: %s" % str(e))
         finally:
             self.log.debug("Request processed")
+
+    def start_daemon(self):
+        """Process the emails received through a Unix socket.
+
+        Instead of starting a new process for every email, the MTA pipes
+        the emails to pipe_email.py, which writes them to our socket. The
+        emails are processed by a pool of workers sharing this object, so
+        the configuration, links and translations are loaded only once.
+
+        :raise: ConfigError if the daemon section is missing.
+
+        """
+        if self.daemon_socket is None:
+            raise ConfigError("Configuration error: no daemon section")
+
+        if os.path.exists(self.daemon_socket):
+            # left behind by a previous run
+            os.remove(self.daemon_socket)
+
+        pool = workers.WorkerPool(
+            self.daemon_workers, self.daemon_queue_size, self.log
+        )
+        server = EmailServer(self.daemon_socket, self, pool)
+        self.server = server
+
+        self.log.info("Listening for emails on %s" % self.daemon_socket)
+        try:
+            server.serve_forever()
+        finally:
+            self.log.info("Stopping daemon")
+            server.server_close()
+            os.remove(self.daemon_socket)
+            pool.stop()
+            self.close()
+
+    def stop_daemon(self):
+        """Stop the daemon started by start_daemon() from another thread.
+
+        start_daemon() returns once the emails queued are processed.
+
+        """
+        if self.server is not None:
+            self.server.shutdown()
+
+    def _send_spooled(self, msg_id, from_addr, to_addr, msg):
+        """Send an email from the spool.
+
+        :param: msg_id (int) the id of the email in the spool.
+        :param: from_addr (string) the address of the sender.
+        :param: to_addr (string) the address of the recipient.
+        :param: msg (string) the email.
+
+        """
+        try:
+            self.smtp_pool.sendmail(from_addr, to_addr, msg)
+        except (smtplib.SMTPException, socket.error) as e:
+            # 5xx replies won't change if we try again, 4xx might
+            if isinstance(e, smtplib.SMTPRecipientsRefused):
+                permanent = all(
+                    code >= 500 for code, resp in e.recipients.values()
+                )
+            else:
+                permanent = getattr(e, 'smtp_code', 0) >= 500
+
+            if self.spool.failed(msg_id, str(e), permanent):
+                self.log.warning("Error sending email, will retry: %s" %
+                                 str(e))
+            else:
+                self.log.error("Error sending email, giving up: %s" % str(e))
+            return
+
+        self.spool.sent(msg_id)
+
+    def send_spool(self, once=False):
+        """Send the replies queued in the spool.
+
+        Emails are claimed in batches and sent by a pool of workers
+        sharing the connections to the SMTP server. Failed emails are
+        retried later by the spool (see gettor.spool).
+
+        :param: once (bool) return once the spool is empty instead of
+                waiting for new emails.
+
+        :raise: ConfigError if the spool section is missing.
+        :raise: InternalError if the spool database is not working.
+
+        """
+        if self.spool is None:
+            raise ConfigError("Configuration error: no spool section")
+
+        pool = workers.WorkerPool(
+            self.spool_workers, self.spool_batch_size, self.log
+        )
+
+        self.log.info("Sending emails from the spool")
+        try:
+            while True:
+                try:
+                    batch = self.spool.claim(self.spool_batch_size)
+                except spool.SpoolError as e:
+                    raise InternalError("Spool error: %s" % str(e))
+
+                if not batch:
+                    if once:
+                        break
+                    time.sleep(SPOOL_POLL_INTERVAL)
+                    continue
+
+                self.log.debug("Sending %d emails" % len(batch))
+                rejected = []
+                for msg_id, from_addr, to_addr, msg in batch:
+                    if not pool.submit(
+                        self._send_spooled, msg_id, from_addr, to_addr, msg
+                    ):
+                        rejected.append(msg_id)
+                pool.join()
+
+                # don't leave them leased until LEASE_TIME
+                if rejected:
+                    self.log.warning("Workers busy, releasing %d emails" %
+                                     len(rejected))
+                    try:
+                        self.spool.release(rejected)
+                    except spool.SpoolError as e:
+                        raise InternalError("Spool error: %s" % str(e))
+                    time.sleep(SPOOL_POLL_INTERVAL)
+        finally:
+            pool.stop()
+            self.close()
+
+    def close(self):
+        """Close the connections to the SMTP server."""
+        self.smtp_pool.close()
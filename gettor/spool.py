@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of GetTor, a Tor Browser distribution system.
+#
+# :authors: Israel Leiva <ilv@riseup.net>
+#           see also AUTHORS file
+#
+# :copyright:   (c) 2008-2015, The Tor Project, Inc.
+#               (c) 2015, Israel Leiva
+#
+# :license: This is Free Software. See LICENSE for license information.
+
+import time
+import sqlite3
+
+import db
+
+"""On-disk queue of outgoing emails."""
+
+# seconds a claimed email is reserved for the sender that claimed it.
+# If the sender dies, the email is claimed again after this time.
+LEASE_TIME = 300
+
+# maximum delay between retries, in seconds
+MAX_BACKOFF = 6 * 3600
+
+
+class SpoolError(Exception):
+    pass
+
+
+class Spool(db.DB):
+    """Queue of outgoing emails stored in a SQLite database.
+
+    Emails are added by the services replying to requests and removed by
+    a sender once delivered. Failed emails are retried with exponential
+    backoff and kept as dead letters after max_attempts.
+
+    Public methods:
+
+        add(): Queue an email.
+        claim(): Get a batch of emails ready to be sent.
+        sent(): Remove an email that has been delivered.
+        release(): Give back claimed emails that weren't tried.
+        failed(): Schedule a retry of an email, or give up on it.
+        count(): Get the number of queued emails and dead letters.
+
+    Exceptions:
+
+        SpoolError: Something went wrong with the spool database.
+
+    """
+
+    def __init__(self, dbname, max_attempts, backoff):
+        """Create a new spool, and its table if it doesn't exist.
+
+        :param: dbname (string) the path of the spool database.
+        :param: max_attempts (int) number of attempts before giving up.
+        :param: backoff (int) seconds to wait before the first retry.
+
+        """
+        db.DB.__init__(self, dbname)
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+
+        try:
+            with self._transaction() as cur:
+                cur.execute(
+                    "CREATE TABLE IF NOT EXISTS outbox(id INTEGER PRIMARY KEY,"
+                    " from_addr BLOB, to_addr BLOB, msg BLOB, attempts INT,"
+                    " next_attempt REAL, dead INT, error TEXT)"
+                )
+                cur.execute(
+                    "CREATE INDEX IF NOT EXISTS outbox_next"
+                    " ON outbox(dead, next_attempt)"
+                )
+        except (sqlite3.Error, db.DBError) as e:
+            raise SpoolError("%s" % str(e))
+
+    def add(self, from_addr, to_addr, msg):
+        """Queue an email.
+
+        :param: from_addr (string) the address of the sender.
+        :param: to_addr (string) the address of the recipient.
+        :param: msg (string) the email, ready to be sent.
+
+        """
+        # stored as bytes, sqlite3 refuses 8-bit strings as text (e.g.
+        # translated replies)
+        try:
+            with self._transaction() as cur:
+                cur.execute(
+                    "INSERT INTO outbox(from_addr, to_addr, msg, attempts,"
+                    " next_attempt, dead) VALUES(?,?,?,0,?,0)",
+                    (sqlite3.Binary(from_addr), sqlite3.Binary(to_addr),
+                     sqlite3.Binary(msg), time.time())
+                )
+        except (sqlite3.Error, db.DBError) as e:
+            raise SpoolError("%s" % str(e))
+
+    def claim(self, batch_size):
+        """Get a batch of emails ready to be sent.
+
+        Claimed emails are reserved for LEASE_TIME seconds, so concurrent
+        senders don't send them twice.
+
+        :param: batch_size (int) maximum number of emails.
+
+        :return: (list) (id, from_addr, to_addr, msg) of each email.
+
+        """
+        now = time.time()
+
+        try:
+            with self._transaction() as cur:
+                cur.execute(
+                    "SELECT id, from_addr, to_addr, msg FROM outbox"
+                    " WHERE dead = 0 AND next_attempt <= ?"
+                    " ORDER BY next_attempt LIMIT ?", (now, batch_size)
+                )
+                batch = [
+                    (row[0], str(row[1]), str(row[2]), str(row[3]))
+                    for row in cur.fetchall()
+                ]
+                cur.executemany(
+                    "UPDATE outbox SET next_attempt = ? WHERE id = ?",
+                    [(now + LEASE_TIME, row[0]) for row in batch]
+                )
+        except (sqlite3.Error, db.DBError) as e:
+            raise SpoolError("%s" % str(e))
+
+        return batch
+
+    def sent(self, msg_id):
+        """Remove an email that has been delivered.
+
+        :param: msg_id (int) the id of the email.
+
+        """
+        try:
+            with self._transaction() as cur:
+                cur.execute("DELETE FROM outbox WHERE id = ?", (msg_id,))
+        except (sqlite3.Error, db.DBError) as e:
+            raise SpoolError("%s" % str(e))
+
+    def release(self, msg_ids):
+        """Give back claimed emails that weren't tried.
+
+        The lease is dropped so they can be claimed again right away,
+        without counting an attempt.
+
+        :param: msg_ids (list) the ids of the emails.
+
+        """
+        try:
+            with self._transaction() as cur:
+                cur.executemany(
+                    "UPDATE outbox SET next_attempt = ? WHERE id = ?",
+                    [(time.time(), msg_id) for msg_id in msg_ids]
+                )
+        except (sqlite3.Error, db.DBError) as e:
+            raise SpoolError("%s" % str(e))
+
+    def failed(self, msg_id, error, permanent=False):
+        """Schedule a retry of an email, or give up on it.
+
+        :param: msg_id (int) the id of the email.
+        :param: error (string) why the email couldn't be sent.
+        :param: permanent (bool) true if retrying won't help (e.g. the
+                recipient was rejected).
+
+        :return: (bool) true if the email will be retried, false if it's
+                 now a dead letter.
+
+        """
+        # SMTP errors may quote the (8-bit) addresses
+        if isinstance(error, str):
+            error = error.decode('utf-8', 'replace')
+
+        try:
+            with self._transaction() as cur:
+                cur.execute("SELECT attempts FROM outbox WHERE id = ?",
+                            (msg_id,))
+                row = cur.fetchone()
+                if row is None:
+                    return False
+
+                attempts = row['attempts'] + 1
+                dead = int(permanent or attempts >= self.max_attempts)
+                delay = min(self.backoff * 2 ** (attempts - 1), MAX_BACKOFF)
+
+                cur.execute(
+                    "UPDATE outbox SET attempts = ?, next_attempt = ?,"
+                    " dead = ?, error = ? WHERE id = ?",
+                    (attempts, time.time() + delay, dead, error, msg_id)
+                )
+        except (sqlite3.Error, db.DBError) as e:
+            raise SpoolError("%s" % str(e))
+
+        return not dead
+
+    def count(self):
+        """Get the number of queued emails and dead letters.
+
+        :return: (tuple) number of queued emails and dead letters.
+
+        """
+        try:
+            cur = self.con.cursor()
+            cur.execute("SELECT COUNT(*) FROM outbox WHERE dead = 0")
+            queued = cur.fetchone()[0]
+            cur.execute("SELECT COUNT(*) FROM outbox WHERE dead = 1")
+            dead = cur.fetchone()[0]
+        except (sqlite3.Error, db.DBError) as e:
+            raise SpoolError("%s" % str(e))
+
+        return queued, dead
@@ -12,15 +12,23 @@
 # :license: This is Free Software. See LICENSE for license information.
 
 import os
-import re
+import time
+import heapq
+import Queue
+import random
 import tweepy
 import logging
-import gettext
+import itertools
+import threading
 import ConfigParser
 
 import core
+import i18n
 import utils
+import workers
+import keywords
 import blacklist
+import ratelimit
 
 """Twitter channel for distributing links to download Tor Browser."""
 
@@ -30,6 +38,22 @@ OS = {
     'windows': 'Windows'
 }
 
+# direct messages we can send (limit) per period of seconds, and how many
+# of them can be sent in a row
+DM_LIMIT = 1000
+DM_PERIOD = 24 * 3600
+DM_BURST = 15
+
+# replies waiting to be sent, and retries of the failed ones
+DM_QUEUE_SIZE = 1000
+DM_MAX_ATTEMPTS = 5
+DM_BACKOFF = 15
+DM_MAX_BACKOFF = 15 * 60
+
+# workers processing the requests received
+WORKERS = 2
+QUEUE_SIZE = 100
+
 
 class ConfigError(Exception):
     pass
@@ -39,6 +63,251 @@ class InternalError(Exception):
     pass
 
 
+class DMSender(object):
+    """ Send direct messages from a queue, within the API rate limits.
+
+    A thread takes the messages queued in batches (all the ones waiting)
+    and sends them one at a time, taking a token from a token bucket for
+    each of them. Messages rejected because of the rate limit (429) or a
+    server error (5xx) are scheduled again after a random (jittered)
+    exponential backoff, up to max_attempts times. Other messages are
+    sent meanwhile, so a failing recipient doesn't hold up the rest.
+
+    Tokens can be more than a minute apart, so stop() doesn't wait for
+    them: it sends the messages that can be sent right away and drops
+    the rest.
+
+    Public methods:
+
+        start(): Start sending the messages queued.
+        stop(): Send the messages we have tokens for and stop.
+        send(): Queue a message to be sent.
+        stats(): Get the counters of the sender.
+
+    """
+    def __init__(self, api, bucket, queue_size, max_attempts, backoff,
+                 max_backoff, log):
+        """ Create a new sender.
+
+        :param: api (object) the tweepy API object used to send messages.
+        :param: bucket (object) the ratelimit.TokenBucket for the messages.
+        :param: queue_size (int) maximum number of messages waiting.
+        :param: max_attempts (int) times a message is tried before giving
+                up on it.
+        :param: backoff (int) seconds to wait before the first retry.
+        :param: max_backoff (int) maximum seconds to wait between retries.
+        :param: log (object) the logger.
+        """
+        self.api = api
+        self.bucket = bucket
+        self.queue = Queue.Queue(queue_size)
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.log = log
+        self.thread = None
+
+        # messages taken from the queue, only used by the sender thread:
+        # heap of (not before, sequence, user_id, text, attempts so far)
+        self.pending = []
+        self.sequence = itertools.count()
+
+        # updated by the sender thread and by the callers of send()
+        self.lock = threading.Lock()
+        self.counters = {
+            'sent': 0,
+            'retried': 0,
+            'failed': 0,
+            'rejected': 0,
+            'dropped': 0
+        }
+
+    def _count(self, name):
+        """ Increase a counter.
+
+        :param: name (string) the name of the counter.
+        """
+        with self.lock:
+            self.counters[name] += 1
+
+    def _is_temporary(self, e):
+        """ Check if sending a message failed for a temporary reason.
+
+        :param: e (object) the tweepy.TweepError raised.
+
+        :return: (bool) true if the message should be sent again.
+        """
+        response = getattr(e, 'response', None)
+        if response is None:
+            # no answer from the API at all (e.g. network error)
+            return True
+        status = response.status_code
+        return status == 429 or status >= 500
+
+    def _get_backoff(self, attempt):
+        """ Get the seconds to wait before trying a message again.
+
+        :param: attempt (int) the number of attempts so far.
+
+        :return: (float) seconds to wait.
+        """
+        delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+        # spread the retries so they don't all happen at once
+        return random.uniform(delay / 2.0, delay)
+
+    def _schedule(self, user_id, text, attempt, not_before):
+        """ Add a message to the ones waiting to be sent.
+
+        :param: user_id (string) the recipient.
+        :param: text (string) the message.
+        :param: attempt (int) the number of attempts so far.
+        :param: not_before (float) time before which it isn't sent.
+        """
+        heapq.heappush(
+            self.pending,
+            (not_before, next(self.sequence), user_id, text, attempt)
+        )
+
+    def _take_queued(self, timeout):
+        """ Take all the messages queued, waiting for the first one.
+
+        :param: timeout (float) seconds to wait for a message, None to wait
+                until there is one.
+
+        :return: (bool) false if the stop mark (None) was found.
+        """
+        try:
+            msg = self.queue.get(True, timeout)
+            while msg is not None:
+                self._schedule(msg[0], msg[1], 0, time.time())
+                msg = self.queue.get_nowait()
+            return False
+        except Queue.Empty:
+            return True
+
+    def _drop_pending(self):
+        """ Give up on the messages waiting to be sent, when stopping. """
+        dropped = len(self.pending)
+        self.pending = []
+        with self.lock:
+            self.counters['dropped'] += dropped
+        self.log.warning("Stopped with %d messages waiting, dropping them"
+                         % dropped)
+
+    def _send(self, user_id, text, attempt):
+        """ Send a message, and schedule it again if it fails for a while.
+
+        A token must have been taken for it already.
+
+        :param: user_id (string) the recipient.
+        :param: text (string) the message.
+        :param: attempt (int) the number of attempts so far.
+        """
+        attempt += 1
+        try:
+            self.api.send_direct_message(user_id=user_id, text=text)
+            self._count('sent')
+            return
+        except tweepy.TweepError as e:
+            if attempt >= self.max_attempts or not self._is_temporary(e):
+                self._count('failed')
+                self.log.error("Couldn't send message: %s" % str(e))
+                return
+
+            delay = self._get_backoff(attempt)
+            if getattr(e, 'response', None) is not None and \
+                    e.response.status_code == 429:
+                # don't make the limit worse with the next messages
+                self.bucket.empty()
+            self._count('retried')
+            self.log.warning(
+                "Sending message failed (%s), trying again in %.1f seconds"
+                % (str(e), delay)
+            )
+            self._schedule(user_id, text, attempt, time.time() + delay)
+        except Exception as e:
+            self._count('failed')
+            self.log.error("Couldn't send message: %s" % str(e))
+
+    def _work(self):
+        """ Send messages until a stop mark (None) is found in the queue.
+
+        Waiting for a retry to be due or for a token is cut short by the
+        stop mark. Once stopping, the messages are sent only while they're
+        due and there are tokens left, the rest are dropped.
+        """
+        running = True
+        while running or self.pending:
+            if running:
+                # wait for new messages until the next one is due
+                timeout = None
+                if self.pending:
+                    timeout = max(0, self.pending[0][0] - time.time())
+                running = self._take_queued(timeout)
+
+            if not self.pending:
+                continue
+            if self.pending[0][0] > time.time():
+                # none of them is due
+                if not running:
+                    self._drop_pending()
+                continue
+
+            delay = self.bucket.take()
+            if delay:
+                if running:
+                    # wait for the token, or for new messages
+                    running = self._take_queued(delay)
+                else:
+                    self._drop_pending()
+                continue
+
+            msg = heapq.heappop(self.pending)
+            self._send(*msg[2:])
+
+    def start(self):
+        """ Start sending the messages queued. """
+        self.thread = threading.Thread(target=self._work, name='dm-sender')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """ Send the messages we have tokens for and stop. """
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def send(self, user_id, text):
+        """ Queue a message to be sent.
+
+        :param: user_id (string) the recipient.
+        :param: text (string) the message.
+
+        :return: (bool) true if the message was queued, false if the queue
+                 is full.
+        """
+        try:
+            self.queue.put_nowait((user_id, text))
+            return True
+        except Queue.Full:
+            self._count('rejected')
+            self.log.warning("Too many messages queued, dropping reply")
+            return False
+
+    def stats(self):
+        """ Get the counters of the sender.
+
+        :return: (dict) messages waiting ('queued', including retries),
+                 sent, retried, failed, rejected because the queue was
+                 full and dropped when stopping.
+        """
+        with self.lock:
+            stats = dict(self.counters)
+        stats['queued'] = self.queue.qsize() + len(self.pending)
+        return stats
+
+
 class GetTorStreamListener(tweepy.StreamListener):
     """ Basic listener for Twitter's streaming API."""
     def __init__(self, bot):
@@ -46,17 +315,25 @@ class GetTorStreamListener(tweepy.StreamListener):
         super(GetTorStreamListener, self).__init__(self.bot.api)
 
     def on_direct_message(self, status):
-        """ Right now we only care about direct messages. """
+        """ Right now we only care about direct messages.
+
+        Messages are just queued, so reading the stream never waits for
+        the database or the API.
+        """
         if status.direct_message['sender']['id_str'] != self.bot.bot_info.id_str:
-            self.bot.parse_request(status.direct_message)
+            self.bot.dispatch(status.direct_message)
 
 
 class TwitterBot(object):
     """ Receive and reply requests via Twitter. """
-    def __init__(self, cfg=None):
+    def __init__(self, cfg=None, core_obj=None, bl_obj=None):
         """ Create new object by reading a configuration file.
 
         :param: cfg (string) the path of the configuration file.
+        :param: core_obj (object) Core object to use instead of creating
+                a new one (e.g. shared with other channels).
+        :param: bl_obj (object) Blacklist object to use instead of creating
+                a new one.
         """
 
         default_cfg = 'twitter.cfg'
@@ -79,20 +356,52 @@ class TwitterBot(object):
 
             self.mirrors = config.get('general', 'mirrors')
             self.i18ndir = config.get('i18n', 'dir')
+            self.i18n = i18n.Translator(self.i18ndir)
+            self.i18n.preload()
 
             logdir = config.get('log', 'dir')
             logfile = os.path.join(logdir, 'twitter.log')
             loglevel = config.get('log', 'level')
 
             blacklist_cfg = config.get('blacklist', 'cfg')
-            self.bl = blacklist.Blacklist(blacklist_cfg)
+            if bl_obj is None:
+                bl_obj = blacklist.Blacklist(blacklist_cfg)
+            self.bl = bl_obj
             self.bl_max_request = config.get('blacklist', 'max_requests')
             self.bl_max_request = int(self.bl_max_request)
             self.bl_wait_time = config.get('blacklist', 'wait_time')
             self.bl_wait_time = int(self.bl_wait_time)
 
+            self.dm_limit = DM_LIMIT
+            self.dm_period = DM_PERIOD
+            self.dm_burst = DM_BURST
+            self.dm_queue_size = DM_QUEUE_SIZE
+            self.dm_max_attempts = DM_MAX_ATTEMPTS
+            self.dm_backoff = DM_BACKOFF
+            self.dm_max_backoff = DM_MAX_BACKOFF
+            if config.has_section('dm'):
+                self.dm_limit = int(config.get('dm', 'limit'))
+                self.dm_period = int(config.get('dm', 'period'))
+                self.dm_burst = int(config.get('dm', 'burst'))
+                self.dm_queue_size = int(config.get('dm', 'queue_size'))
+                self.dm_max_attempts = int(config.get('dm', 'max_attempts'))
+                self.dm_backoff = int(config.get('dm', 'backoff'))
+                self.dm_max_backoff = int(config.get('dm', 'max_backoff'))
+
+            self.workers = WORKERS
+            self.queue_size = QUEUE_SIZE
+            if config.has_section('workers'):
+                self.workers = int(config.get('workers', 'workers'))
+                self.queue_size = int(config.get('workers', 'queue_size'))
+
             core_cfg = config.get('general', 'core_cfg')
-            self.core = core.Core(core_cfg)
+            if core_obj is None:
+                core_obj = core.Core(core_cfg)
+            self.core = core_obj
+            self.parser = keywords.RequestParser(
+                self.core.get_supported_os(),
+                self.core.get_supported_lc()
+            )
 
         except ConfigParser.Error as e:
             raise ConfigError("Configuration error: %s" % str(e))
@@ -115,6 +424,10 @@ class TwitterBot(object):
         log.addHandler(logfileh)
 
         self.log = log
+        # started by start()
+        self.stream = None
+        self.sender = None
+        self.pool = None
 
     def _is_blacklisted(self, username):
         """Check if a user is blacklisted.
@@ -147,63 +460,21 @@ class TwitterBot(object):
 
         """
         try:
-            t = gettext.translation(lc, self.i18ndir, languages=[lc])
-            _ = t.ugettext
-
-            msgstr = _(msgid)
-            return msgstr
+            return self.i18n.get_msg(msgid, lc)
         except IOError as e:
             raise ConfigError("%s" % str(e))
 
     def parse_text(self, msg):
         """ Parse the text part of a message.
 
-        Split the message in words and look for patterns for locale,
-        operating system and mirrors requests.
+        Look for the locale, operating system and type of request (see
+        gettor.keywords).
 
         :param: msg (string) the message received.
 
-        :return: request (list) 3-tuple with locale, os and type of request.
+        :return: (dict) the locale, os and type of request.
         """
-
-        # core knows what OS are supported
-        supported_os = self.core.get_supported_os()
-        supported_lc = self.core.get_supported_lc()
-
-        # default values
-        req = {}
-        req['lc'] = 'en'
-        req['os'] = None
-        req['type'] = 'help'
-
-        found_lc = False
-        found_os = False
-        found_mirrors = False
-
-        # analyze every word
-        words = re.split('\s+', msg.strip())
-        for word in words:
-            # look for lc and os
-            if not found_lc:
-                for lc in supported_lc:
-                    if re.match(lc, word, re.IGNORECASE):
-                        found_lc = True
-                        req['lc'] = lc
-            if not found_os:
-                for os in supported_os:
-                    if re.match(os, word, re.IGNORECASE):
-                        found_os = True
-                        req['os'] = os
-                        req['type'] = 'links'
-            # mirrors
-            if not found_mirrors:
-                if re.match("mirrors?", word, re.IGNORECASE):
-                    found_mirrors = True
-                    req['type'] = 'mirrors'
-            if (found_lc and found_os) or (found_lc and found_mirrors):
-                break
-
-        return req
+        return self.parser.parse(msg)
 
     def parse_request(self, dm):
         """ Process the request received.
@@ -257,15 +528,73 @@ class TwitterBot(object):
                     self.log.info('help; none; %s' % req['lc'])
                     reply = self._get_msg('help', 'en')
 
-                self.api.send_direct_message(
-                    user_id=sender_id,
-                    text=reply
-                )
+                self.sender.send(sender_id, reply)
 
         except (core.ConfigError, core.InternalError) as e:
             # if core failes, send the user an error message, but keep going
             self.log.error("Something went wrong internally: %s" % str(e))
             reply = self._get_msg('internal_error', 'en')
+            self.sender.send(sender_id, reply)
+
+    def dispatch(self, dm):
+        """ Queue a direct message to be processed by the workers.
+
+        :param: dm (status.direct_message) the direct message object received
+                via Twitter API.
+
+        :return: (bool) true if the message was queued, false if it was
+                 dropped because the workers are too busy.
+        """
+        if self.pool.submit(self.parse_request, dm):
+            return True
+        self.log.warning("Too many requests queued, dropping message")
+        return False
+
+    def start_workers(self, api):
+        """ Start the workers processing requests and sending replies.
+
+        :param: api (object) the tweepy API object used to send replies.
+        """
+        if self.sender is None:
+            bucket = ratelimit.TokenBucket(
+                float(self.dm_limit) / self.dm_period, self.dm_burst
+            )
+            self.sender = DMSender(
+                api,
+                bucket,
+                self.dm_queue_size,
+                self.dm_max_attempts,
+                self.dm_backoff,
+                self.dm_max_backoff,
+                self.log
+            )
+            self.sender.start()
+        if self.pool is None:
+            self.pool = workers.WorkerPool(
+                self.workers, self.queue_size, self.log
+            )
+
+    def stop_workers(self):
+        """ Process the requests queued, send the replies and stop.
+
+        Replies waiting for the rate limit are dropped (see DMSender).
+        """
+        if self.pool is not None:
+            self.pool.stop()
+            self.pool = None
+        if self.sender is not None:
+            self.sender.stop()
+            self.log.info('Replies sender stats: %s' % self.stats())
+            self.sender = None
+
+    def stats(self):
+        """ Get the counters of the replies sender.
+
+        :return: (dict) see DMSender.stats().
+        """
+        if self.sender is None:
+            return {}
+        return self.sender.stats()
 
     def start(self):
         """ Start the bot for handling requests.
@@ -284,10 +613,20 @@ class TwitterBot(object):
 
         self.api = tweepy.API(self.auth)
         self.bot_info = self.api.me()
+        self.start_workers(self.api)
 
-        stream = tweepy.Stream(
+        self.stream = tweepy.Stream(
             auth=self.api.auth,
             listener=GetTorStreamListener(self)
         )
 
-        stream.userstream()
+        try:
+            self.stream.userstream()
+        finally:
+            self.stop_workers()
+
+    def stop(self):
+        """ Disconnect the stream started by start(). """
+        if self.stream is not None:
+            self.log.info('Stopping the bot')
+            self.stream.disconnect()
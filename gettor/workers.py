@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of GetTor, a Tor Browser distribution system.
+#
+# :authors: Israel Leiva <ilv@riseup.net>
+#           see also AUTHORS file
+#
+# :copyright:   (c) 2008-2015, The Tor Project, Inc.
+#               (c) 2015, Israel Leiva
+#
+# :license: This is Free Software. See LICENSE for license information.
+
+import Queue
+import threading
+
+"""Pool of threads for handling requests in long-running services."""
+
+
+class WorkerPool(object):
+    """Run tasks in a fixed number of threads.
+
+    Tasks wait in a bounded queue; when it's full new tasks are rejected
+    so the caller can tell the client to try again later instead of
+    piling up work.
+
+    Public methods:
+
+        submit(): Queue a task to be run by one of the workers.
+        join(): Wait for the queued tasks.
+        stop(): Wait for the queued tasks and stop the workers.
+
+    """
+
+    def __init__(self, workers, queue_size, log):
+        """Create a new pool and start its workers.
+
+        :param: workers (int) number of threads.
+        :param: queue_size (int) maximum number of tasks waiting.
+        :param: log (object) logger for the errors raised by the tasks.
+
+        """
+        self.queue = Queue.Queue(queue_size)
+        self.log = log
+        self.threads = []
+
+        for i in range(workers):
+            self._start_worker(i, self.queue)
+
+    def _start_worker(self, i, queue):
+        """Start a worker taking tasks from a queue.
+
+        :param: i (int) the number of the worker.
+        :param: queue (object) the queue of tasks.
+
+        """
+        t = threading.Thread(
+            target=self._work, args=(queue,), name="worker-%d" % i
+        )
+        t.daemon = True
+        t.start()
+        self.threads.append(t)
+
+    def _work(self, queue):
+        """Run tasks until a stop mark (None) is found in the queue."""
+        while True:
+            task = queue.get()
+            try:
+                if task is None:
+                    return
+                func, args = task
+                func(*args)
+            except Exception as e:
+                # a failed task shouldn't take the worker down
+                self.log.error("Task failed: %s" % str(e))
+            finally:
+                queue.task_done()
+
+    def submit(self, func, *args):
+        """Queue a task to be run by one of the workers.
+
+        :param: func (function) the task.
+        :param: args (list) the arguments of the task.
+
+        :return: (bool) true if the task was queued, false if the queue
+                 is full.
+
+        """
+        try:
+            self.queue.put_nowait((func, args))
+            return True
+        except Queue.Full:
+            return False
+
+    def join(self):
+        """Wait for the queued tasks."""
+        self.queue.join()
+
+    def stop(self):
+        """Wait for the queued tasks and stop the workers."""
+        for t in self.threads:
+            self.queue.put(None)
+        for t in self.threads:
+            t.join()
+
+
+class KeyedWorkerPool(WorkerPool):
+    """Run tasks in a fixed number of threads, in order for each key.
+
+    Every worker has its own bounded queue, and tasks with the same key
+    (e.g. messages from the same user) always go to the same worker, so
+    they run one after the other in the order they were submitted.
+
+    When the queue of a worker is full, submit() rejects the task right
+    away instead of piling up work.
+
+    Public methods:
+
+        submit(): Queue a task to be run by the worker of its key.
+        join(): Wait for the queued tasks.
+        stop(): Wait for the queued tasks and stop the workers.
+
+    """
+
+    def __init__(self, workers, queue_size, log):
+        """Create a new pool and start its workers.
+
+        :param: workers (int) number of threads.
+        :param: queue_size (int) maximum number of tasks waiting for each
+                worker.
+        :param: log (object) logger for the errors raised by the tasks.
+
+        """
+        self.queues = [Queue.Queue(queue_size) for i in range(workers)]
+        self.log = log
+        self.threads = []
+
+        for i, queue in enumerate(self.queues):
+            self._start_worker(i, queue)
+
+    def submit(self, key, func, *args):
+        """Queue a task to be run by the worker of its key.
+
+        :param: key (string) tasks with the same key run in order.
+        :param: func (function) the task.
+        :param: args (list) the arguments of the task.
+
+        :return: (bool) true if the task was queued, false if the queue
+                 of the worker is full.
+
+        """
+        queue = self.queues[hash(key) % len(self.queues)]
+        try:
+            queue.put_nowait((func, args))
+            return True
+        except Queue.Full:
+            return False
+
+    def join(self):
+        """Wait for the queued tasks."""
+        for queue in self.queues:
+            queue.join()
+
+    def stop(self):
+        """Wait for the queued tasks and stop the workers."""
+        for queue in self.queues:
+            queue.put(None)
+        for t in self.threads:
+            t.join()
@@ -11,10 +11,8 @@
 # :license: This is Free Software. See LICENSE for license information.
 
 import os
-import re
 import sys
 import time
-import gettext
 import hashlib
 import logging
 import ConfigParser
@@ -24,12 +22,19 @@ from sleekxmpp.xmlstream.stanzabase import JID
 from sleekxmpp.exceptions import IqError, IqTimeout
 
 import core
+import i18n
 import utils
+import workers
+import keywords
 import blacklist
 
 
 """XMPP module for processing requests."""
 
+# workers processing the requests, see dispatch()
+WORKERS = 4
+QUEUE_SIZE = 25
+
 OS = {
     'osx': 'Mac OS X',
     'linux': 'Linux',
@@ -75,17 +80,25 @@ class Bot(ClientXMPP):
             self.disconnect()
 
     def message(self, msg):
+        # requests are processed by the workers of the XMPP object, so a
+        # slow request doesn't stop the bot from handling other messages
         if msg['type'] in ('chat', 'normal'):
-            msg_to_send = self.xmpp.parse_request(msg['from'], msg['body'])
-            if msg_to_send:
+            def reply(msg_to_send):
                 msg.reply(msg_to_send).send()
 
+            self.xmpp.dispatch(msg['from'], msg['body'], reply)
+
 
 class XMPP(object):
     """Receive and reply requests by XMPP.
 
     Public methods:
 
+        start_bot(): Start the bot for handling requests.
+        stop_bot(): Disconnect the bot.
+        start_workers(): Start the workers processing the requests.
+        stop_workers(): Stop the workers processing the requests.
+        dispatch(): Queue a request to be processed by the workers.
         parse_request(): parses a message and tries to figure out what the user
                          is asking for.
 
@@ -96,10 +109,14 @@ class XMPP(object):
 
     """
 
-    def __init__(self, cfg=None):
+    def __init__(self, cfg=None, core_obj=None, bl_obj=None):
     	"""Create new object by reading a configuration file.
 
         :param: cfg (string) the path of the configuration file.
+        :param: core_obj (object) Core object to use instead of creating
+                a new one (e.g. shared with other channels).
+        :param: bl_obj (object) Blacklist object to use instead of creating
+                a new one.
 
         """
         # define a set of default values
@@ -123,16 +140,32 @@ class XMPP(object):
             self.max_words = config.get('general', 'max_words')
             self.max_words = int(self.max_words)
             core_cfg = config.get('general', 'core_cfg')
-            self.core = core.Core(core_cfg)
+            if core_obj is None:
+                core_obj = core.Core(core_cfg)
+            self.core = core_obj
+            self.parser = keywords.RequestParser(
+                self.core.get_supported_os(),
+                self.core.get_supported_lc()
+            )
             self.i18ndir = config.get('i18n', 'dir')
+            self.i18n = i18n.Translator(self.i18ndir)
+            self.i18n.preload()
 
             blacklist_cfg = config.get('blacklist', 'cfg')
-            self.bl = blacklist.Blacklist(blacklist_cfg)
+            if bl_obj is None:
+                bl_obj = blacklist.Blacklist(blacklist_cfg)
+            self.bl = bl_obj
             self.bl_max_req = config.get('blacklist', 'max_requests')
             self.bl_max_req = int(self.bl_max_req)
             self.bl_wait_time = config.get('blacklist', 'wait_time')
             self.bl_wait_time = int(self.bl_wait_time)
 
+            self.workers = WORKERS
+            self.queue_size = QUEUE_SIZE
+            if config.has_section('workers'):
+                self.workers = int(config.get('workers', 'workers'))
+                self.queue_size = int(config.get('workers', 'queue_size'))
+
             logdir = config.get('log', 'dir')
             logfile = os.path.join(logdir, 'xmpp.log')
             loglevel = config.get('log', 'level')
@@ -161,6 +194,10 @@ class XMPP(object):
         log.propagate = False
         self.log = log
 
+        # started by start_bot()
+        self.bot = None
+        self.pool = None
+
     def start_bot(self):
         """Start the bot for handling requests.
 
@@ -168,9 +205,79 @@ class XMPP(object):
 
         """
         self.log.info("Starting the bot with account %s" % self.user)
-        xmpp = Bot(self.user, self.password, self)
-        xmpp.connect()
-        xmpp.process(block=True)
+        self.start_workers()
+        self.bot = Bot(self.user, self.password, self)
+        self.bot.connect()
+        try:
+            self.bot.process(block=True)
+        finally:
+            self.stop_workers()
+
+    def stop_bot(self):
+        """Disconnect the bot started by start_bot()."""
+        if self.bot is not None:
+            self.log.info("Stopping the bot")
+            self.bot.disconnect()
+
+    def start_workers(self):
+        """Start the workers processing the requests."""
+        if self.pool is None:
+            self.pool = workers.KeyedWorkerPool(
+                self.workers, self.queue_size, self.log
+            )
+
+    def stop_workers(self):
+        """Wait for the requests queued and stop the workers."""
+        if self.pool is not None:
+            self.pool.stop()
+            self.pool = None
+
+    def _process_request(self, account, msg, reply):
+        """Process a request and send the reply, if any.
+
+        :param: account (string) the account that did the request.
+        :param: msg (string) the body of the message sent to us.
+        :param: reply (function) sends a message back to the account.
+
+        """
+        msg_to_send = self.parse_request(account, msg)
+        if msg_to_send:
+            reply(msg_to_send)
+
+    def dispatch(self, account, msg, reply):
+        """Queue a request to be processed by the workers.
+
+        Requests from the same account are processed in the order they
+        arrive. This runs on the event thread of the bot, so it never
+        waits: the request is dropped if the workers are too busy, or if
+        they aren't running (before start_bot() or while stopping).
+
+        Dropping is deliberate load-shedding and nothing is sent back: the
+        queues are only full when someone floods us, and a 'busy' reply
+        to every message would answer the flood before the blacklist
+        does. Users can simply ask again.
+
+        :param: account (string) the account that did the request.
+        :param: msg (string) the body of the message sent to us.
+        :param: reply (function) sends a message back to the account.
+
+        :return: (bool) true if the request was queued, false if it was
+                 dropped.
+
+        """
+        # stop_workers() may reset it at any time
+        pool = self.pool
+        if pool is None:
+            self.log.warning("Workers not running, dropping message")
+            return False
+
+        # the resource changes between sessions, the user doesn't
+        key = JID(str(account)).bare
+        if pool.submit(key, self._process_request, account, msg, reply):
+            return True
+
+        self.log.warning("Too many requests queued, dropping message")
+        return False
 
     def _is_blacklisted(self, account):
         """Check if a user is blacklisted.
@@ -202,65 +309,23 @@ class XMPP(object):
         # obtain the content in the proper language
         self.log.debug("Trying to get translated text")
         try:
-            t = gettext.translation(lc, self.i18ndir, languages=[lc])
-            _ = t.ugettext
-
-            msgstr = _(msgid)
-            return msgstr
+            return self.i18n.get_msg(msgid, lc)
         except IOError as e:
             raise ConfigError("%s" % str(e))
 
     def _parse_text(self, msg):
         """Parse the text part of a message.
 
-        Split the message in words and look for patterns for locale,
-        operating system and built-in pluggable transport info.
+        Look for the locale, operating system and type of request (see
+        gettor.keywords).
 
         :param: msg (string) the message received.
-        :param: core_obj (object) the object of gettor core module.
 
-        :return: request (list) 4-tuple with locale, os, type of request
-                 and pt info.
+        :return: (dict) the locale, os and type of request.
 
         """
-        # core knows what OS are supported
-        supported_os = self.core.get_supported_os()
-        supported_lc = self.core.get_supported_lc()
-
         self.log.debug("Parsing text")
-        # default values
-        req = {}
-        req['lc'] = 'en'
-        req['os'] = None
-        req['type'] = 'help'
-
-        found_lc = False
-        found_os = False
-        found_mirrors = False
-
-        # analyze every word
-        for word in msg.split(' '):
-            # look for lc and os
-            if not found_lc:
-                for lc in supported_lc:
-                    if re.match(lc, word, re.IGNORECASE):
-                        found_lc = True
-                        req['lc'] = lc
-            if not found_os:
-                for os in supported_os:
-                    if re.match(os, word, re.IGNORECASE):
-                        found_os = True
-                        req['os'] = os
-                        req['type'] = 'links'
-            # mirrors
-            if not found_mirrors:
-                if re.match("mirrors?", word, re.IGNORECASE):
-                    found_mirrors = True
-                    req['type'] = 'mirrors'
-            if (found_lc and found_os) or (found_lc and found_mirrors):
-                break
-
-        return req
+        return self.parser.parse(msg)
 
     def parse_request(self, account, msg):
         """Process the request received.
@@ -288,8 +353,8 @@ class XMPP(object):
 
             # first let's find out how many words are in the message
             # request shouldn't be longer than 3 words, but just in case
-            words = re.split('\s+', msg.strip())
-            if len(words) > self.max_words:
+            words = keywords.count_words(msg, self.max_words + 1)
+            if words > self.max_words:
                 bogus_request = True
                 self.log.info("Message way too long")
                 self.log.info('invalid; none; none')
@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Thin client for the SMTP daemon (see process_email_daemon.py). It only
+# copies the email received on stdin to the daemon socket, so the MTA
+# doesn't have to start the whole GetTor machinery for every email.
+#
+# Usage: pipe_email.py /path/to/gettor/smtp/gettor.sock
+
+import sys
+import socket
+
+# tell the MTA to try again later (sysexits.h)
+EX_USAGE = 64
+EX_TEMPFAIL = 75
+
+def main():
+    if len(sys.argv) != 2:
+        sys.stderr.write("Usage: %s socket\n" % sys.argv[0])
+        sys.exit(EX_USAGE)
+
+    try:
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.connect(sys.argv[1])
+
+        while True:
+            chunk = sys.stdin.read(65536)
+            if not chunk:
+                break
+            s.sendall(chunk)
+        s.shutdown(socket.SHUT_WR)
+
+        reply = s.makefile().readline().strip()
+        s.close()
+    except socket.error as e:
+        sys.stderr.write("GetTor daemon not available: %s\n" % str(e))
+        sys.exit(EX_TEMPFAIL)
+
+    if reply != 'OK':
+        sys.stderr.write("GetTor daemon busy, try again later\n")
+        sys.exit(EX_TEMPFAIL)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+import signal
+import logging
+
+import gettor.channels
+
+def main():
+    logging_level = 'INFO'
+    logging_file = '/path/to/gettor/log/process_channels.log'
+    logging_format = '[%(levelname)s] %(asctime)s - %(message)s'
+    date_format = "%Y-%m-%d" # %H:%M:%S
+
+    logging.basicConfig(
+        format=logging_format,
+        datefmt=date_format,
+        filename = logging_file,
+        level = logging_level
+    )
+
+    # stop the channels cleanly on shutdown
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    logging.debug("Starting channels")
+    try:
+        server = gettor.channels.ChannelServer('/path/to/gettor/channels.cfg')
+        server.start()
+    except gettor.channels.ConfigError as e:
+        logging.error("Configuration error: %s" % str(e))
+    except gettor.channels.InternalError as e:
+        logging.error("Core module not working: %s" % str(e))
+    except Exception as e:
+        # in case something unexpected happens
+        logging.critical("Unexpected error: %s" % str(e))
+
+if __name__ == '__main__':
+    main()
@@ -24,8 +24,8 @@ def main():
     
     try:
         service = gettor.smtp.SMTP('/path/to/gettor/smtp.cfg')
-        incoming = sys.stdin.read()
-        service.process_email(incoming)
+        service.process_email(sys.stdin)
+        service.close()
         logging.debug("Email processed sucessfully")
     except gettor.smtp.ConfigError as e:
         logging.error("Configuration error: %s" % str(e))        
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+import signal
+import logging
+
+import gettor.smtp
+
+def main():
+    logging_level = 'INFO'
+    logging_file = '/path/to/gettor/log/process_email.log'
+    logging_format = '[%(levelname)s] %(asctime)s - %(message)s'
+    date_format = "%Y-%m-%d" # %H:%M:%S
+
+    logging.basicConfig(
+        format=logging_format,
+        datefmt=date_format,
+        filename = logging_file,
+        level = logging_level
+    )
+
+    # clean up the socket and the queued emails on shutdown
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    logging.debug("Starting SMTP daemon")
+    try:
+        service = gettor.smtp.SMTP('/path/to/gettor/smtp.cfg')
+        service.start_daemon()
+    except gettor.smtp.ConfigError as e:
+        logging.error("Configuration error: %s" % str(e))
+    except gettor.smtp.InternalError as e:
+        logging.error("Core module not working: %s" % str(e))
+    except Exception as e:
+        # in case something unexpected happens
+        logging.critical("Unexpected error: %s" % str(e))
+
+if __name__ == '__main__':
+    main()
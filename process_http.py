@@ -1,14 +1,35 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import gettor.http2
+import sys
+import argparse
+
+import gettor.http
 
 
 def main():
-    api = gettor.http2.HTTP('http.cfg')
-    api.load_data()
-    # api.run()
-    api.build()
+    parser = argparse.ArgumentParser(description='Build or serve the tree of'
+                                     ' GetTor RESTful API')
+    parser.add_argument('-r', '--rollback', action='store_true',
+                        help='serve the previous build again')
+    parser.add_argument('-s', '--serve', action='store_true',
+                        help='serve the API from memory instead of building'
+                        ' it (see the [server] section of http.cfg)')
+    args = parser.parse_args()
+
+    try:
+        api = gettor.http.HTTP('http.cfg')
+        if args.rollback:
+            print "Serving generation %s" % api.rollback()
+        elif args.serve:
+            api.run()
+        else:
+            api.load_data()
+            api.build()
+    except gettor.http.ConfigError as e:
+        sys.exit("Configuration error: %s" % str(e))
+    except gettor.http.InternalError as e:
+        sys.exit("Error: %s" % str(e))
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,166 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of GetTor, a Tor Browser distribution system.
+#
+# :authors: Israel Leiva <ilv@riseup.net>
+#           see also AUTHORS file
+#
+# :copyright:   (c) 2008-2015, The Tor Project, Inc.
+#               (c) 2015, Israel Leiva
+#
+# :license: This is Free Software. See LICENSE for license information.
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from gettor import http
+
+"""Benchmark a full build of the static API tree with synthetic data."""
+
+OS = ['linux', 'windows', 'osx']
+URL = 'https://www.example.org/%s/%s/%s/%s'
+SHA = '40ade5f6883a70af77de37da8a50bd72b533b1b65d198a0d8f02c2d5f4791355'
+
+
+def get_data(providers, locales):
+    """Get data shaped like the one loaded by gettor.http.HTTP.
+
+    :param: providers (int) number of providers.
+    :param: locales (int) number of locales.
+
+    :return: (tuple) resources, providers, links, latest version and
+             mirrors.
+
+    """
+    lcs = ['lc%d' % i for i in range(locales)]
+    links = {'updated_at': '2015-01-01 00:00:00'}
+    names = {'updated_at': '2015-01-01 00:00:00'}
+    for i in range(providers):
+        pname = 'provider-%d' % i
+        names[pname] = 'https://api.example.org/providers/%s' % pname
+        links[pname] = {}
+        for osys in OS:
+            links[pname][osys] = {}
+            for lc in lcs:
+                if osys == 'linux':
+                    links[pname][osys][lc] = {
+                        'binary32': URL % (pname, osys, lc, 'bin32'),
+                        'signature32': URL % (pname, osys, lc, 'asc32'),
+                        'sha256-32': SHA,
+                        'binary64': URL % (pname, osys, lc, 'bin64'),
+                        'signature64': URL % (pname, osys, lc, 'asc64'),
+                        'sha256-64': SHA
+                    }
+                else:
+                    links[pname][osys][lc] = {
+                        'binary': URL % (pname, osys, lc, 'bin'),
+                        'signature': URL % (pname, osys, lc, 'asc'),
+                        'sha256': SHA
+                    }
+
+    lv = {'updated_at': '2015-01-01 00:00:00'}
+    for release in ('stable', 'alpha'):
+        lv[release] = {'latest_version': '6.0.5', 'downloads': {}}
+        for osys in OS:
+            lv[release]['downloads'][osys] = {}
+            for lc in lcs:
+                lv[release]['downloads'][osys][lc] = {
+                    'binary': URL % ('tpo', release, osys, lc),
+                    'signature': URL % ('tpo', release, osys, lc + '.asc')
+                }
+
+    resources = {
+        'providers': 'https://api.example.org/providers',
+        'mirrors': 'https://api.example.org/mirrors',
+        'latest_version': 'https://api.example.org/latest',
+        'updated_at': '2015-01-01 00:00:00'
+    }
+    mirrors = [
+        {'adress': '10.0.0.%d' % i, 'orport': '443', 'https': 'Yes'}
+        for i in range(100)
+    ]
+    return resources, names, links, lv, mirrors
+
+
+def build(tree, data, processes, threads, compact, compressed):
+    """Build the whole tree like gettor.http.HTTP does.
+
+    :param: tree (string) the directory to build the tree into.
+    :param: data (tuple) see get_data().
+    :param: processes (int) processes serializing the nodes.
+    :param: threads (int) threads writing the nodes.
+    :param: compact (bool) true for json without whitespace.
+    :param: compressed (bool) true to add .gz and .br files.
+
+    :return: (tuple) the number of files and their total size.
+
+    """
+    nodes = http.get_nodes(*data)
+    for path in sorted(set(os.path.dirname(p) for p, c in nodes)):
+        path = os.path.join(tree, path)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def write(node):
+        with open(os.path.join(tree, node[0]), 'wb') as f:
+            f.write(node[1])
+            f.flush()
+            os.fsync(f.fileno())
+
+    nodes = http.serialize_nodes(nodes, processes, compact, compressed)
+    http.write_nodes(write, nodes, threads)
+    return len(nodes), sum(len(node[1]) for node in nodes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark for building'
+                                     ' the static API tree')
+    parser.add_argument('-p', '--providers', default=10, type=int,
+                        help='number of providers')
+    parser.add_argument('-l', '--locales', default=15, type=int,
+                        help='number of locales')
+    parser.add_argument('-r', '--runs', default=3, type=int,
+                        help='builds for each configuration (best is shown)')
+    parser.add_argument('--processes', default='0,2,4', type=str,
+                        help='comma separated numbers of processes')
+    parser.add_argument('--threads', default='1,4,8', type=str,
+                        help='comma separated numbers of threads')
+    parser.add_argument('--compact', action='store_true',
+                        help='json without whitespace')
+    parser.add_argument('--compress', action='store_true',
+                        help='build .gz and .br files too')
+    args = parser.parse_args()
+
+    data = get_data(args.providers, args.locales)
+    print "%d providers x %d OS x %d locales" % (
+        args.providers, len(OS), args.locales
+    )
+
+    for processes in [int(p) for p in args.processes.split(',')]:
+        for threads in [int(t) for t in args.threads.split(',')]:
+            best = None
+            for i in range(args.runs):
+                tree = tempfile.mkdtemp(prefix='gettor-bench-')
+                try:
+                    start = time.time()
+                    files, size = build(
+                        tree, data, processes, threads,
+                        args.compact, args.compress
+                    )
+                    elapsed = time.time() - start
+                finally:
+                    shutil.rmtree(tree)
+                if best is None or elapsed < best:
+                    best = elapsed
+            print "processes=%d threads=%d: %d files (%d KB) in %.3f" \
+                " seconds" % (processes, threads, files, size / 1024, best)
+
+if __name__ == "__main__":
+    main()
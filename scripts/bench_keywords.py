@@ -0,0 +1,94 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of GetTor, a Tor Browser distribution system.
+#
+# :authors: Israel Leiva <ilv@riseup.net>
+#           see also AUTHORS file
+#
+# :copyright:   (c) 2008-2015, The Tor Project, Inc.
+#               (c) 2015, Israel Leiva
+#
+# :license: This is Free Software. See LICENSE for license information.
+
+import os
+import re
+import sys
+import timeit
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from gettor import keywords
+
+# requests as we usually get them, plus a long one without keywords
+MESSAGES = [
+    'linux',
+    'windows es',
+    'please send me tor browser for osx in english',
+    'mirrors',
+    'hello, I would like to download Tor Browser, thanks ' * 20,
+]
+
+SUPPORTED_OS = ['linux', 'windows', 'osx']
+SUPPORTED_LC = ['en', 'es', 'fa', 'tr', 'zh', 'ar', 'de', 'fr', 'it', 'ru']
+
+
+def parse_text(msg):
+    """Old parser of the XMPP and Twitter modules, for comparison."""
+    req = {}
+    req['lc'] = 'en'
+    req['os'] = None
+    req['type'] = 'help'
+
+    found_lc = False
+    found_os = False
+    found_mirrors = False
+
+    words = re.split('\s+', msg.strip())
+    for word in words:
+        if not found_lc:
+            for lc in SUPPORTED_LC:
+                if re.match(lc, word, re.IGNORECASE):
+                    found_lc = True
+                    req['lc'] = lc
+        if not found_os:
+            for os in SUPPORTED_OS:
+                if re.match(os, word, re.IGNORECASE):
+                    found_os = True
+                    req['os'] = os
+                    req['type'] = 'links'
+        if not found_mirrors:
+            if re.match("mirrors?", word, re.IGNORECASE):
+                found_mirrors = True
+                req['type'] = 'mirrors'
+        if (found_lc and found_os) or (found_lc and found_mirrors):
+            break
+
+    return req
+
+
+def main():
+    """Compare the cost per message of the old and new request parsers.
+
+    See argparse usage for more details.
+
+    """
+    parser = argparse.ArgumentParser(description='Benchmark for GetTor'
+                                     ' request parsing')
+    parser.add_argument('-n', '--number', type=int, default=20000,
+                        help='number of times each message is parsed')
+    args = parser.parse_args()
+
+    request_parser = keywords.RequestParser(SUPPORTED_OS, SUPPORTED_LC)
+
+    print "%-30s %12s %12s" % ('message', 'old (us)', 'new (us)')
+    for msg in MESSAGES:
+        old = timeit.timeit(lambda: parse_text(msg), number=args.number)
+        new = timeit.timeit(lambda: request_parser.parse(msg),
+                            number=args.number)
+        print "%-30s %12.2f %12.2f" % (msg[:30], old * 1e6 / args.number,
+                                       new * 1e6 / args.number)
+
+if __name__ == "__main__":
+    main()
@@ -11,11 +11,33 @@
 #
 # :license: This is Free Software. See LICENSE for license information.
 
+import os
 import sys
 import time
 import sqlite3
 import argparse
 
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from gettor import db
+from gettor import bloom
+from gettor import blacklist
+
+# users deleted per transaction by --expire, and seconds between batches
+EXPIRE_BATCH_SIZE = 500
+EXPIRE_PAUSE = 0.1
+
+
+def bump_version(con):
+    """Tell GetTor services that the users table has changed.
+
+    Services keeping a filter of blocked users build it again when
+    PRAGMA user_version changes.
+
+    """
+    version = con.execute("PRAGMA user_version").fetchone()[0]
+    con.execute("PRAGMA user_version = %d" % (version + 1))
+
 
 def main():
     """Script for managing blacklisting of users.
@@ -42,6 +64,23 @@ def main():
     parser.add_argument('-r', '--requests', default=None,
                         help='number of requests; everyone with number of'
                         ' requests greather than this will be cleaned up')
+    parser.add_argument('-e', '--expire', default=None, type=int,
+                        metavar='minutes',
+                        help='delete users (except blocked ones) without'
+                        ' requests in the last given minutes; meant to be'
+                        ' run from cron')
+    parser.add_argument('--batch-size', default=EXPIRE_BATCH_SIZE, type=int,
+                        help='users deleted at once by --expire')
+    parser.add_argument('--pause', default=EXPIRE_PAUSE, type=float,
+                        help='seconds between batches of --expire')
+    parser.add_argument('-f', '--filter-estimate', default=None,
+                        const=blacklist.BLOOM_ERROR_RATE, nargs='?',
+                        type=float, metavar='error rate',
+                        help='estimate the size and false positive rate of'
+                        ' the filter of blocked users built with the given'
+                        ' error rate, to choose the [bloom] settings of'
+                        ' blacklist.cfg (running services log the stats of'
+                        ' their own filter when they build it)')
 
     args = parser.parse_args()
     query = ''
@@ -49,11 +88,12 @@ def main():
 
     if args.add:
         # add new entry, useful for adding users permanently blocked
-        query = "INSERT INTO users VALUES('%s', '%s', 1, %s, %s)"\
+        query = "INSERT OR REPLACE INTO users VALUES('%s', '%s', 1, %s, %s)"\
                 % (args.add[0], args.add[1], args.add[2], time.time())
         with con:
             cur = con.cursor()
             cur.execute(query)
+        bump_version(con)
         print "Query execute successfully"
     elif args.clean:
         if args.clean == 'c':
@@ -63,6 +103,7 @@ def main():
                 with con:
                     cur = con.cursor()
                     cur.execute(query)
+                bump_version(con)
                 print "Query executed successfully."
             else:
                 sys.exit("Number of requests missing. See --help.")
@@ -72,7 +113,40 @@ def main():
             with con:
                 cur = con.cursor()
                 cur.execute(query)
+            bump_version(con)
             print "Query execute succcessfully."
+    elif args.expire is not None:
+        # small batches, so the services are never locked out for long
+        users = db.DB(args.database)
+        before = time.time() - args.expire * 60
+        total = 0
+        try:
+            while True:
+                deleted = users.delete_expired_users(before, args.batch_size)
+                total += deleted
+                if deleted < args.batch_size:
+                    break
+                time.sleep(args.pause)
+        except db.DBError as e:
+            sys.exit("Error deleting users: %s" % str(e))
+        finally:
+            users.close()
+        print "%d expired users deleted." % total
+    elif args.filter_estimate is not None:
+        # a new filter like the one the services would build now (see
+        # gettor.blacklist.BlockedUsers), not the one they're using
+        with con:
+            cur = con.cursor()
+            cur.execute("SELECT id, service FROM users WHERE blocked = 1")
+            rows = cur.fetchall()
+        blocked = bloom.BloomFilter(len(rows) * 2, args.filter_estimate)
+        for row in rows:
+            blocked.add(("%s:%s" % (row[0], row[1])).encode('utf-8'))
+        print "Blocked users: %d" % len(blocked)
+        print "Filter size: %d bits, %d hashes" % (blocked.size,
+                                                   blocked.hashes)
+        print "Estimated false positive rate: %f" % \
+            blocked.false_positive_rate()
     else:
         query = "SELECT * FROM users"
         has_where = False
@@ -12,13 +12,17 @@
 
 import os
 import re
+import sys
 import json
-import codecs
 import urllib2
 import ConfigParser
 
 from time import gmtime, strftime
 
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from gettor import http
+
 
 """Script to build a static mirror of GetTor RESTful API"""
 
@@ -92,28 +96,21 @@ class APIMirror(object):
             return False
         return True
     
-    def _write_json(self, path, content):
-        """
+    def _write_node(self, node):
+        """ Write a node of the API.
+
+        :param: node (tuple) the path (relative to the tree), json and hash
+                of the node.
+
+        :raise: InternalError if the file can't be written.
+
         """
+        path = os.path.join(self.tree, node[0])
         try:
-            with codecs.open(
-                path,
-                "w",
-                "utf-8"
-            ) as jsonfile:
-                # Make pretty json
-                json.dump(
-                    content,
-                    jsonfile,
-                    sort_keys=True,
-                    indent=4,
-                    separators=(',', ': '),
-                    encoding="utf-8",
-                )
+            with open(path, "wb") as jsonfile:
+                jsonfile.write(node[1])
         except IOError as e:
-            #logging.error("Couldn't write json: %s" % str(e))
-            print "Error building %s: %s" % (path, str(e))
-        print "%s built" % path
+            raise InternalError("Error building %s: %s" % (path, str(e)))
 
     def _get_provider_name(self, p):
         """ Return simplified version of provider's name.
@@ -183,119 +180,31 @@ class APIMirror(object):
         self._load_latest_version()
 
     def build(self):
-        """ Build RESTful API. """
-        
-        print "Building API mirror"
-        
-        # resources
-        self._write_json(
-            os.path.join(self.tree, 'api'),
-            self.resources
-        )
-
-        api_path = os.path.join(self.tree, 'api-content')
-        if not os.path.isdir(api_path):
-            os.mkdir(api_path)
-        
-        # providers
-        self._write_json(
-            os.path.join(api_path, 'providers'),
-            self.providers
-        )
+        """ Build RESTful API.
 
-        providers_path = os.path.join(api_path, 'providers-content')
-        if not os.path.isdir(providers_path):
-            os.mkdir(providers_path)
+        Nodes are serialized by a pool of processes and written by a pool
+        of threads, see gettor.http.
 
-        for provider in self.links:
-            if provider == 'updated_at':
-                continue
-
-            self._write_json(
-                os.path.join(providers_path, provider),
-                self.links[provider]
-            )
-
-            provider_path = os.path.join(
-                providers_path,
-                "%s-content" % provider
-            )
-
-            if not os.path.isdir(provider_path):
-                os.mkdir(provider_path)
-            
-            for osys in self.links[provider]:
-                self._write_json(
-                    os.path.join(provider_path, osys),
-                    self.links[provider][osys]
-                )
-
-                provider_os_path = os.path.join(
-                    provider_path, "%s-content" % osys
-                )            
-
-                if not os.path.isdir(provider_os_path):
-                    os.mkdir(provider_os_path)
-                
-                for lc in self.links[provider][osys]:
-                    self._write_json(
-                        os.path.join(provider_os_path, lc),
-                        self.links[provider][osys][lc]
-                    )
-
-        # latest version
-        self._write_json(
-            os.path.join(api_path, 'latest'),
-            self.lv
-        )
+        """
         
-        lv_path = os.path.join(api_path, 'latest-content')
-        if not os.path.isdir(lv_path):
-            os.mkdir(lv_path)
-
-        for release in self.lv:
-            if release == 'updated_at':
-                continue
-
-            self._write_json(
-                os.path.join(lv_path, release),
-                self.lv[release]
-            )
-            
-            release_path = os.path.join(
-                lv_path,
-                "%s-content" % release
-            )
-
-            if not os.path.isdir(release_path):
-                os.mkdir(release_path)
-            
-            for osys in self.lv[release]['downloads']:
-                self._write_json(
-                    os.path.join(release_path, osys),
-                    self.lv[release]['downloads'][osys]
-                )
-
-                release_os_path = os.path.join(
-                    release_path,
-                    "%s-content" % osys
-                )
-
-                if not os.path.isdir(release_os_path):
-                    os.mkdir(release_os_path)
-                
-                for lc in self.lv[release]['downloads'][osys]:
-                    self._write_json(
-                        os.path.join(release_os_path, lc),
-                        self.lv[release]['downloads'][osys][lc]
-                    )
-
-        # mirrors
-        self._write_json(
-            os.path.join(api_path, 'mirrors'),
+        print "Building API mirror"
+        nodes = http.get_nodes(
+            self.resources,
+            self.providers,
+            self.links,
+            self.lv,
             self.mirrors
         )
 
+        for path in sorted(set(os.path.dirname(p) for p, c in nodes)):
+            path = os.path.join(self.tree, path)
+            if not os.path.isdir(path):
+                os.makedirs(path)
+
+        nodes = http.serialize_nodes(nodes, http.BUILD_PROCESSES)
+        http.write_nodes(self._write_node, nodes, http.BUILD_THREADS)
+        print "API mirror built: %d files" % len(nodes)
+
 def main():
     api = APIMirror()
     api.load_data()
@@ -15,6 +15,71 @@ import os
 import sqlite3
 import argparse
 
+# (id, service) is the key used by every lookup on the blacklist
+USERS_TABLE = (
+    "CREATE TABLE users(id TEXT, service TEXT, times INT, blocked INT,"
+    " last_request REAL, PRIMARY KEY (id, service))"
+)
+
+# used to find expired users, see 'scripts/blacklist.py --expire'
+USERS_INDEX = "CREATE INDEX users_last_request ON users(last_request)"
+
+
+def migrate(dbname):
+    """Upgrade the users table of an existing database.
+
+    Older databases don't have a primary key on the users table and store
+    last_request as TEXT. The table is rebuilt in place; if a user appears
+    more than once, the most recent entry is kept. The index on
+    last_request is added if it's missing.
+
+    :param: dbname (string) the path of the database.
+
+    :raise: ValueError if the database has no users table.
+
+    :return: (bool) true if the table was upgraded, false if it was
+             already up to date.
+
+    """
+    con = sqlite3.connect(dbname, isolation_level=None)
+    cur = con.cursor()
+    cur.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table'"
+        " AND name = 'users'"
+    )
+    if cur.fetchone() is None:
+        con.close()
+        raise ValueError("no users table, create the database with --create")
+
+    cur.execute("PRAGMA table_info(users)")
+    has_key = any(column[5] for column in cur.fetchall())
+    cur.execute("PRAGMA index_list(users)")
+    has_index = any(
+        index[1] == 'users_last_request' for index in cur.fetchall()
+    )
+    if has_key and has_index:
+        con.close()
+        return False
+
+    cur.execute("BEGIN IMMEDIATE")
+    try:
+        if not has_key:
+            cur.execute("ALTER TABLE users RENAME TO users_old")
+            cur.execute(USERS_TABLE)
+            cur.execute(
+                "INSERT OR REPLACE INTO users SELECT id, service, times,"
+                " blocked, CAST(last_request AS REAL) FROM users_old"
+                " ORDER BY CAST(last_request AS REAL)"
+            )
+            cur.execute("DROP TABLE users_old")
+        cur.execute(USERS_INDEX)
+    except sqlite3.Error:
+        cur.execute("ROLLBACK")
+        raise
+    cur.execute("COMMIT")
+    con.close()
+    return True
+
 
 def main():
     """Create/delete GetTor database for managing stats and blacklisting.
@@ -31,6 +96,9 @@ def main():
     parser.add_argument('-d', '--delete', default=None,
                         metavar='path_to_database.db',
                         help='delete database')
+    parser.add_argument('-m', '--migrate', default=None,
+                        metavar='path_to_database.db',
+                        help='upgrade the tables of an existing database')
 
     args = parser.parse_args()
     if args.create:
@@ -38,17 +106,29 @@ def main():
         with con:
             cur = con.cursor()
             # table for handling users (i.e. blacklist)
-            cur.execute(
-                "CREATE TABLE users(id TEXT, service TEXT, times INT,"
-                "blocked INT, last_request TEXT)"
-            )
-            
+            cur.execute(USERS_TABLE)
+            cur.execute(USERS_INDEX)
+
             cur.execute(
                 "CREATE TABLE requests(date TEXT, request TEXT, os TEXT,"
                 " locale TEXT, channel TEXT, PRIMARY KEY (date, channel))"
             )
 
         print "Database %s created" % os.path.abspath(args.create)
+    elif args.migrate:
+        dbname = os.path.abspath(args.migrate)
+        if not os.path.isfile(dbname):
+            print "Database %s not found" % dbname
+            return
+        try:
+            upgraded = migrate(dbname)
+        except (ValueError, sqlite3.Error) as e:
+            print "Can't upgrade database %s: %s" % (dbname, str(e))
+            return
+        if upgraded:
+            print "Database %s upgraded" % dbname
+        else:
+            print "Database %s is up to date" % dbname
     elif args.delete:
         os.remove(os.path.abspath(args.delete))
         print "Database %s deleted" % os.path.abspath(args.delete)
@@ -0,0 +1,139 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of GetTor, a Tor Browser distribution system.
+#
+# :authors: Israel Leiva <ilv@riseup.net>
+#           see also AUTHORS file
+#
+# :copyright:   (c) 2008-2015, The Tor Project, Inc.
+#               (c) 2015, Israel Leiva
+#
+# :license: This is Free Software. See LICENSE for license information.
+
+import time
+import httplib
+import argparse
+import threading
+
+"""Load test for the API served by 'process_http.py --serve'."""
+
+# a mix of the requests clients make
+PATHS = [
+    '/api',
+    '/api/providers',
+    '/api/mirrors',
+    '/api/latest',
+    '/api/latest/stable?os=linux&lc=en-US',
+    '/api/providers/dropbox?os=linux&lc=en',
+    '/api/providers/dropbox?os=windows&lc=es',
+    '/api/providers/github?os=osx',
+]
+
+
+def client(host, port, paths, requests, headers, etag, results):
+    """Make requests over a single keep-alive connection.
+
+    :param: host (string) the host of the server.
+    :param: port (int) the port of the server.
+    :param: paths (list) paths to request, in turns.
+    :param: requests (int) number of requests.
+    :param: headers (dict) headers of every request.
+    :param: etag (bool) true to send If-None-Match with the last ETag.
+    :param: results (list) where the latency of every request and the
+            number of errors are added.
+
+    """
+    con = httplib.HTTPConnection(host, port)
+    etags = {}
+    latencies = []
+    errors = 0
+    for i in range(requests):
+        path = paths[i % len(paths)]
+        req_headers = dict(headers)
+        if path in etags:
+            req_headers['If-None-Match'] = etags[path]
+        start = time.time()
+        try:
+            con.request('GET', path, headers=req_headers)
+            response = con.getresponse()
+            response.read()
+        except (httplib.HTTPException, IOError):
+            errors += 1
+            con.close()
+            con = httplib.HTTPConnection(host, port)
+            continue
+        latencies.append(time.time() - start)
+        if response.status not in (200, 304):
+            errors += 1
+        elif etag:
+            etags[path] = response.getheader('ETag')
+    con.close()
+    results.append((latencies, errors))
+
+
+def percentile(values, p):
+    """Get a percentile of a sorted list.
+
+    :param: values (list) sorted values.
+    :param: p (float) the percentile, between 0 and 100.
+
+    :return: (float) the value.
+
+    """
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test for GetTor'
+                                     ' RESTful API')
+    parser.add_argument('--host', default='localhost', type=str,
+                        help='host of the server')
+    parser.add_argument('--port', default=8080, type=int,
+                        help='port of the server')
+    parser.add_argument('-c', '--clients', default=10, type=int,
+                        help='concurrent clients (one connection each)')
+    parser.add_argument('-n', '--requests', default=1000, type=int,
+                        help='requests made by every client')
+    parser.add_argument('-z', '--gzip', action='store_true',
+                        help='accept compressed responses')
+    parser.add_argument('-e', '--etag', action='store_true',
+                        help='send If-None-Match with the last ETag seen')
+    parser.add_argument('paths', nargs='*', default=PATHS,
+                        help='paths to request')
+    args = parser.parse_args()
+
+    headers = {}
+    if args.gzip:
+        headers['Accept-Encoding'] = 'gzip'
+
+    results = []
+    threads = [
+        threading.Thread(target=client, args=(
+            args.host, args.port, args.paths, args.requests, headers,
+            args.etag, results
+        )) for i in range(args.clients)
+    ]
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+
+    latencies = sorted(l for result in results for l in result[0])
+    errors = sum(result[1] for result in results)
+    print "%d requests in %.2f seconds (%d errors)" % (
+        len(latencies), elapsed, errors
+    )
+    print "%.0f requests per second" % (len(latencies) / elapsed)
+    print "latency p50 %.2f ms, p99 %.2f ms, max %.2f ms" % (
+        percentile(latencies, 50) * 1000,
+        percentile(latencies, 99) * 1000,
+        latencies[-1] * 1000 if latencies else 0
+    )
+
+if __name__ == "__main__":
+    main()
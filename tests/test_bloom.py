@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of GetTor, a Tor Browser distribution system.
+#
+# :authors: Israel Leiva <ilv@riseup.net>
+#           see also AUTHORS file
+#
+# :copyright:   (c) 2008-2015, The Tor Project, Inc.
+#               (c) 2015, Israel Leiva
+#
+# :license: This is Free Software. See LICENSE for license information.
+
+import os
+import sys
+import shutil
+import logging
+import sqlite3
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from gettor import db
+from gettor import bloom
+from gettor import blacklist
+
+"""Tests for the filter of blocked users."""
+
+USERS_TABLE = (
+    "CREATE TABLE users(id TEXT, service TEXT, times INT, blocked INT,"
+    " last_request REAL, PRIMARY KEY (id, service))"
+)
+
+
+class BloomFilterTest(unittest.TestCase):
+
+    def test_no_false_negatives(self):
+        f = bloom.BloomFilter(5000, 0.01)
+        values = ['user-%d' % i for i in range(5000)]
+        for v in values:
+            f.add(v)
+        self.assertEqual(len(f), 5000)
+        for v in values:
+            self.assertIn(v, f)
+
+    def test_no_false_negatives_over_capacity(self):
+        # more values than planned make false positives more likely, but
+        # never false negatives
+        f = bloom.BloomFilter(10, 0.01)
+        values = ['user-%d' % i for i in range(1000)]
+        for v in values:
+            f.add(v)
+        for v in values:
+            self.assertIn(v, f)
+
+    def test_false_positive_rate(self):
+        f = bloom.BloomFilter(2000, 0.01)
+        for i in range(2000):
+            f.add('in-%d' % i)
+        found = sum(1 for i in range(20000) if ('out-%d' % i) in f)
+        # the estimate and the measured rate stay close to the target
+        self.assertLess(f.false_positive_rate(), 0.015)
+        self.assertLess(found / 20000.0, 0.02)
+
+    def test_empty(self):
+        f = bloom.BloomFilter(0, 0.001)
+        self.assertNotIn('user', f)
+        self.assertEqual(f.false_positive_rate(), 0)
+
+
+class BlockedUsersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='gettor-bloom-')
+        self.dbname = os.path.join(self.dir, 'gettor.db')
+        con = sqlite3.connect(self.dbname)
+        con.execute(USERS_TABLE)
+        con.executemany("INSERT INTO users VALUES(?,?,0,?,0)", [
+            ('u%d' % i, 'SMTP', int(i % 10 == 0)) for i in range(1000)
+        ])
+        con.commit()
+        con.close()
+        self.db = db.DB(self.dbname)
+        self.blocked = blacklist.BlockedUsers(
+            self.db, 0.001, 0, logging.getLogger('test')
+        )
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.dir)
+
+    def change(self, sql, *args):
+        """Change the users table like scripts/blacklist.py does."""
+        con = sqlite3.connect(self.dbname)
+        con.execute(sql, args)
+        version = con.execute("PRAGMA user_version").fetchone()[0]
+        con.execute("PRAGMA user_version = %d" % (version + 1))
+        con.commit()
+        con.close()
+
+    def test_blocked_users(self):
+        for i in range(0, 1000, 10):
+            self.assertTrue(self.blocked.might_be_blocked('u%d' % i, 'SMTP'))
+        # same users, other service
+        found = sum(
+            self.blocked.might_be_blocked('u%d' % i, 'XMPP')
+            for i in range(0, 1000, 10)
+        )
+        self.assertLess(found, 5)
+
+    def test_rebuilt_when_blocked(self):
+        self.assertFalse(self.blocked.might_be_blocked('new', 'SMTP'))
+        self.change("INSERT INTO users VALUES('new', 'SMTP', 0, 1, 0)")
+        self.assertTrue(self.blocked.might_be_blocked('new', 'SMTP'))
+        self.assertEqual(self.blocked.stats()['users'], 101)
+
+    def test_rebuilt_when_unblocked(self):
+        self.assertTrue(self.blocked.might_be_blocked('u10', 'SMTP'))
+        self.change("UPDATE users SET blocked = 0 WHERE id = ?", 'u10')
+        self.assertFalse(self.blocked.might_be_blocked('u10', 'SMTP'))
+
+    def test_not_rebuilt_before_interval(self):
+        self.blocked.check_interval = 3600
+        self.blocked.might_be_blocked('new', 'SMTP')
+        self.change("INSERT INTO users VALUES('new', 'SMTP', 0, 1, 0)")
+        self.assertFalse(self.blocked.might_be_blocked('new', 'SMTP'))
+
+    def test_stats(self):
+        self.assertEqual(self.blocked.stats(), {})
+        self.blocked.might_be_blocked('u1', 'SMTP')
+        stats = self.blocked.stats()
+        self.assertEqual(stats['users'], 100)
+        self.assertLess(stats['false_positive_rate'], 0.001)
+
+
+class BlacklistTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='gettor-blacklist-')
+        self.dbname = os.path.join(self.dir, 'gettor.db')
+        con = sqlite3.connect(self.dbname)
+        con.execute(USERS_TABLE)
+        con.execute("INSERT INTO users VALUES('bad', 'SMTP', 0, 1, 0)")
+        con.commit()
+        con.close()
+        self.objs = []
+
+    def tearDown(self):
+        for obj in self.objs:
+            obj.flush()
+            obj.db.close()
+        shutil.rmtree(self.dir)
+
+    def get_blacklist(self, cache):
+        cfg = os.path.join(self.dir, 'blacklist.cfg')
+        with open(cfg, 'w') as f:
+            f.write("[general]\ndb: %s\n" % self.dbname)
+            f.write("[log]\nlevel: DEBUG\ndir: %s\n" % self.dir)
+            if cache:
+                f.write("[cache]\nsize: 100\nflush_interval: 3600\n")
+        obj = blacklist.Blacklist(cfg)
+        self.objs.append(obj)
+        return obj
+
+    def check(self, bl, user):
+        try:
+            bl.is_blacklisted(user, 'SMTP', 3, 20)
+            return None
+        except blacklist.BlacklistError as e:
+            return str(e)
+
+    def test_filter_without_cache(self):
+        bl = self.get_blacklist(False)
+        self.assertEqual(self.check(bl, 'bad'), 'Blocked user')
+        self.assertEqual(bl.stats()['users'], 1)
+
+    def test_throttle_without_cache(self):
+        bl = self.get_blacklist(False)
+        verdicts = [self.check(bl, 'good') for i in range(5)]
+        self.assertEqual(
+            verdicts, [None, None, None, 'Too many requests',
+                       'Too many requests']
+        )
+        row = bl.db.get_user('good', 'SMTP')
+        self.assertEqual(row['times'], 5)
+
+    def test_stale_filter_without_cache(self):
+        bl = self.get_blacklist(False)
+        self.assertEqual(self.check(bl, 'good'), None)
+        # blocked without telling the filter (no new version)
+        con = sqlite3.connect(self.dbname)
+        con.execute("UPDATE users SET blocked = 1 WHERE id = 'good'")
+        con.commit()
+        con.close()
+        self.assertFalse(bl.blocked.might_be_blocked('good', 'SMTP'))
+        self.assertEqual(self.check(bl, 'good'), 'Blocked user')
+
+    def test_same_verdicts_with_cache(self):
+        without = self.get_blacklist(False)
+        cached = self.get_blacklist(True)
+        for user in ('a', 'b'):
+            self.assertEqual(
+                [self.check(without, user) for i in range(5)],
+                [self.check(cached, 'cached-' + user) for i in range(5)]
+            )
+        self.assertEqual(self.check(cached, 'bad'), 'Blocked user')
+
+
+class UserCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='gettor-cache-')
+        self.dbname = os.path.join(self.dir, 'gettor.db')
+        con = sqlite3.connect(self.dbname)
+        con.execute(USERS_TABLE)
+        con.commit()
+        con.close()
+        self.db = db.DB(self.dbname)
+        log = logging.getLogger('test')
+        blocked = blacklist.BlockedUsers(self.db, 0.001, 0, log)
+        # save the counters on every request
+        self.cache = blacklist.UserCache(self.db, blocked, 100, -1, log)
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.dir)
+
+    def test_flush_error(self):
+        save_users = self.db.save_users
+
+        def fail(users):
+            raise db.DBError("database is locked")
+
+        self.db.save_users = fail
+        verdicts = [self.cache.check_user('u', 'SMTP', 3, 20)
+                    for i in range(4)]
+        self.assertEqual(verdicts, [None, None, None, db.THROTTLED])
+        self.assertTrue(self.cache.users[('u', 'SMTP')]['dirty'])
+        self.assertIsNone(self.db.get_user('u', 'SMTP'))
+
+        # kept for the next flush
+        self.db.save_users = save_users
+        self.cache.flush()
+        self.assertEqual(self.db.get_user('u', 'SMTP')['times'], 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of GetTor, a Tor Browser distribution system.
+#
+# :authors: Israel Leiva <ilv@riseup.net>
+#           see also AUTHORS file
+#
+# :copyright:   (c) 2008-2015, The Tor Project, Inc.
+#               (c) 2015, Israel Leiva
+#
+# :license: This is Free Software. See LICENSE for license information.
+
+import os
+import sys
+import gzip
+import json
+import httplib
+import threading
+import unittest
+
+from cStringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from gettor import http
+
+"""Tests for the embedded server of the RESTful API."""
+
+URL = 'https://www.example.org/%s/%s/%s'
+
+
+def get_api():
+    """Get an HTTP object with a small set of data, no configuration."""
+    api = http.HTTP.__new__(http.HTTP)
+    api.build_compact = False
+    api.resources = {
+        'providers': 'https://api.example.org/providers',
+        'mirrors': 'https://api.example.org/mirrors',
+        'latest_version': 'https://api.example.org/latest',
+        'updated_at': '2015-01-01 00:00:00'
+    }
+    api.providers = {
+        'dropbox': 'https://api.example.org/providers/dropbox',
+        'updated_at': '2015-01-01 00:00:00'
+    }
+    api.links = {'updated_at': '2015-01-01 00:00:00', 'dropbox': {}}
+    for osys in ('windows', 'osx'):
+        api.links['dropbox'][osys] = {}
+        for lc in ('en', 'es'):
+            api.links['dropbox'][osys][lc] = {
+                'binary': URL % (osys, lc, 'bin'),
+                'signature': URL % (osys, lc, 'asc'),
+                'sha256': '0' * 64
+            }
+    api.lv = {'updated_at': '2015-01-01 00:00:00'}
+    for release in ('stable', 'alpha'):
+        api.lv[release] = {'latest_version': '6.0.5', 'downloads': {
+            'windows': {'en-US': {
+                'binary': URL % (release, 'windows', 'bin'),
+                'signature': URL % (release, 'windows', 'asc')
+            }}
+        }}
+    api.mirrors = [{'adress': '10.0.0.1', 'orport': '443', 'https': 'Yes'}]
+    api.load_responses()
+    return api
+
+
+class MatchETagTest(unittest.TestCase):
+
+    def test_match(self):
+        self.assertTrue(http.match_etag('"abc"', '"abc"'))
+        self.assertTrue(http.match_etag('W/"abc"', '"abc"'))
+        self.assertTrue(http.match_etag('"x", W/"abc" ,"y"', '"abc"'))
+        self.assertTrue(http.match_etag('*', '"abc"'))
+
+    def test_no_match(self):
+        self.assertFalse(http.match_etag(None, '"abc"'))
+        self.assertFalse(http.match_etag('', '"abc"'))
+        self.assertFalse(http.match_etag('"abcd"', '"abc"'))
+        # not a list of entity tags containing it
+        self.assertFalse(http.match_etag('x"abc"x', '"abc"'))
+
+
+class ServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.api = get_api()
+        self.server = http.APIServer(('localhost', 0), self.api)
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, args=(0.05,)
+        )
+        self.thread.daemon = True
+        self.thread.start()
+        self.con = httplib.HTTPConnection(
+            'localhost', self.server.server_address[1]
+        )
+
+    def tearDown(self):
+        self.con.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def get(self, path, headers={}, method='GET'):
+        self.con.request(method, path, headers=headers)
+        response = self.con.getresponse()
+        return response, response.read()
+
+    def test_get(self):
+        response, body = self.get('/api')
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.getheader('Content-Type'),
+                         'application/json')
+        self.assertEqual(int(response.getheader('Content-Length')),
+                         len(body))
+        self.assertEqual(response.getheader('Vary'), 'Accept-Encoding')
+        self.assertEqual(json.loads(body), self.api.resources)
+
+    def test_urls(self):
+        links = self.api.links['dropbox']
+        for path, expected in (
+            ('/api/providers', self.api.providers),
+            ('/api/providers.json', self.api.providers),
+            ('/api/providers/dropbox?os=osx', links['osx']),
+            ('/api/providers/dropbox?os=osx&lc=es', links['osx']['es']),
+            ('/api/latest/alpha?os=windows&lc=en-US',
+             self.api.lv['alpha']['downloads']['windows']['en-US']),
+        ):
+            response, body = self.get(path)
+            self.assertEqual(response.status, 200, path)
+            self.assertEqual(json.loads(body), expected, path)
+
+    def test_not_found(self):
+        for path in ('/', '/api/nothing', '/api/providers/other',
+                     '/api/providers/dropbox?os=linux', '/other/api'):
+            response, body = self.get(path)
+            self.assertEqual(response.status, 404, path)
+
+    def test_head(self):
+        response, body = self.get('/api', method='HEAD')
+        self.assertEqual(response.status, 200)
+        self.assertEqual(body, '')
+        self.assertTrue(int(response.getheader('Content-Length')) > 0)
+
+    def test_gzip(self):
+        plain, body = self.get('/api/mirrors')
+        response, data = self.get('/api/mirrors',
+                                  {'Accept-Encoding': 'deflate, gzip'})
+        self.assertEqual(response.getheader('Content-Encoding'), 'gzip')
+        self.assertEqual(gzip.GzipFile(fileobj=StringIO(data)).read(), body)
+        # every representation has its own ETag
+        self.assertNotEqual(response.getheader('ETag'),
+                            plain.getheader('ETag'))
+
+    def test_not_modified(self):
+        response, body = self.get('/api/providers')
+        etag = response.getheader('ETag')
+        for header in (etag, 'W/' + etag, '"other", ' + etag, '*'):
+            response, body = self.get('/api/providers',
+                                      {'If-None-Match': header})
+            self.assertEqual(response.status, 304, header)
+            self.assertEqual(response.getheader('ETag'), etag)
+            self.assertEqual(body, '')
+
+    def test_modified(self):
+        response, body = self.get('/api/providers',
+                                  {'If-None-Match': '"other"'})
+        self.assertEqual(response.status, 200)
+        self.assertTrue(body)
+
+    def test_keep_alive(self):
+        self.get('/api')
+        sock = self.con.sock
+        self.get('/api/mirrors')
+        self.assertIs(self.con.sock, sock)
+
+    def test_reload_in_process(self):
+        # forking while the server threads run could deadlock the children
+        def pool(*args):
+            raise AssertionError("Pool used to serialize responses")
+        self.api.build_processes = 4
+        old, http.multiprocessing.Pool = http.multiprocessing.Pool, pool
+        try:
+            self.api.load_responses()
+        finally:
+            http.multiprocessing.Pool = old
+
+    def test_reload(self):
+        response, body = self.get('/api/mirrors')
+        etag = response.getheader('ETag')
+        self.api.mirrors.append(
+            {'adress': '10.0.0.2', 'orport': '443', 'https': 'Yes'}
+        )
+        self.api.load_responses()
+        response, body = self.get('/api/mirrors', {'If-None-Match': etag})
+        self.assertEqual(response.status, 200)
+        self.assertEqual(len(json.loads(body)), 2)
+        self.assertNotEqual(response.getheader('ETag'), etag)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of GetTor, a Tor Browser distribution system.
+#
+# :authors: Israel Leiva <ilv@riseup.net>
+#           see also AUTHORS file
+#
+# :copyright:   (c) 2008-2015, The Tor Project, Inc.
+#               (c) 2015, Israel Leiva
+#
+# :license: This is Free Software. See LICENSE for license information.
+
+import os
+import sys
+import time
+import shutil
+import struct
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from gettor import i18n
+
+"""Tests for the shared cache of gettext catalogs."""
+
+
+def write_mo(path, messages):
+    """Write a gettext catalog (.mo file).
+
+    :param: path (string) the path of the file.
+    :param: messages (dict) msgid -> translation.
+
+    """
+    keys = sorted(messages)
+    ids = ''.join(k + '\0' for k in keys)
+    strs = ''.join(messages[k] + '\0' for k in keys)
+    # header, table of msgids and table of translations
+    start = 7 * 4 + 2 * 8 * len(keys)
+    offsets = []
+    pos = 0
+    for k in keys:
+        offsets.append((len(k), start + pos))
+        pos += len(k) + 1
+    start += len(ids)
+    pos = 0
+    for k in keys:
+        offsets.append((len(messages[k]), start + pos))
+        pos += len(messages[k]) + 1
+
+    data = struct.pack(
+        '<7I', 0x950412de, 0, len(keys), 7 * 4, 7 * 4 + 8 * len(keys), 0, 0
+    )
+    for length, offset in offsets:
+        data += struct.pack('<2I', length, offset)
+    with open(path, 'wb') as f:
+        f.write(data + ids + strs)
+
+
+class TranslatorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.i18ndir = tempfile.mkdtemp(prefix='gettor-i18n-')
+        self.check_interval = i18n.CHECK_INTERVAL
+        i18n._catalogs.clear()
+        self.write('es', 'hola')
+
+    def tearDown(self):
+        i18n.CHECK_INTERVAL = self.check_interval
+        i18n._catalogs.clear()
+        shutil.rmtree(self.i18ndir)
+
+    def write(self, lc, msg, mtime=None):
+        """Write the catalog of a locale with a single message."""
+        path = os.path.join(self.i18ndir, lc, 'LC_MESSAGES')
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        path = os.path.join(path, '%s.mo' % lc)
+        write_mo(path, {'hello': msg})
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+
+    def test_get_msg(self):
+        t = i18n.Translator(self.i18ndir)
+        self.assertEqual(t.get_msg('hello', 'es'), u'hola')
+        # messages not in the catalog are returned as they are
+        self.assertEqual(t.get_msg('bye', 'es'), u'bye')
+
+    def test_missing_locale(self):
+        t = i18n.Translator(self.i18ndir)
+        self.assertRaises(IOError, t.get_msg, 'hello', 'fa')
+
+    def test_shared_between_translators(self):
+        t1 = i18n.Translator(self.i18ndir)
+        t2 = i18n.Translator(self.i18ndir)
+        self.assertIs(t1._get_catalog('es'), t2._get_catalog('es'))
+
+    def test_preload(self):
+        self.write('fa', 'salam')
+        i18n.Translator(self.i18ndir).preload()
+        self.assertIn((self.i18ndir, 'es'), i18n._catalogs)
+        self.assertIn((self.i18ndir, 'fa'), i18n._catalogs)
+
+    def test_no_reload_before_interval(self):
+        t = i18n.Translator(self.i18ndir)
+        self.assertEqual(t.get_msg('hello', 'es'), u'hola')
+        self.write('es', 'buenas', time.time() + 10)
+        self.assertEqual(t.get_msg('hello', 'es'), u'hola')
+
+    def test_reload_when_changed(self):
+        i18n.CHECK_INTERVAL = 0
+        t = i18n.Translator(self.i18ndir)
+        self.assertEqual(t.get_msg('hello', 'es'), u'hola')
+        self.write('es', 'buenas', time.time() + 10)
+        self.assertEqual(t.get_msg('hello', 'es'), u'buenas')
+
+    def test_kept_when_unchanged(self):
+        i18n.CHECK_INTERVAL = 0
+        t = i18n.Translator(self.i18ndir)
+        catalog = t._get_catalog('es')
+        self.assertIs(t._get_catalog('es'), catalog)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of GetTor, a Tor Browser distribution system.
+#
+# :authors: Israel Leiva <ilv@riseup.net>
+#           see also AUTHORS file
+#
+# :copyright:   (c) 2008-2015, The Tor Project, Inc.
+#               (c) 2015, Israel Leiva
+#
+# :license: This is Free Software. See LICENSE for license information.
+
+import os
+import re
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from gettor import keywords
+
+"""Tests for the parsing of requests."""
+
+OS = ['windows', 'linux', 'osx']
+LC = ['en', 'es', 'fa', 'zh', 'zh-TW', 'pt-BR']
+
+
+def old_parse(msg, supported_os, supported_lc):
+    """The parser used by the channels before RequestParser.
+
+    Locales are taken in the order given, the first one matching wins;
+    RequestParser tries them longest first.
+
+    """
+    req = {'lc': 'en', 'os': None, 'type': 'help'}
+    found_lc = found_os = found_mirrors = False
+    for word in msg.split():
+        if not found_lc:
+            for lc in supported_lc:
+                if re.match(re.escape(lc), word, re.IGNORECASE):
+                    found_lc = True
+                    req['lc'] = lc
+                    break
+        if not found_os:
+            for osys in supported_os:
+                if re.match(re.escape(osys), word, re.IGNORECASE):
+                    found_os = True
+                    req['os'] = osys
+                    req['type'] = 'links'
+        if not found_mirrors:
+            if re.match("mirrors?", word, re.IGNORECASE):
+                found_mirrors = True
+                req['type'] = 'mirrors'
+        if (found_lc and found_os) or (found_lc and found_mirrors):
+            break
+    return req
+
+
+class WordsTest(unittest.TestCase):
+
+    def test_get_words(self):
+        words = keywords.get_words("  linux\tes\n\nmirrors  ")
+        self.assertEqual(list(words), ['linux', 'es', 'mirrors'])
+
+    def test_get_words_limit(self):
+        self.assertEqual(list(keywords.get_words("a b c d", 2)), ['a', 'b'])
+
+    def test_count_words(self):
+        self.assertEqual(keywords.count_words("a b c d", 10), 4)
+        self.assertEqual(keywords.count_words("a b c d", 3), 3)
+        self.assertEqual(keywords.count_words("", 3), 0)
+
+
+class RequestParserTest(unittest.TestCase):
+
+    def setUp(self):
+        self.parser = keywords.RequestParser(OS, LC)
+
+    def test_help(self):
+        req = self.parser.parse("hello there")
+        self.assertEqual(req, {'lc': 'en', 'os': None, 'type': 'help'})
+
+    def test_links(self):
+        req = self.parser.parse("linux es")
+        self.assertEqual(req, {'lc': 'es', 'os': 'linux', 'type': 'links'})
+
+    def test_mirrors(self):
+        for msg in ("mirror", "MIRRORS please"):
+            self.assertEqual(self.parser.parse(msg)['type'], 'mirrors')
+
+    def test_case_and_prefix(self):
+        req = self.parser.parse("LINUX64 FA-ir")
+        self.assertEqual(req, {'lc': 'fa', 'os': 'linux', 'type': 'links'})
+
+    def test_first_match_wins(self):
+        req = self.parser.parse("osx windows es fa")
+        self.assertEqual(req['os'], 'osx')
+        self.assertEqual(req['lc'], 'es')
+
+    def test_longest_locale(self):
+        # keywords are returned as written in the configuration
+        self.assertEqual(self.parser.parse("zh-tw linux")['lc'], 'zh-TW')
+        self.assertEqual(self.parser.parse("zh linux")['lc'], 'zh')
+
+    def test_find_lc(self):
+        req = self.parser.parse("linux es", find_lc=False)
+        self.assertEqual(req, {'lc': 'en', 'os': 'linux', 'type': 'links'})
+
+    def test_special_characters(self):
+        # keywords are matched literally, not as regular expressions
+        parser = keywords.RequestParser(['os.x'], ['e+'])
+        self.assertEqual(parser.parse("osxx ee")['os'], None)
+        self.assertEqual(parser.parse("os.x e+"),
+                         {'lc': 'e+', 'os': 'os.x', 'type': 'links'})
+
+    def test_no_keywords(self):
+        parser = keywords.RequestParser([], [])
+        req = parser.parse("linux es mirrors")
+        self.assertEqual(req, {'lc': 'en', 'os': None, 'type': 'mirrors'})
+
+    def test_max_words(self):
+        msg = "x " * keywords.MAX_WORDS + "linux"
+        self.assertEqual(self.parser.parse(msg)['type'], 'help')
+        msg = "x " * (keywords.MAX_WORDS - 1) + "linux"
+        self.assertEqual(self.parser.parse(msg)['type'], 'links')
+
+    def test_same_as_old_parser(self):
+        msgs = [
+            "", "help", "linux", "es", "windows fa", "fa windows",
+            "mirrors", "mirrors es", "linux mirrors es", "es mirrors linux",
+            "please send me tor for osx in zh-TW", "Linux PT-br",
+            "I want the mirrors", "mirror\nlinux\nen", "xlinux xes",
+        ]
+        lc_order = sorted(LC, key=len, reverse=True)
+        for msg in msgs:
+            self.assertEqual(
+                self.parser.parse(msg), old_parse(msg, OS, lc_order), msg
+            )
+
+
+if __name__ == '__main__':
+    unittest.main()
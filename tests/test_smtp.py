@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of GetTor, a Tor Browser distribution system.
+#
+# :authors: Israel Leiva <ilv@riseup.net>
+#           see also AUTHORS file
+#
+# :copyright:   (c) 2008-2015, The Tor Project, Inc.
+#               (c) 2015, Israel Leiva
+#
+# :license: This is Free Software. See LICENSE for license information.
+
+import os
+import sys
+import time
+import shutil
+import smtpd
+import socket
+import logging
+import smtplib
+import asyncore
+import tempfile
+import threading
+import unittest
+
+from cStringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from gettor import smtp
+from gettor import workers
+
+"""Tests for reading incoming emails in the SMTP module."""
+
+HEADERS = (
+    "From: user@example.org\n"
+    "To: gettor@torproject.org\n"
+    "Subject: help\n"
+)
+
+
+def multipart(boundary, parts, subtype='mixed'):
+    """Build a multipart body.
+
+    :param: boundary (string) the boundary.
+    :param: parts (list) (content type, body) of every part.
+    :param: subtype (string) the multipart subtype.
+
+    :return: (tuple) content type and body of the multipart.
+
+    """
+    body = "preamble\n"
+    for ctype, content in parts:
+        body += "--%s\nContent-Type: %s\n\n%s\n" % (boundary, ctype, content)
+    body += "--%s--\nepilogue\n" % boundary
+    return 'multipart/%s; boundary="%s"' % (subtype, boundary), body
+
+
+class ReadEmailTest(unittest.TestCase):
+
+    def setUp(self):
+        # no configuration needed to read emails
+        self.smtp = smtp.SMTP.__new__(smtp.SMTP)
+        self.smtp.max_size = smtp.MAX_EMAIL_SIZE
+
+    def read(self, ctype, body):
+        email = "%sContent-Type: %s\n\n%s" % (HEADERS, ctype, body)
+        msg, content = self.smtp.read_email(StringIO(email))
+        self.assertEqual(msg['Subject'], 'help')
+        return content
+
+    def test_text(self):
+        self.assertEqual(self.read('text/plain', 'linux es\n'), 'linux es\n')
+
+    def test_first_text_part(self):
+        content = self.read(*multipart('b1', [
+            ('application/pdf', 'xxx'),
+            ('text/plain', 'linux'),
+            ('text/plain', 'windows'),
+        ]))
+        self.assertEqual(content, 'linux\n')
+
+    def test_plain_preferred_to_html(self):
+        content = self.read(*multipart('b1', [
+            ('text/html', '<p>windows</p>'),
+            ('text/plain', 'linux'),
+        ]))
+        self.assertEqual(content, 'linux\n')
+
+    def test_html_only(self):
+        content = self.read(*multipart('b1', [
+            ('image/png', 'xxx'),
+            ('text/html', '<p>linux</p>'),
+        ]))
+        self.assertEqual(content, '<p>linux</p>\n')
+
+    def test_nested_plain(self):
+        ctype, body = multipart('b2', [
+            ('text/plain', 'linux'),
+            ('text/html', '<p>linux</p>'),
+        ], 'alternative')
+        content = self.read(*multipart('b1', [
+            (ctype, body),
+            ('application/pdf', 'xxx'),
+        ]))
+        self.assertEqual(content, 'linux\n')
+
+    def test_nested_without_plain(self):
+        # the text/plain part after the nested multipart must be found
+        ctype, body = multipart('b2', [
+            ('text/html', '<p>windows</p>'),
+        ], 'alternative')
+        content = self.read(*multipart('b1', [
+            (ctype, body),
+            ('text/plain', 'linux'),
+        ]))
+        self.assertEqual(content, 'linux\n')
+
+    def test_no_text(self):
+        content = self.read(*multipart('b1', [
+            ('application/pdf', 'xxx'),
+        ]))
+        self.assertIsNone(content)
+
+    def test_max_size(self):
+        self.smtp.max_size = len(HEADERS) + 200
+        ctype, body = multipart('b1', [
+            ('application/pdf', 'x' * 1000),
+            ('text/plain', 'linux'),
+        ])
+        self.assertIsNone(self.read(ctype, body))
+
+
+
+class EmailServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='gettor-smtp-')
+        self.path = os.path.join(self.dir, 'gettor.sock')
+        self.replies = []
+
+        smtp_obj = smtp.SMTP.__new__(smtp.SMTP)
+        smtp_obj.max_size = smtp.MAX_EMAIL_SIZE
+        smtp_obj.log = logging.getLogger('test')
+        smtp_obj.reply_email = lambda msg, content: self.replies.append(
+            content
+        )
+        self.pool = workers.WorkerPool(1, 10, smtp_obj.log)
+        self.server = smtp.EmailServer(self.path, smtp_obj, self.pool)
+        t = threading.Thread(target=self.server.serve_forever, args=(0.05,))
+        t.daemon = True
+        t.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.pool.stop()
+        shutil.rmtree(self.dir)
+
+    def connect(self):
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.settimeout(5)
+        s.connect(self.path)
+        return s
+
+    def test_stalled_client(self):
+        # writes half an email and then nothing
+        stalled = self.connect()
+        stalled.sendall(HEADERS)
+
+        start = time.time()
+        s = self.connect()
+        s.sendall("%sContent-Type: text/plain\n\nlinux\n" % HEADERS)
+        s.shutdown(socket.SHUT_WR)
+        self.assertEqual(s.recv(16), 'OK\n')
+        self.assertLess(time.time() - start, 2)
+        s.close()
+
+        # the stalled email is handled once its connection is closed
+        self.pool.join()
+        self.assertEqual(self.replies, ['linux\n'])
+        stalled.close()
+
+
+class StubChannel(smtpd.SMTPChannel):
+    """SMTP session refusing recipients named 'bad'."""
+
+    def smtp_RCPT(self, arg):
+        if arg and 'bad@' in arg:
+            self.push('550 No such user')
+            return
+        smtpd.SMTPChannel.smtp_RCPT(self, arg)
+
+
+class StubSMTPServer(smtpd.SMTPServer):
+    """SMTP server keeping the emails received and its sessions."""
+
+    def __init__(self):
+        smtpd.SMTPServer.__init__(self, ('localhost', 0), None)
+        self.port = self.socket.getsockname()[1]
+        self.channels = []
+        self.received = []
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is not None:
+            self.channels.append(StubChannel(self, *pair))
+
+    def process_message(self, peer, mailfrom, rcpttos, data):
+        self.received.append((rcpttos, data))
+
+    def drop(self):
+        """Close every session, like a server timing out idle clients."""
+        for channel in self.channels:
+            channel.close()
+
+
+class SMTPPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubSMTPServer()
+        self.running = True
+        self.thread = threading.Thread(target=self.loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.pool.close()
+        self.running = False
+        self.thread.join()
+
+    def loop(self):
+        while self.running:
+            asyncore.loop(timeout=0.05, count=1)
+        asyncore.close_all()
+
+    def get_pool(self, max_messages=100, noop_interval=30):
+        self.pool = smtp.SMTPPool(
+            'localhost', self.server.port, 2, max_messages, noop_interval
+        )
+        return self.pool
+
+    def send(self, to_addr='user@example.org'):
+        self.pool.sendmail('gettor@example.org', to_addr, 'Subject: x\n\n.')
+
+    def test_reuse(self):
+        self.get_pool()
+        for i in range(5):
+            self.send()
+        self.assertEqual(len(self.server.received), 5)
+        self.assertEqual(len(self.server.channels), 1)
+
+    def test_noop_after_idle(self):
+        self.get_pool(noop_interval=0)
+        self.send()
+        self.send()
+        self.assertEqual(len(self.server.channels), 1)
+
+    def test_reconnect(self):
+        self.get_pool()
+        self.send()
+        self.server.drop()
+        time.sleep(0.2)
+        # the broken connection is replaced and the email sent anyway
+        self.send()
+        self.assertEqual(len(self.server.received), 2)
+        self.assertEqual(len(self.server.channels), 2)
+
+    def test_reconnect_after_noop(self):
+        self.get_pool(noop_interval=0)
+        self.send()
+        self.server.drop()
+        time.sleep(0.2)
+        self.send()
+        self.assertEqual(len(self.server.received), 2)
+        self.assertEqual(len(self.server.channels), 2)
+
+    def test_max_messages(self):
+        self.get_pool(max_messages=2)
+        for i in range(5):
+            self.send()
+        self.assertEqual(len(self.server.received), 5)
+        self.assertEqual(len(self.server.channels), 3)
+
+    def test_refused_recipient(self):
+        self.get_pool()
+        self.send()
+        self.assertRaises(
+            smtplib.SMTPRecipientsRefused, self.send, 'bad@example.org'
+        )
+        # the connection is still good and kept
+        self.send()
+        self.assertEqual(len(self.server.received), 2)
+        self.assertEqual(len(self.server.channels), 1)
+
+if __name__ == '__main__':
+    unittest.main()
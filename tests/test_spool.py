@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of GetTor, a Tor Browser distribution system.
+#
+# :authors: Israel Leiva <ilv@riseup.net>
+#           see also AUTHORS file
+#
+# :copyright:   (c) 2008-2015, The Tor Project, Inc.
+#               (c) 2015, Israel Leiva
+#
+# :license: This is Free Software. See LICENSE for license information.
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from gettor import spool
+
+"""Tests for the on-disk queue of outgoing emails."""
+
+# a translated reply, as the services build it (8-bit str)
+MSG = (
+    "From: GetTor <gettor@torproject.org>\n"
+    "To: usuario@example.com\n"
+    "Subject: [GetTor] Enlaces para Tor Browser\n\n"
+    "¡Hola! Estos son los enlaces que pediste. Año 2015, niño.\n"
+)
+
+
+class SpoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.dbname = os.path.join(self.tmpdir, 'spool.db')
+        self.spool = spool.Spool(self.dbname, 3, 60)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_non_ascii(self):
+        self.spool.add('gettor@torproject.org', 'niño@example.com', MSG)
+        batch = self.spool.claim(10)
+        self.assertEqual(len(batch), 1)
+        msg_id, from_addr, to_addr, msg = batch[0]
+        self.assertEqual(from_addr, 'gettor@torproject.org')
+        self.assertEqual(to_addr, 'niño@example.com')
+        self.assertEqual(msg, MSG)
+        self.assertTrue(isinstance(msg, str))
+
+        self.spool.sent(msg_id)
+        self.assertEqual(self.spool.count(), (0, 0))
+
+    def test_claim_leases(self):
+        self.spool.add('gettor@torproject.org', 'a@example.com', MSG)
+        self.assertEqual(len(self.spool.claim(10)), 1)
+        self.assertEqual(self.spool.claim(10), [])
+
+    def test_release(self):
+        self.spool.add('gettor@torproject.org', 'a@example.com', MSG)
+        batch = self.spool.claim(10)
+        self.spool.release([batch[0][0]])
+        self.assertEqual(self.spool.claim(10), batch)
+
+    def test_failed(self):
+        self.spool.add('gettor@torproject.org', 'niño@example.com', MSG)
+        msg_id = self.spool.claim(10)[0][0]
+
+        # retried later, not right away
+        self.assertTrue(self.spool.failed(msg_id, "451 niño: try again"))
+        self.assertEqual(self.spool.claim(10), [])
+        self.assertEqual(self.spool.count(), (1, 0))
+
+        self.assertFalse(
+            self.spool.failed(msg_id, "550 niño: no such user", True)
+        )
+        self.assertEqual(self.spool.count(), (0, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
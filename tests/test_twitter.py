@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of GetTor, a Tor Browser distribution system.
+#
+# :authors: Israel Leiva <ilv@riseup.net>
+#           see also AUTHORS file
+#
+# :copyright:   (c) 2008-2015, The Tor Project, Inc.
+#               (c) 2015, Israel Leiva
+#
+# :license: This is Free Software. See LICENSE for license information.
+
+import os
+import sys
+import time
+import logging
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from gettor import ratelimit
+
+try:
+    import tweepy
+    from gettor import twitter
+except ImportError:
+    twitter = None
+
+"""Tests for the sender of direct messages of the Twitter channel."""
+
+
+class Response(object):
+    """Answer of the API to a failed request."""
+
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class FakeAPI(object):
+    """Stand-in for the tweepy API, failing for the given recipients."""
+
+    def __init__(self, failing=()):
+        self.failing = failing
+        self.sent = []
+
+    def send_direct_message(self, user_id, text):
+        if user_id in self.failing:
+            raise tweepy.TweepError('Service unavailable', Response(503))
+        self.sent.append(user_id)
+
+
+@unittest.skipIf(twitter is None, "tweepy is not installed")
+class DMSenderTest(unittest.TestCase):
+
+    def sender(self, api, bucket):
+        return twitter.DMSender(
+            api, bucket, 100, 5, 60, 600, logging.getLogger('test')
+        )
+
+    def test_stop_doesnt_wait_for_tokens(self):
+        api = FakeAPI()
+        # two messages in a row, then one every 86 seconds
+        sender = self.sender(api, ratelimit.TokenBucket(1 / 86.4, 2))
+        for i in range(5):
+            sender.send(str(i), 'reply')
+
+        start = time.time()
+        sender.start()
+        sender.stop()
+        self.assertLess(time.time() - start, 2)
+
+        self.assertEqual(api.sent, ['0', '1'])
+        stats = sender.stats()
+        self.assertEqual(stats['sent'], 2)
+        self.assertEqual(stats['dropped'], 3)
+        self.assertEqual(stats['queued'], 0)
+
+    def test_stop_drops_retries(self):
+        api = FakeAPI(failing=('0',))
+        sender = self.sender(api, ratelimit.TokenBucket(1, 10))
+        sender.send('0', 'reply')
+        sender.send('1', 'reply')
+
+        start = time.time()
+        sender.start()
+        sender.stop()
+        self.assertLess(time.time() - start, 2)
+
+        self.assertEqual(api.sent, ['1'])
+        stats = sender.stats()
+        self.assertEqual(stats['retried'], 1)
+        self.assertEqual(stats['dropped'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+#!/usr/bin/python
+#
+# Dummy script to test the replies sender of GetTor's Twitter module
+# against a fake Twitter API.
+#
+# The fake API rejects some messages with 429 and 503 errors, like the real
+# one does when we go over its limits, and every message should be sent
+# anyway. Retries are sent later, so the other messages don't wait for them.
+#
+
+import time
+import logging
+
+import tweepy
+
+import gettor.ratelimit
+import gettor.twitter
+
+MESSAGES = 50
+
+
+class Response(object):
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class FakeAPI(object):
+    """Stand-in for tweepy.API, failing every few messages."""
+
+    def __init__(self):
+        self.calls = 0
+        self.sent = []
+
+    def send_direct_message(self, user_id, text):
+        self.calls += 1
+        if self.calls % 7 == 0:
+            raise tweepy.TweepError("Rate limit exceeded", Response(429))
+        if self.calls % 11 == 0:
+            raise tweepy.TweepError("Service unavailable", Response(503))
+        self.sent.append((user_id, text))
+
+
+logging.basicConfig()
+log = logging.getLogger('twitter_demo')
+
+api = FakeAPI()
+# 100 messages per second, 10 in a row
+bucket = gettor.ratelimit.TokenBucket(100, 10)
+sender = gettor.twitter.DMSender(api, bucket, 100, 5, 0.05, 1, log)
+
+start = time.time()
+sender.start()
+for i in range(MESSAGES):
+    sender.send(str(i), 'reply %d' % i)
+print "Queued: %s" % sender.stats()
+# stop() drops the messages that can't be sent right away
+while sender.stats()['queued']:
+    time.sleep(0.01)
+sender.stop()
+elapsed = time.time() - start
+
+print "Done: %s" % sender.stats()
+print "%d messages sent with %d API calls in %.2f seconds" % (
+    len(api.sent), api.calls, elapsed
+)
+print "All messages sent: %s" % (
+    sorted(int(m[0]) for m in api.sent) == range(MESSAGES)
+)
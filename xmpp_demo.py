@@ -0,0 +1,71 @@
+#!/usr/bin/python
+#
+# Dummy script to test GetTor's XMPP module without an XMPP server.
+#
+# A stand-in stream sends messages from several accounts to the workers
+# of the XMPP module, just like the bot does, and checks the replies.
+#
+
+import sys
+import time
+import threading
+
+import gettor.xmpp
+
+ACCOUNTS = 20
+MESSAGES = 10
+REQUESTS = ['help', 'linux', 'windows', 'osx', 'mirrors']
+
+
+class Stream(object):
+    """Stand-in for the XMPP stream of the bot."""
+
+    def __init__(self, xmpp):
+        self.xmpp = xmpp
+        self.replies = {}
+        self.accepted = {}
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+    def send(self, account, body):
+        """Send a message from account, as Bot.message() would."""
+        user = account.split('/')[0]
+
+        def reply(msg_to_send):
+            with self.lock:
+                self.replies.setdefault(user, []).append(body)
+
+        if self.xmpp.dispatch(account, body, reply):
+            self.accepted.setdefault(user, []).append(body)
+        else:
+            self.dropped += 1
+
+
+try:
+    xmpp = gettor.xmpp.XMPP(sys.argv[1] if len(sys.argv) > 1 else None)
+    # don't blacklist our fake accounts
+    xmpp.bl_max_req = MESSAGES + 1
+    stream = Stream(xmpp)
+
+    start = time.time()
+    xmpp.start_workers()
+    for i in range(MESSAGES):
+        for j in range(ACCOUNTS):
+            account = 'user%d@example.com/res%d' % (j, i)
+            stream.send(account, REQUESTS[(i + j) % len(REQUESTS)])
+    xmpp.stop_workers()
+    elapsed = time.time() - start
+
+    # messages from the same user must be answered in order, whatever
+    # resource they come from (dropped messages aren't answered)
+    in_order = stream.replies == stream.accepted
+
+    replies = sum(len(r) for r in stream.replies.values())
+    print "%d messages, %d replies, %d dropped in %.2f seconds" % (
+        ACCOUNTS * MESSAGES, replies, stream.dropped, elapsed
+    )
+    print "Replies in order for every account: %s" % in_order
+except gettor.xmpp.ConfigError as e:
+    print "Misconfiguration: " + str(e)
+except gettor.xmpp.InternalError as e:
+    print "Internal error: " + str(e)